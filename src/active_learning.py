@@ -0,0 +1,266 @@
+"""
+Active learning generation of training sets.
+
+Rather than simulating uniformly over the prior and finding out afterwards where the network
+is weak, active_learner alternates between training a network on the spectra simulated so far
+and simulating more where that network is worst:
+    1. A uniform initial batch is simulated with looper, along with two fixed uniform sets: a
+       probe set, whose errors locate the weak regions, and a validation set to report on.
+    2. Every round, a network is trained on all spectra so far and its squared error on the
+       probe set is measured. The error at any parameter set is estimated as the mean error of
+       its k nearest probe spectra in the (normalized) label space.
+    3. Candidates are drawn from the prior with generator.draw_parameters, and the ones to
+       simulate are resampled with probability proportional to a = (1-mix)*error/mean + mix.
+    4. Every selected spectrum gets the importance weight 1/a, so the weighted training loss is
+       an unbiased estimate of the loss over the prior; mix bounds the weights by 1/mix.
+The inputs, labels and weights are saved to work_dir every round, shuffled together so the rows
+selected in the last rounds do not all end up at the end, along with the uniform validation set
+(validation_inputs.npy and validation_labels.npy, for the val_inputs and val_labels of
+best_simulation.py) and a csv history of the number of simulations against the validation error. Running with mix = 1 gives the uniform
+baseline to compare against.
+"""
+import os
+import csv
+import random
+import numpy as np
+
+def knn_error(reference_labels, reference_errors, candidates, k = 10, chunk_rows = 4096):
+    """
+    Estimates the error at candidate parameter sets as the mean error of their k nearest
+    reference points.
+
+    Parameters
+    -------
+    reference_labels : np.ndarray
+        (P, 6) normalized labels of the reference (probe) spectra.
+    reference_errors : np.ndarray
+        (P,) errors of the network on them.
+    candidates : np.ndarray
+        (M, 6) normalized labels to estimate the error at.
+    k : int
+        Number of neighbours.
+    chunk_rows : int
+        Candidates compared at a time, bounding the memory to chunk_rows*P distances.
+
+    Returns
+    -------
+    errors : np.ndarray
+        (M,) estimated errors.
+    """
+    reference_labels = np.asarray(reference_labels, dtype = np.float64)
+    reference_errors = np.asarray(reference_errors, dtype = np.float64)
+    candidates = np.asarray(candidates, dtype = np.float64)
+    if reference_labels.shape[0] != reference_errors.shape[0]:
+        raise ValueError("Need one error per reference point!")
+    k = min(k, reference_labels.shape[0])
+    reference_sq = (reference_labels**2).sum(axis = 1)
+    errors = np.empty(candidates.shape[0])
+    for start in range(0, candidates.shape[0], chunk_rows):
+        chunk = candidates[start:start+chunk_rows]
+        distances = (chunk**2).sum(axis = 1)[:, None] - 2*chunk @ reference_labels.T + reference_sq
+        nearest = np.argpartition(distances, k-1, axis = 1)[:, :k]
+        errors[start:start+chunk_rows] = reference_errors[nearest].mean(axis = 1)
+    return errors
+
+def shuffle_rows(rng, *arrays):
+    """
+    Applies one random permutation to the rows of every array, keeping them aligned.
+
+    Returns
+    -------
+    shuffled : list
+        The permuted arrays.
+    """
+    permutation = rng.permutation(len(arrays[0]))
+    return [np.asarray(array)[permutation] for array in arrays]
+
+def acquisition(errors, mix = 0.2):
+    """
+    Turns estimated errors into selection probabilities and importance weights.
+
+    Parameters
+    -------
+    errors : np.ndarray
+        Estimated errors of candidates drawn from the prior.
+    mix : float
+        Fraction of uniform sampling mixed in, between 0 (exclusive) and 1. 1 samples uniformly.
+
+    Returns
+    -------
+    probabilities : np.ndarray
+        Selection probability of every candidate.
+    weights : np.ndarray
+        Importance weight of every candidate if selected.
+    """
+    if not 0 < mix <= 1:
+        raise ValueError("mix needs to be between 0 and 1!")
+    errors = np.asarray(errors, dtype = np.float64)
+    mean = errors.mean()
+    relative = errors/mean if mean > 0 else np.ones(len(errors))
+    a = (1-mix)*relative + mix
+    return a/a.sum(), 1/a
+
+def select(errors, n, mix = 0.2, rng = None):
+    """
+    Resamples n candidates with acquisition probabilities (with replacement, so the weights
+    stay exact).
+
+    Returns
+    -------
+    chosen : np.ndarray
+        Indices of the chosen candidates.
+    weights : np.ndarray
+        Their importance weights.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    probabilities, weights = acquisition(errors, mix)
+    chosen = rng.choice(len(probabilities), size = n, replace = True, p = probabilities)
+    return chosen, weights[chosen]
+
+class active_learner:
+    def __init__(self, gen, work_dir, hparams = None, epochs = 50, mix = 0.2, k = 10, candidates_per_sample = 20,
+                 seed = None):
+        """
+        Parameters
+        -------
+        gen : generator
+            Generator simulating the spectra, e.g. with a spectra_cache attached.
+        work_dir : str
+            Directory the dataset, weights and history are saved to.
+        hparams : dict
+            Network hyperparameters, overriding hyper_search.default_hparams.
+        epochs : int
+            Epochs the network is trained for every round.
+        mix : float
+            Fraction of uniform sampling, see acquisition.
+        k : int
+            Neighbours of the error estimate.
+        candidates_per_sample : int
+            Candidates drawn from the prior for every spectrum simulated.
+        seed : int
+            Seed of the parameter draws and selection. Also seeds gen if it has no seed, so
+            repeated runs reuse its cached spectra.
+        """
+        from src.hyper_search import default_hparams
+        self.gen = gen
+        self.work_dir = work_dir
+        self.hparams = dict(default_hparams, **(hparams or {}))
+        self.epochs = epochs
+        self.mix = mix
+        self.k = k
+        self.candidates_per_sample = candidates_per_sample
+        self.rng = np.random.default_rng(seed)
+        if seed is not None:
+            random.seed(seed)
+            if gen.seed is None:
+                gen.seed = seed
+        self.inputs = []
+        self.labels = []
+        self.weights = []
+        self.simulations = 0
+        self.history = []
+        if not os.path.exists(work_dir):
+            os.makedirs(work_dir)
+
+    def __uniform(self, n):
+        answers, inputs, uncertainties = self.gen.looper(n)
+        self.simulations += n
+        return np.asarray(inputs, dtype = np.float64), np.asarray(answers, dtype = np.float64)
+
+    def __train(self):
+        """
+        Trains a new network on all spectra so far, with their importance weights.
+        """
+        import tensorflow as tf
+        from src.hyper_search import build_model
+        inputs = np.concatenate(self.inputs)
+        labels = np.concatenate(self.labels)
+        weights = np.concatenate(self.weights)
+        norm = tf.keras.layers.experimental.preprocessing.Normalization()
+        norm.adapt(inputs)
+        dnn_model = build_model(self.hparams, norm)
+        dnn_model.fit(inputs, labels, sample_weight = weights, batch_size = self.hparams["batch_size"],
+                      epochs = self.epochs, shuffle = True, verbose = 0)
+        return dnn_model
+
+    def __errors(self, dnn_model, inputs, labels):
+        predictions = dnn_model.predict(inputs, batch_size = 1024, verbose = 0)
+        return ((predictions - labels)**2).mean(axis = 1)
+
+    def __save(self, validation_inputs, validation_labels):
+        inputs, labels, weights = shuffle_rows(self.rng, np.concatenate(self.inputs), np.concatenate(self.labels),
+                                               np.concatenate(self.weights))
+        np.save(os.path.join(self.work_dir, "inputs.npy"), inputs)
+        np.save(os.path.join(self.work_dir, "labels.npy"), labels)
+        np.save(os.path.join(self.work_dir, "weights.npy"), weights)
+        np.save(os.path.join(self.work_dir, "validation_inputs.npy"), validation_inputs)
+        np.save(os.path.join(self.work_dir, "validation_labels.npy"), validation_labels)
+        with open(os.path.join(self.work_dir, "history.csv"), "w", newline = "") as f:
+            writer = csv.DictWriter(f, fieldnames = list(self.history[0]))
+            writer.writeheader()
+            writer.writerows(self.history)
+        return
+
+    def run(self, n_initial, n_rounds, n_per_round, n_probe = 500, n_validation = 1000):
+        """
+        Runs the active learning loop.
+
+        Parameters
+        -------
+        n_initial : int
+            Spectra in the uniform initial batch.
+        n_rounds : int
+            Number of rounds of selection.
+        n_per_round : int
+            Spectra selected every round.
+        n_probe : int
+            Uniform spectra whose errors guide the selection.
+        n_validation : int
+            Uniform spectra the validation error is reported on.
+
+        Returns
+        -------
+        history : list
+            One dict per round with the number of simulations (including the probe and
+            validation sets), the training set size and the validation mse and mae.
+        """
+        probe_inputs, probe_labels = self.__uniform(n_probe)
+        validation_inputs, validation_labels = self.__uniform(n_validation)
+        inputs, labels = self.__uniform(n_initial)
+        self.inputs.append(inputs)
+        self.labels.append(labels)
+        self.weights.append(np.ones(len(labels)))
+        for round_number in range(n_rounds + 1):
+            dnn_model = self.__train()
+            predictions = dnn_model.predict(validation_inputs, batch_size = 1024, verbose = 0)
+            weights = np.concatenate(self.weights)
+            self.history.append({"round": round_number, "simulations": self.simulations, "rows": len(weights),
+                                 "val_mse": float(((predictions - validation_labels)**2).mean()),
+                                 "val_mae": float(np.abs(predictions - validation_labels).mean()),
+                                 "max_weight": float(weights.max())})
+            print("Round " + str(round_number) + ": " + str(self.simulations) + " simulations, validation mse "
+                  + str(round(self.history[-1]["val_mse"], 6)))
+            self.__save(validation_inputs, validation_labels)
+            if round_number == n_rounds:
+                break
+            #Estimates the error over candidates from the prior and simulates where it is largest
+            proposals = self.gen.draw_parameters(n_per_round*self.candidates_per_sample)
+            candidates = np.array([proposal[-1] for proposal in proposals])
+            errors = knn_error(probe_labels, self.__errors(dnn_model, probe_inputs, probe_labels), candidates, self.k)
+            chosen, chosen_weights = select(errors, n_per_round, self.mix, self.rng)
+            answers, new_inputs, uncertainties, kept = self.gen.simulate([proposals[i] for i in chosen])
+            self.simulations += len(chosen)
+            if not kept:
+                continue
+            self.inputs.append(np.asarray(new_inputs, dtype = np.float64))
+            self.labels.append(np.asarray(answers, dtype = np.float64))
+            self.weights.append(chosen_weights[kept])
+        return self.history
+
+#Run Script:
+##from src.spectra_generator import generator, rmf_list, arf_list
+##learner = active_learner(generator(rmf_list, arf_list), "active", epochs = 50, seed = 1)
+##history = learner.run(n_initial = 2000, n_rounds = 10, n_per_round = 1000)
+##Uniform baseline with the same budget:
+##baseline = active_learner(generator(rmf_list, arf_list), "uniform", epochs = 50, mix = 1, seed = 1)
+##history = baseline.run(n_initial = 2000, n_rounds = 10, n_per_round = 1000)
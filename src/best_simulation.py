@@ -1,136 +1,141 @@
-import tensorflow as tf
-from tensorflow.keras import layers
-from tensorflow.keras import losses
-from tensorflow.keras import preprocessing
-import matplotlib.pyplot as plt
-import numpy as np
-import pickle
+"""
+Fits a neural network to simulated spectra.
+Run with `python -m src.cli train simulation [--config file.json] [--set name=value ...]`.
+"""
 import os
-import math
+import pickle
 import datetime
-import itertools
-import copy
-import random
-#HYPERPARAMETERS:
-initial_learning_rate = 0.0001
-n_neurons = 1024
-h_neurons = 512
-h2_neurons = 256
-h3_neurons = 1024
-h4_neurons = 1024
-h5_neurons = 512
-h6_neurons = 512
-h7_neurons = 256
-drp_rate1 = 0.2
-drp_rate2 = 0.2
-drp_rate3 = 0.2
-drp_rate4 = 0.1
-drp_rate5 = 0.1
-drp_rate6 = 0.1
-drp_rate7 = 0.1
-recycle_number = 3
-#Parameters
-epochs = 1000
-batch_size = 32
-validation_split = .2
-
-#Changes Working Directory to Right Place
-os.chdir("/home/mailingliam/Computational_Project")
-# Prepare a directory to store all the checkpoints.
-checkpoint_dir = "./ckpt"
-if not os.path.exists(checkpoint_dir):
-    os.makedirs(checkpoint_dir)
-###Loads inputs and outputs
-inputs_test = pickle.load(open("inputs","rb")) #List of Lists of [energies, rates, rmf_number, arf_number, exposure_time]
-print("Test Inputs Loaded")
-labels_test = pickle.load(open("answers","rb")) #List of Lists of [mass, dist, logmdot, astar, cosi, redshift]
-print("Test Labels Loaded")
-test_data_np = np.asarray(inputs_test) #Curently not recycled, should maybe test?
-test_labels_np = np.asarray(labels_test)
-
-##input_memmap = np.load("inputs1to15.npy", mmap_mode="r")
-##label_memmap = np.load("labels1to15.npy", mmap_mode="r")
-
-#Validation Maps:
-input_memmap = np.load("megacleansedinputs.npy", mmap_mode="r")
-label_memmap = np.load("megacleansedlabels.npy", mmap_mode="r")
-
-print("Compiling")
-
-def build_and_compile_fit_model(norm):
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers
+from src.throughput import throughput_monitor
+from src.compression import basis_path, load_basis, projection_layer
+
+default_config = {
+    #HYPERPARAMETERS:
+    "initial_learning_rate": 0.0001,
+    "n_neurons": 1024,
+    "h_neurons": 512,
+    "h2_neurons": 256,
+    "drp_rate2": 0.2,
+    "drp_rate3": 0.2,
+    "drp_rate4": 0.1,
+    #Parameters
+    "epochs": 1000,
+    "batch_size": 32,
+    #Principal components the spectra are projected onto in front of the dense stack, 0 for
+    #the full inputs (the basis is read from <train_inputs>.pca.npz, see compression.py)
+    "pca_components": 0,
+    "validation_split": .2, #Used when val_inputs and val_labels are not given
+    #Files, relative to work_dir
+    "work_dir": "/home/mailingliam/Computational_Project",
+    "test_inputs": "inputs", #List of Lists of [energies, rates, rmf_number, arf_number, exposure_time]
+    "test_labels": "answers", #List of Lists of [mass, dist, logmdot, astar, cosi, redshift]
+    "train_inputs": "megacleansedinputs.npy",
+    "train_labels": "megacleansedlabels.npy",
+    "train_weights": None, #Optional .npy of per row importance weights, e.g. from active_learning.py
+    "val_inputs": None, #Optional validation .npy files, e.g. the uniform validation set of active_learning.py
+    "val_labels": None,
+    "checkpoint": "./ckpt_simbest_v2",
+    "log_dir": "logs/fit/",
+    "plots_dir": "plots",
+    }
+
+def build_and_compile_fit_model(norm, config, input_memmap, label_memmap, callbacks, weights = None, validation_data = None):
     dnn_model = tf.keras.Sequential([
         norm,
-##        layers.Dropout(drp_rate1),
-        layers.Dense(n_neurons,activation='relu', kernel_regularizer=tf.keras.regularizers.L2(0.00005)),# input_shape = (batch_size,1993,), 
-        layers.Dropout(drp_rate2),
-        layers.Dense(h_neurons, activation = 'relu', kernel_regularizer= tf.keras.regularizers.L2(0.00005)),
-        layers.Dropout(drp_rate3),
-        layers.Dense(h2_neurons, activation = 'relu', kernel_regularizer= tf.keras.regularizers.L2(0.00005)),
-        layers.Dropout(drp_rate4),
-##        layers.Dense(h3_neurons, activation = 'relu', kernel_regularizer= tf.keras.regularizers.L2(0.00005)),
-##        layers.Dropout(drp_rate5),
-##        layers.Dense(h4_neurons, activation = 'relu', kernel_regularizer= tf.keras.regularizers.L2(0.00005)),
-##        layers.Dropout(drp_rate5),
-##        layers.Dense(h5_neurons, activation = 'relu', kernel_regularizer= tf.keras.regularizers.L2(0.00005)),
-##        layers.Dropout(drp_rate6),
-##        layers.Dense(h6_neurons, activation = 'relu', kernel_regularizer= tf.keras.regularizers.L2(0.00005)),
-##        layers.Dropout(drp_rate7),
-##        layers.Dense(h7_neurons, activation = 'relu'),
-        layers.Dense(6)#, activation = 'sigmoid')
+        layers.Dense(config["n_neurons"],activation='relu', kernel_regularizer=tf.keras.regularizers.L2(0.00005)),
+        layers.Dropout(config["drp_rate2"]),
+        layers.Dense(config["h_neurons"], activation = 'relu', kernel_regularizer= tf.keras.regularizers.L2(0.00005)),
+        layers.Dropout(config["drp_rate3"]),
+        layers.Dense(config["h2_neurons"], activation = 'relu', kernel_regularizer= tf.keras.regularizers.L2(0.00005)),
+        layers.Dropout(config["drp_rate4"]),
+        layers.Dense(6)
         ])
 
     dnn_model.compile(loss = 'mean_squared_error',
-              optimizer = tf.keras.optimizers.Adam(learning_rate = initial_learning_rate),
+              optimizer = tf.keras.optimizers.Adam(learning_rate = config["initial_learning_rate"]),
               metrics = [tf.keras.metrics.MeanAbsoluteError()])
     dnn_model.summary()
     history = dnn_model.fit(
-        input_memmap, label_memmap,
-        validation_split = 0.2,
-        verbose = 2, epochs = epochs, shuffle = True,
+        input_memmap, label_memmap, sample_weight = weights,
+        validation_split = 0 if validation_data is not None else config["validation_split"],
+        validation_data = validation_data, batch_size = config["batch_size"],
+        verbose = 2, epochs = config["epochs"], shuffle = True,
         callbacks = callbacks)
     return history, dnn_model
 
+def main(config):
+    """
+    Trains, evaluates and saves the network described by config.
+
+    Parameters
+    -------
+    config : dict
+        Overrides of default_config.
+
+    Returns
+    -------
+    history : tf.keras.callbacks.History
+    dnn_model : tf.keras.Sequential
+    """
+    config = dict(default_config, **config)
+    #Changes Working Directory to Right Place
+    os.chdir(config["work_dir"])
+    ###Loads inputs and outputs
+    with open(config["test_inputs"], "rb") as f:
+        test_data_np = np.asarray(pickle.load(f))
+    print("Test Inputs Loaded")
+    with open(config["test_labels"], "rb") as f:
+        test_labels_np = np.asarray(pickle.load(f))
+    print("Test Labels Loaded")
+    input_memmap = np.load(config["train_inputs"], mmap_mode="r")
+    label_memmap = np.load(config["train_labels"], mmap_mode="r")
+
+    #Defines Callbacks (Saves Model)
+    log_dir = config["log_dir"] + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    callbacks = [
+        tf.keras.callbacks.ModelCheckpoint(
+            filepath = config["checkpoint"], save_best_only = True,
+            monitor = "val_loss"
+            ),
+        tf.keras.callbacks.TensorBoard(log_dir=log_dir, histogram_freq=1),
+        tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5,
+                                  patience=30, min_lr=0.0000000005),
+        tf.keras.callbacks.EarlyStopping(monitor = 'val_loss', patience = 150),
+        #Input wait vs compute time per epoch, summarize with python -m src.throughput
+        throughput_monitor(config["batch_size"], log_path = log_dir + "/throughput.csv")
+        ]
+
+    print("Compiling")
+    if config["pca_components"]:
+        #Fixed projection onto the principal components, which also standardizes the inputs
+        normalizer = projection_layer(load_basis(basis_path(config["train_inputs"])), config["pca_components"])
+    else:
+        #Defines Normalizing Layer
+        normalizer = layers.experimental.preprocessing.Normalization()
+        #Adapts the Normalizing Layer to the Data (so it can normalize appropriately)
+        normalizer.adapt(input_memmap)
+    print("Time to Fit!")
+    weights = None if config["train_weights"] is None else np.load(config["train_weights"], mmap_mode="r")
+    validation_data = None
+    if config["val_inputs"] is not None and config["val_labels"] is not None:
+        validation_data = (np.load(config["val_inputs"], mmap_mode="r"), np.load(config["val_labels"], mmap_mode="r"))
+    history, dnn_model = build_and_compile_fit_model(normalizer, config, input_memmap, label_memmap, callbacks, weights,
+                                                     validation_data)
+
+    results = dnn_model.evaluate(test_data_np, test_labels_np, verbose=0)
+    print("test loss, test acc:", results)
+    with open('loss', "wb") as f:
+        pickle.dump(history.history['loss'], f)
+    with open('val_loss', "wb") as f:
+        pickle.dump(history.history['val_loss'], f)
+
+    with open(os.path.join(config["plots_dir"], "captains_log.txt"), "a") as f:
+        f.write("\n")
+        f.write("["+str(config["initial_learning_rate"])+", "+ str([config["n_neurons"],config["h_neurons"],config["h2_neurons"]])+", "
+                + str([config["drp_rate2"],config["drp_rate3"]])+", "+ str(config["batch_size"])+", "+str(config["epochs"])+"]")
+    return history, dnn_model
 
-#Defines Callbacks (Saves Model)
-
-log_dir = "logs/fit/" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-
-callbacks = [
-    tf.keras.callbacks.ModelCheckpoint(
-        filepath = checkpoint_dir+"_simbest_v2", save_best_only = True,  #Changed from Best, may cause a problem?
-        monitor = "val_loss"
-        ),
-    tf.keras.callbacks.TensorBoard(log_dir=log_dir, histogram_freq=1),
-    tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5,
-                              patience=30, min_lr=0.0000000005),
-    tf.keras.callbacks.EarlyStopping(monitor = 'val_loss', patience = 150)
-    ]
-
-#Defines Normalizing Layer
-normalizer = layers.experimental.preprocessing.Normalization()
-#Adapts the Normalizing Layer to the Data (so it can normalize appropriately)
-normalizer.adapt(input_memmap)
-print("Time to Fit!")
-history, dnn_model = build_and_compile_fit_model(normalizer)
-
-results = dnn_model.evaluate(test_data_np, test_labels_np, verbose=0)
-predictions = dnn_model.predict(test_data_np)
-print("test loss, test acc:", results)
-acc = history.history['mean_absolute_error']
-val_acc = history.history['val_mean_absolute_error']
-loss = history.history['loss']
-val_loss = history.history['val_loss']
-
-with open('loss', "wb") as f:
-    pickle.dump(loss, f)
-with open('val_loss', "wb") as f:
-    pickle.dump(val_loss, f)
-
-
-
-os.chdir("/home/mailingliam/Computational_Project/plots")
-f = open("captains_log.txt","a")
-f.write("\n")
-f.write("["+str(initial_learning_rate)+", "+ str([n_neurons,h_neurons,h2_neurons])+", " + str([drp_rate2,drp_rate3])+", "+
-        str(batch_size)+", "+str(epochs)+"]")
-f.close()
+if __name__ == "__main__":
+    main({})
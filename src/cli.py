@@ -0,0 +1,311 @@
+"""
+Command line entry point for the whole pipeline:
+    python -m src.cli generate --iterations 300 --number 16
+    python -m src.cli merge --inputs inputs1 inputs2 --labels label1 label2 --out-inputs in.npy --out-labels lab.npy
+    python -m src.cli augment --inputs inputs15 --labels answers15 --out-inputs realinput15.npy --out-labels reallabels15.npy
+    python -m src.cli train real_world --config real_world.json --set epochs=10
+    python -m src.cli train real_world --config real_world.json --workers 4
+    python -m src.cli predict --model ckpt_looper --inputs real_inputs.npy --output predictions.npy
+    python -m src.cli predict --model ckpt_looper --inputs real_inputs.npy --output predictions.npy --samples 30
+    python -m src.cli evaluate --predictions predictions.npy --labels labels.npy --inputs inputs.npy --output residuals.npz
+    python -m src.cli bench --kind mirrored --workers 1 2 4
+    python -m src.cli compress --inputs inputs.npy --components 128 --output inputs_pca128.npy
+    python -m src.cli validate --inputs inputs.npy --labels labels.npy
+    python -m src.cli index --labels labels.npy --inputs inputs.npy --range astar=0.9: cosi=:0.2
+
+XSPEC, TensorFlow and matplotlib are only imported by the subcommands that use them, so this
+module and --help load in a fraction of a second. Settings come from flags, or for training
+from a JSON config file whose keys override the script's default_config.
+"""
+import json
+import argparse
+
+def parse_overrides(pairs):
+    """
+    Parses name=value pairs, reading each value as JSON where possible.
+
+    Parameters
+    -------
+    pairs : list
+        Strings of the form name=value.
+
+    Returns
+    -------
+    overrides : dict
+    """
+    overrides = {}
+    for pair in pairs or []:
+        if "=" not in pair:
+            raise ValueError("Overrides need to be of the form name=value, got " + pair)
+        name, value = pair.split("=", 1)
+        try:
+            overrides[name] = json.loads(value)
+        except json.JSONDecodeError:
+            overrides[name] = value
+    return overrides
+
+def load_config(path, pairs):
+    """
+    Reads a JSON config file (if given) and applies name=value overrides on top.
+
+    Returns
+    -------
+    config : dict
+    """
+    config = {}
+    if path is not None:
+        with open(path) as f:
+            config = json.load(f)
+    config.update(parse_overrides(pairs))
+    return config
+
+def generate(args):
+    from src.spectra_generator import generator, rmf_list, arf_list
+    gen = generator(rmf_list, arf_list)
+    gen.test = args.test
+    gen.seed = args.seed
+    if args.cache_dir is not None:
+        from src.spectra_cache import spectra_cache
+        gen.cache = spectra_cache(args.cache_dir, max_bytes = args.cache_mb*1024**2)
+    answers, inputs, uncertainties = gen.looper(args.iterations)
+    #looper gives [energy_err, rate_err, modvals] per spectrum, saver takes one list of each
+    gen.saver(answers, inputs, [list(column) for column in zip(*uncertainties)], args.number)
+    return
+
+def merge(args):
+    from src.saver import merge
+    print(str(merge(args.inputs, args.labels, args.out_inputs, args.out_labels)) + " rows written")
+    return
+
+def augment(args):
+    from src.saver import augment
+    print(str(augment(args.inputs, args.labels, args.out_inputs, args.out_labels, args.recycle)) + " rows written")
+    return
+
+def worker_arguments(args):
+    """
+    Command line of one process of `train real_world --workers N`: the same training, with the
+    multi_worker strategy and without --workers.
+    """
+    arguments = ["-m", "src.cli", "train", args.script]
+    if args.config is not None:
+        arguments += ["--config", args.config]
+    for pair in (args.set or []) + ["strategy=\"multi_worker\""]:
+        arguments += ["--set", pair]
+    return arguments
+
+def train(args):
+    if args.workers > 1:
+        if args.script != "real_world":
+            raise ValueError("--workers is only supported by real_world!")
+        from src.distributed import launch_local_workers
+        #Each worker gets its TF_CONFIG, the chief's output is the run's
+        print(launch_local_workers(worker_arguments(args), args.workers)[0], end = "")
+        return
+    config = load_config(args.config, args.set)
+    if args.script == "simulation":
+        from src.best_simulation import main
+    else:
+        from src.best_real_world import main
+    main(config)
+    return
+
+def predict(args):
+    import numpy as np
+    import tensorflow as tf
+    inputs = np.load(args.inputs, mmap_mode = "r")
+    if args.samples > 1 or len(args.model) > 1:
+        from src.uncertainty import load_ensemble, predict_with_uncertainty
+        prefix = args.output[:-len(".npy")] if args.output.endswith(".npy") else args.output
+        predict_with_uncertainty(load_ensemble(args.model), inputs, args.samples, args.micro_batch,
+                                 (args.lower, args.upper), prefix)
+        print(str(inputs.shape[0]) + " predictions written to " + prefix + "_{mean,std,lower,upper}.npy")
+        return
+    dnn_model = tf.keras.models.load_model(args.model[0])
+    predictions = np.lib.format.open_memmap(args.output, mode = "w+", dtype = np.float32, shape = (inputs.shape[0], 6))
+    for start in range(0, inputs.shape[0], args.chunk_rows):
+        predictions[start:start+args.chunk_rows] = dnn_model.predict(inputs[start:start+args.chunk_rows],
+                                                                      batch_size = args.batch_size, verbose = 0)
+    predictions.flush()
+    print(str(inputs.shape[0]) + " predictions written to " + args.output)
+    return
+
+def evaluate(args):
+    from src.evaluation import evaluate, residual_accumulator
+    accumulator = evaluate(args.predictions, args.labels, args.inputs, args.processes, label_bins = args.bins)
+    for path in args.merge or []:
+        accumulator.merge(residual_accumulator.load(path))
+    print(accumulator.report())
+    if args.output is not None:
+        accumulator.save(args.output)
+    return
+
+def bench(args):
+    if args.throughput_log is not None:
+        from src.throughput import summarize
+        print(summarize(args.throughput_log))
+        return
+    from src.distributed import scaling_benchmark
+    scaling_benchmark(args.kind, args.workers, args.steps, args.batch)
+    return
+
+def compress(args):
+    import os
+    from src.compression import basis_path, fit_basis, load_basis, explained_variance, transform_dataset
+    path = basis_path(args.inputs)
+    if args.refit or not os.path.exists(path):
+        basis = fit_basis(args.inputs)
+        print("Basis written to " + path)
+    else:
+        basis = load_basis(path)
+    print(str(args.components) + " components keep " + str(round(100*explained_variance(basis, args.components), 3)) + "% of the variance")
+    if args.output is not None:
+        print(str(transform_dataset(args.inputs, args.output, basis, args.components)) + " rows written")
+    return
+
+def validate(args):
+    import sys
+    from src.validation import validate, format_report, is_valid
+    from src.spectra_generator import generator, rmf_list, arf_list
+    report = validate(args.inputs, args.labels, generator(rmf_list, arf_list), not args.unnormalized,
+                      args.processes, max_rows = args.max_rows)
+    print(format_report(report))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f)
+    if not is_valid(report):
+        sys.exit(1)
+    return
+
+def parse_bounds(pairs):
+    """
+    Parses name=low:high pairs into {name: (low, high)}, either side of the colon may be empty.
+    """
+    bounds = {}
+    for pair in pairs or []:
+        if "=" not in pair or ":" not in pair:
+            raise ValueError("Ranges need to be of the form name=low:high, got " + pair)
+        name, value = pair.split("=", 1)
+        low, high = value.split(":", 1)
+        bounds[name] = (float(low) if low else None, float(high) if high else None)
+    return bounds
+
+def index(args):
+    import os
+    import time
+    from src.param_index import param_index, build_index, index_path
+    directory = index_path(args.labels)
+    if args.rebuild or not os.path.exists(directory):
+        from src.spectra_generator import generator, rmf_list, arf_list
+        if args.inputs is None:
+            raise ValueError("--inputs is needed to build the index!")
+        build_index(args.labels, args.inputs, generator(rmf_list, arf_list))
+        print("Index written to " + directory)
+    if args.range is None:
+        return
+    start = time.perf_counter()
+    rows = param_index(directory).range_query(parse_bounds(args.range))
+    print(str(len(rows)) + " rows in " + str(round(1000*(time.perf_counter() - start), 2)) + " ms")
+    if args.output is not None:
+        import numpy as np
+        np.save(args.output, rows)
+    return
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog = "python -m src.cli", description = "Modelling active galactic nuclei with XSPEC and neural networks")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    parser_generate = subparsers.add_parser("generate", help = "simulate spectra with XSPEC and pickle them")
+    parser_generate.add_argument("--iterations", type = int, default = 300, help = "number of spectra")
+    parser_generate.add_argument("--number", type = int, required = True, help = "suffix of the saved files")
+    parser_generate.add_argument("--test", action = "store_true", help = "seed XSPEC for reproducible spectra")
+    parser_generate.add_argument("--seed", type = int, help = "seed the parameter draws and XSPEC, so a run can be repeated")
+    parser_generate.add_argument("--cache-dir", help = "directory of the simulated spectra cache, used by seeded runs")
+    parser_generate.add_argument("--cache-mb", type = int, default = 2048, help = "size cap of the cache")
+    parser_generate.set_defaults(function = generate)
+
+    parser_merge = subparsers.add_parser("merge", help = "combine pickled inputs and labels into .npy files")
+    parser_merge.add_argument("--inputs", nargs = "+", required = True)
+    parser_merge.add_argument("--labels", nargs = "+", required = True)
+    parser_merge.add_argument("--out-inputs", required = True)
+    parser_merge.add_argument("--out-labels", required = True)
+    parser_merge.set_defaults(function = merge)
+
+    parser_augment = subparsers.add_parser("augment", help = "recycle simulated spectra to look like real observations")
+    parser_augment.add_argument("--inputs", required = True)
+    parser_augment.add_argument("--labels", required = True)
+    parser_augment.add_argument("--out-inputs", required = True)
+    parser_augment.add_argument("--out-labels", required = True)
+    parser_augment.add_argument("--recycle", type = int, default = 3, help = "recycled copies of every spectrum")
+    parser_augment.set_defaults(function = augment)
+
+    parser_train = subparsers.add_parser("train", help = "train a network")
+    parser_train.add_argument("script", choices = ["simulation", "real_world"])
+    parser_train.add_argument("--config", help = "JSON file overriding the script's default_config")
+    parser_train.add_argument("--set", action = "append", metavar = "NAME=VALUE", help = "override one setting")
+    parser_train.add_argument("--workers", type = int, default = 1,
+                              help = "local worker processes of a multi_worker real_world run")
+    parser_train.set_defaults(function = train)
+
+    parser_predict = subparsers.add_parser("predict", help = "predict the parameters of a .npy dataset")
+    parser_predict.add_argument("--model", nargs = "+", required = True, help = "saved model or checkpoint, several for an ensemble")
+    parser_predict.add_argument("--inputs", required = True)
+    parser_predict.add_argument("--output", required = True)
+    parser_predict.add_argument("--batch-size", type = int, default = 1024)
+    parser_predict.add_argument("--chunk-rows", type = int, default = 65536, help = "rows read from disk at a time")
+    parser_predict.add_argument("--samples", type = int, default = 1, help = "Monte Carlo dropout samples per model")
+    parser_predict.add_argument("--micro-batch", type = int, default = 8192, help = "rows per call after tiling by the samples")
+    parser_predict.add_argument("--lower", type = float, default = 0.05, help = "quantile of the lower bound")
+    parser_predict.add_argument("--upper", type = float, default = 0.95, help = "quantile of the upper bound")
+    parser_predict.set_defaults(function = predict)
+
+    parser_evaluate = subparsers.add_parser("evaluate", help = "residuals of predictions across parameter space and rmf/arf ids")
+    parser_evaluate.add_argument("--predictions", required = True, help = ".npy predictions, e.g. from predict")
+    parser_evaluate.add_argument("--labels", required = True)
+    parser_evaluate.add_argument("--inputs", help = ".npy inputs the rmf and arf ids are read from")
+    parser_evaluate.add_argument("--processes", type = int)
+    parser_evaluate.add_argument("--bins", type = int, default = 10, help = "bins of every label")
+    parser_evaluate.add_argument("--merge", nargs = "+", help = "saved accumulators of other shards to merge in")
+    parser_evaluate.add_argument("--output", help = ".npz file the accumulated statistics are saved to")
+    parser_evaluate.set_defaults(function = evaluate)
+
+    parser_bench = subparsers.add_parser("bench", help = "training throughput against replica count")
+    parser_bench.add_argument("--kind", choices = ["mirrored", "multi_worker"], default = "mirrored")
+    parser_bench.add_argument("--workers", type = int, nargs = "+", default = [1, 2, 4])
+    parser_bench.add_argument("--steps", type = int, default = 50)
+    parser_bench.add_argument("--batch", type = int, default = 32)
+    parser_bench.add_argument("--throughput-log", help = "summarize a training throughput log instead")
+    parser_bench.set_defaults(function = bench)
+
+    parser_compress = subparsers.add_parser("compress", help = "fit the principal components of a dataset and compress it")
+    parser_compress.add_argument("--inputs", required = True, help = ".npy inputs, the basis is kept next to them")
+    parser_compress.add_argument("--components", type = int, required = True)
+    parser_compress.add_argument("--output", help = ".npy file for the compressed inputs")
+    parser_compress.add_argument("--refit", action = "store_true")
+    parser_compress.set_defaults(function = compress)
+
+    parser_validate = subparsers.add_parser("validate", help = "check a .npy dataset for bad values, bad ids and duplicates")
+    parser_validate.add_argument("--inputs", required = True)
+    parser_validate.add_argument("--labels", required = True)
+    parser_validate.add_argument("--unnormalized", action = "store_true", help = "labels are in XSPEC units rather than 0-1")
+    parser_validate.add_argument("--processes", type = int)
+    parser_validate.add_argument("--max-rows", type = int, default = 1000, help = "offending row ids kept per check")
+    parser_validate.add_argument("--output", help = "JSON file for the full report")
+    parser_validate.set_defaults(function = validate)
+
+    parser_index = subparsers.add_parser("index", help = "build or query the parameter-space index of a dataset")
+    parser_index.add_argument("--labels", required = True, help = ".npy labels, the index is kept next to them")
+    parser_index.add_argument("--inputs", help = ".npy inputs, needed to build the index")
+    parser_index.add_argument("--rebuild", action = "store_true")
+    parser_index.add_argument("--range", nargs = "+", metavar = "NAME=LOW:HIGH", help = "rows inside a box")
+    parser_index.add_argument("--output", help = ".npy file for the row ids of the query")
+    parser_index.set_defaults(function = index)
+    return parser
+
+def main(argv = None):
+    args = make_parser().parse_args(argv)
+    args.function(args)
+    return
+
+if __name__ == "__main__":
+    main()
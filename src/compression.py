@@ -0,0 +1,283 @@
+"""
+Principal component compression of the spectra.
+
+Neighbouring channels of the 995 bin spectra are highly correlated, so most of the variance
+of the ~1993 standardized features lies in a few hundred directions. fit_basis computes the
+exact principal components of a memory-mapped dataset out of core, by accumulating the
+feature covariance chunk by chunk (the 1990x1990 matrix is small, the dataset is not), and
+stores them next to the dataset. The basis can then be used to
+    - write a compressed copy of a dataset with transform_dataset, streaming in chunks, or
+    - project the raw inputs inside the network with projection_layer, a fixed (non trainable)
+      Dense layer that replaces the Normalization layer in front of the dense stack.
+Only the spectral columns (energies and rates) are compressed; the rmf id, arf id and exposure
+columns are standardized and passed through unchanged.
+Report reconstruction error and training step time for several k with:
+    python -m src.compression inputs.npy --components 32 64 128 256
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+n_passthrough = 3
+
+def basis_path(input_path):
+    return os.path.splitext(input_path)[0] + ".pca.npz"
+
+def fit_basis(input_path, chunk_rows = 65536, max_rows = None, save = True):
+    """
+    Computes the principal components of the standardized spectral columns of a dataset.
+
+    Parameters
+    -------
+    input_path : str
+        .npy inputs of shape (N, 1993).
+    chunk_rows : int
+        Rows read at a time.
+    max_rows : int
+        Only fit on the first max_rows rows, None for all of them.
+    save : bool
+        Whether to save the basis to basis_path(input_path).
+
+    Returns
+    -------
+    basis : dict
+        mean and scale of every column, components (spectral columns x components, ordered
+        by decreasing variance) and the variance along each component.
+    """
+    inputs = np.load(input_path, mmap_mode = "r")
+    n_rows = inputs.shape[0] if max_rows is None else min(max_rows, inputs.shape[0])
+    if n_rows < 2:
+        raise ValueError("Need at least two rows to fit a basis!")
+    n_features = inputs.shape[1]
+    #First pass for the standardization, as the rates span orders of magnitude
+    total = np.zeros(n_features)
+    total_sq = np.zeros(n_features)
+    for start in range(0, n_rows, chunk_rows):
+        chunk = np.asarray(inputs[start:min(start+chunk_rows, n_rows)], dtype = np.float64)
+        total += chunk.sum(axis = 0)
+        total_sq += (chunk**2).sum(axis = 0)
+    mean = total/n_rows
+    scale = np.sqrt(np.maximum(total_sq/n_rows - mean**2, 0))
+    #Constant columns (zero padded bins) are left at zero instead of divided by zero
+    scale[scale == 0] = 1
+    #Second pass accumulates the covariance of the standardized spectral columns
+    n_spectral = n_features - n_passthrough
+    covariance = np.zeros((n_spectral, n_spectral))
+    for start in range(0, n_rows, chunk_rows):
+        chunk = np.asarray(inputs[start:min(start+chunk_rows, n_rows), :n_spectral], dtype = np.float64)
+        z = (chunk - mean[:n_spectral])/scale[:n_spectral]
+        covariance += z.T @ z
+    covariance /= n_rows - 1
+    variance, components = np.linalg.eigh(covariance)
+    order = np.argsort(variance)[::-1]
+    basis = {"mean": mean, "scale": scale, "components": components[:, order],
+             "variance": np.maximum(variance[order], 0), "rows": np.array(n_rows)}
+    if save:
+        np.savez(basis_path(input_path), **basis)
+    return basis
+
+def load_basis(path):
+    with np.load(path) as f:
+        return {name: f[name] for name in f.files}
+
+def explained_variance(basis, k):
+    """
+    Fraction of the variance of the standardized spectral columns kept by k components.
+    """
+    return float(basis["variance"][:k].sum()/basis["variance"].sum())
+
+def transform(basis, x, k):
+    """
+    Compresses rows to k components followed by the standardized passthrough columns.
+
+    Parameters
+    -------
+    basis : dict
+        From fit_basis or load_basis.
+    x : np.ndarray
+        Rows of shape (n, 1993).
+    k : int
+        Number of components.
+
+    Returns
+    -------
+    compressed : np.ndarray
+        float32 array of shape (n, k+3).
+    """
+    if not 1 <= k <= basis["components"].shape[1]:
+        raise ValueError("k needs to be between 1 and " + str(basis["components"].shape[1]) + "!")
+    z = (np.asarray(x, dtype = np.float64) - basis["mean"])/basis["scale"]
+    projected = z[:, :-n_passthrough] @ basis["components"][:, :k]
+    return np.concatenate([projected, z[:, -n_passthrough:]], axis = 1).astype(np.float32)
+
+def transform_dataset(input_path, output_path, basis, k, chunk_rows = 65536):
+    """
+    Writes a compressed copy of a dataset, one chunk at a time.
+
+    Returns
+    -------
+    rows : int
+        Number of rows written.
+    """
+    inputs = np.load(input_path, mmap_mode = "r")
+    compressed = np.lib.format.open_memmap(output_path, mode = "w+", dtype = np.float32,
+                                           shape = (inputs.shape[0], k + n_passthrough))
+    for start in range(0, inputs.shape[0], chunk_rows):
+        compressed[start:start+chunk_rows] = transform(basis, inputs[start:start+chunk_rows], k)
+    compressed.flush()
+    return inputs.shape[0]
+
+def reconstruction_error(input_path, basis, ks, chunk_rows = 65536, max_rows = None):
+    """
+    Measures how much of each row is lost when keeping k components, in one pass for all k.
+
+    As the components are orthonormal, the squared error of a row is the squared norm of its
+    standardized spectral columns minus that of its first k projections.
+
+    Parameters
+    -------
+    input_path : str
+        .npy inputs, e.g. a validation set the basis was not fitted on.
+    basis : dict
+    ks : list
+        Numbers of components.
+    chunk_rows : int
+        Rows read at a time.
+    max_rows : int
+        Only use the first max_rows rows, None for all of them.
+
+    Returns
+    -------
+    errors : dict
+        Maps k to the mean squared error per standardized spectral column, and to the
+        relative error (lost fraction of the total squared norm).
+    """
+    inputs = np.load(input_path, mmap_mode = "r")
+    n_rows = inputs.shape[0] if max_rows is None else min(max_rows, inputs.shape[0])
+    largest = max(ks)
+    n_spectral = basis["components"].shape[0]
+    norm_sq = 0.0
+    kept = np.zeros(largest)
+    for start in range(0, n_rows, chunk_rows):
+        chunk = np.asarray(inputs[start:min(start+chunk_rows, n_rows), :n_spectral], dtype = np.float64)
+        z = (chunk - basis["mean"][:n_spectral])/basis["scale"][:n_spectral]
+        norm_sq += (z**2).sum()
+        kept += ((z @ basis["components"][:, :largest])**2).sum(axis = 0)
+    cumulative = np.cumsum(kept)
+    return {k: {"mse": float(max(norm_sq - cumulative[k-1], 0)/(n_rows*n_spectral)),
+                "relative": float(max(norm_sq - cumulative[k-1], 0)/norm_sq) if norm_sq else 0.0} for k in ks}
+
+def projection_matrix(basis, k, whiten = True):
+    """
+    Folds the standardization and projection into one affine map, raw rows @ weights + bias.
+
+    Parameters
+    -------
+    basis : dict
+    k : int
+        Number of components.
+    whiten : bool
+        Whether to divide every component by its standard deviation, so all outputs have unit
+        variance like those of the Normalization layer.
+
+    Returns
+    -------
+    weights : np.ndarray
+        Shape (1993, k+3).
+    bias : np.ndarray
+        Shape (k+3,).
+    """
+    n_spectral = basis["components"].shape[0]
+    projection = np.zeros((n_spectral + n_passthrough, k + n_passthrough))
+    projection[:n_spectral, :k] = basis["components"][:, :k]
+    projection[n_spectral:, k:] = np.eye(n_passthrough)
+    if whiten:
+        projection[:, :k] /= np.sqrt(np.maximum(basis["variance"][:k], 1e-12))
+    weights = projection/basis["scale"][:, None]
+    bias = -(basis["mean"]/basis["scale"]) @ projection
+    return weights.astype(np.float32), bias.astype(np.float32)
+
+def projection_layer(basis, k, whiten = True):
+    """
+    Non trainable Dense layer applying the projection to raw inputs, to put in front of the
+    dense stack in place of the Normalization layer. Create it under the strategy scope when
+    training with a tf.distribute strategy.
+
+    Returns
+    -------
+    layer : tf.keras.layers.Dense
+    """
+    import tensorflow as tf
+    weights, bias = projection_matrix(basis, k, whiten)
+    layer = tf.keras.layers.Dense(k + n_passthrough, trainable = False, name = "pca_projection",
+                                  kernel_initializer = tf.keras.initializers.Constant(weights),
+                                  bias_initializer = tf.keras.initializers.Constant(bias))
+    layer.build((None, weights.shape[0]))
+    return layer
+
+def step_time(norm, n_features, steps = 50, batch_size = 32, hparams = None):
+    """
+    Mean time of a training step of the dense network behind a given input layer, on random data.
+
+    Returns
+    -------
+    seconds : float
+    """
+    import tensorflow as tf
+    from src.hyper_search import default_hparams, build_model
+    dnn_model = build_model(dict(default_hparams, **(hparams or {})), norm)
+    x = tf.random.normal((batch_size, n_features))
+    y = tf.random.uniform((batch_size, 6))
+    #Warm up, so tracing is not timed
+    for i in range(3):
+        dnn_model.train_on_batch(x, y)
+    start = time.perf_counter()
+    for i in range(steps):
+        dnn_model.train_on_batch(x, y)
+    return (time.perf_counter() - start)/steps
+
+def report(input_path, ks, validation_path = None, steps = 50, batch_size = 32, max_rows = None, refit = False):
+    """
+    Fits (or loads) the basis of a dataset and prints the kept variance, the reconstruction
+    error and the training step time against the uncompressed network for every k.
+
+    Returns
+    -------
+    rows : list
+        One dict per k.
+    """
+    path = basis_path(input_path)
+    if refit or not os.path.exists(path):
+        basis = fit_basis(input_path, max_rows = max_rows)
+        print("Basis written to " + path)
+    else:
+        basis = load_basis(path)
+    errors = reconstruction_error(validation_path or input_path, basis, ks, max_rows = max_rows)
+    import tensorflow as tf
+    n_features = basis["mean"].shape[0]
+    normalizer = tf.keras.layers.experimental.preprocessing.Normalization(mean = basis["mean"], variance = basis["scale"]**2)
+    baseline = step_time(normalizer, n_features, steps, batch_size)
+    print("full (" + str(n_features) + " features): " + str(round(1000*baseline, 3)) + " ms/step")
+    rows = []
+    for k in ks:
+        seconds = step_time(projection_layer(basis, k), n_features, steps, batch_size)
+        rows.append({"k": k, "explained_variance": explained_variance(basis, k), "mse": errors[k]["mse"],
+                     "relative_error": errors[k]["relative"], "step_ms": 1000*seconds, "speedup": baseline/seconds})
+        print("k = " + str(k) + ": explained variance " + str(round(rows[-1]["explained_variance"], 5))
+              + ", relative reconstruction error " + str(round(rows[-1]["relative_error"], 5)) + ", "
+              + str(round(rows[-1]["step_ms"], 3)) + " ms/step, speedup " + str(round(rows[-1]["speedup"], 2)) + "x")
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Principal component compression of a dataset")
+    parser.add_argument("inputs")
+    parser.add_argument("--components", type = int, nargs = "+", default = [32, 64, 128, 256])
+    parser.add_argument("--validation", help = ".npy inputs to measure the reconstruction error on")
+    parser.add_argument("--steps", type = int, default = 50)
+    parser.add_argument("--batch", type = int, default = 32)
+    parser.add_argument("--max-rows", type = int)
+    parser.add_argument("--refit", action = "store_true")
+    args = parser.parse_args(sys.argv[1:])
+    report(args.inputs, args.components, args.validation, args.steps, args.batch, args.max_rows, args.refit)
@@ -0,0 +1,278 @@
+"""
+Data-parallel training on CPUs with tf.distribute.
+
+cpu_mirrored_strategy splits the host CPU into several logical devices and mirrors the model
+across them in one process; multi_worker_strategy mirrors it across several local processes,
+each started by launch_local_workers with its own TF_CONFIG (`python -m src.cli train real_world
+--workers N` does this for best_real_world.py). make_dataset feeds either from the memory-mapped
+.npy files: every worker reads only its shard of the rows, and each step consumes
+per_replica_batch rows per replica, so the global batch grows with the worker count.
+
+Run a scaling benchmark of samples/sec against worker count with:
+    python -m src.distributed --kind mirrored --workers 1 2 4 8
+    python -m src.distributed --kind multi_worker --workers 1 2 4
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import numpy as np
+
+def cpu_mirrored_strategy(n_devices):
+    """
+    Mirrors the model over n_devices logical CPU devices in this process. Has to be
+    called before TensorFlow initializes its devices.
+
+    Parameters
+    -------
+    n_devices : int
+        Number of replicas.
+
+    Returns
+    -------
+    strategy : tf.distribute.MirroredStrategy
+    """
+    import tensorflow as tf
+    if type(n_devices) != int or n_devices < 1:
+        raise ValueError("n_devices needs to be a positive integer!")
+    cpu = tf.config.list_physical_devices("CPU")[0]
+    tf.config.set_logical_device_configuration(cpu, [tf.config.LogicalDeviceConfiguration()]*n_devices)
+    devices = ["/cpu:" + str(i) for i in range(n_devices)]
+    #NCCL is only available on GPUs
+    return tf.distribute.MirroredStrategy(devices = devices, cross_device_ops = tf.distribute.ReductionToOneDevice())
+
+def tf_config(n_workers, index, base_port = 12345, host = "localhost"):
+    """
+    Builds the TF_CONFIG of one of n_workers processes on this host.
+
+    Parameters
+    -------
+    n_workers : int
+        Number of worker processes.
+    index : int
+        Index of this worker; worker 0 is the chief.
+    base_port : int
+        Port of worker 0, the others use consecutive ports.
+
+    Returns
+    -------
+    config : str
+        JSON to place in the TF_CONFIG environment variable.
+    """
+    if index < 0 or index >= n_workers:
+        raise ValueError("Worker index needs to be between 0 and n_workers-1!")
+    cluster = {"worker": [host + ":" + str(base_port+i) for i in range(n_workers)]}
+    return json.dumps({"cluster": cluster, "task": {"type": "worker", "index": index}})
+
+def is_chief():
+    """
+    Whether this process is the chief of the cluster in TF_CONFIG: the "chief" task if there
+    is one, otherwise worker 0. A process without TF_CONFIG is its own chief.
+    """
+    if "TF_CONFIG" not in os.environ:
+        return True
+    config = json.loads(os.environ["TF_CONFIG"])
+    task = config.get("task", {})
+    if "chief" in config.get("cluster", {}):
+        return task.get("type") == "chief"
+    return task.get("type", "worker") == "worker" and task.get("index", 0) == 0
+
+def multi_worker_strategy():
+    """
+    Mirrors the model across the worker processes described by TF_CONFIG.
+
+    Returns
+    -------
+    strategy : tf.distribute.MultiWorkerMirroredStrategy
+    """
+    import tensorflow as tf
+    if "TF_CONFIG" not in os.environ:
+        raise RuntimeError("TF_CONFIG is not set, start the workers with launch_local_workers!")
+    options = tf.distribute.experimental.CommunicationOptions(
+        implementation = tf.distribute.experimental.CommunicationImplementation.RING)
+    return tf.distribute.MultiWorkerMirroredStrategy(communication_options = options)
+
+def make_dataset(inputs, labels, per_replica_batch, strategy, shuffle = True, repeat = False, seed = None,
+                 drop_remainder = True):
+    """
+    Streams batches from (memory-mapped) arrays for a distribution strategy. Each input
+    pipeline (one per worker process) takes its shard of the row indices before anything is
+    read, and every batch is gathered from the arrays with sorted indices, so a worker only
+    touches its own rows.
+
+    Parameters
+    -------
+    inputs : np.ndarray
+        Inputs, may be a memmap.
+    labels : np.ndarray
+        Labels, may be a memmap.
+    per_replica_batch : int
+        Rows per replica per step, i.e. batch_size from the training scripts.
+    strategy : tf.distribute.Strategy
+        Strategy the model is built under.
+    shuffle : bool
+        Whether to reshuffle rows every epoch.
+    repeat : bool
+        Whether to repeat the rows indefinitely.
+    drop_remainder : bool
+        Whether to drop the last incomplete batch, so every training step has the same shape.
+        Evaluation datasets should keep it, or a small set may give no batches at all.
+
+    Returns
+    -------
+    dataset : tf.distribute.DistributedDataset
+        Batches of (inputs, labels), per_replica_batch*strategy.num_replicas_in_sync rows per step.
+    """
+    import tensorflow as tf
+    if inputs.shape[0] != labels.shape[0]:
+        raise ValueError("inputs and labels need to have the same number of rows!")
+    global_batch = per_replica_batch*strategy.num_replicas_in_sync
+
+    def gather(batch_indices):
+        batch_indices = np.sort(batch_indices)
+        return np.asarray(inputs[batch_indices], dtype = np.float32), np.asarray(labels[batch_indices], dtype = np.float32)
+
+    def input_fn(context):
+        batch = context.get_per_replica_batch_size(global_batch)
+        indices = tf.data.Dataset.range(inputs.shape[0]).shard(context.num_input_pipelines, context.input_pipeline_id)
+        if shuffle:
+            indices = indices.shuffle(inputs.shape[0]//context.num_input_pipelines + 1, seed = seed,
+                                      reshuffle_each_iteration = True)
+        if repeat:
+            indices = indices.repeat()
+        indices = indices.batch(batch, drop_remainder = drop_remainder)
+
+        def load(batch_indices):
+            x, y = tf.numpy_function(gather, [batch_indices], [tf.float32, tf.float32])
+            x.set_shape([batch if drop_remainder else None, inputs.shape[1]])
+            y.set_shape([batch if drop_remainder else None, labels.shape[1]])
+            return x, y
+
+        return indices.map(load, num_parallel_calls = tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+    return strategy.distribute_datasets_from_function(input_fn)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+def launch_local_workers(arguments, n_workers, base_port = None, threads = None):
+    """
+    Starts n_workers processes of `python arguments...` on this host, each with its TF_CONFIG,
+    and waits for them to finish.
+
+    Parameters
+    -------
+    arguments : list
+        Command line after the python executable, e.g. ["-m", "src.best_real_world"].
+    n_workers : int
+        Number of processes.
+    base_port : int
+        Port of the chief, the others use consecutive ports. Picked automatically if not given.
+    threads : int
+        CPU threads per process. Defaults to an equal share of the cores.
+
+    Returns
+    -------
+    outputs : list
+        Standard output of every worker, chief first.
+    """
+    base_port = base_port or free_port()
+    threads = threads or max(1, (os.cpu_count() or 1)//n_workers)
+    processes = []
+    for index in range(n_workers):
+        env = dict(os.environ)
+        env["TF_CONFIG"] = tf_config(n_workers, index, base_port)
+        env["TF_NUM_INTRAOP_THREADS"] = str(threads)
+        env["TF_NUM_INTEROP_THREADS"] = "2"
+        env["OMP_NUM_THREADS"] = str(threads)
+        processes.append(subprocess.Popen([sys.executable] + list(arguments), env = env,
+                                          stdout = subprocess.PIPE, text = True))
+    outputs = [process.communicate()[0] for process in processes]
+    failed = [index for index, process in enumerate(processes) if process.returncode != 0]
+    if failed:
+        raise RuntimeError("Workers " + str(failed) + " exited with an error!")
+    return outputs
+
+def _benchmark_worker(kind, n_workers, steps, per_replica_batch, hparams):
+    """
+    Times training steps of the best_real_world.py network on random data and prints the
+    throughput as JSON. Runs in its own process, as logical devices can only be configured once.
+    """
+    import tensorflow as tf
+    from tensorflow.keras import layers
+    from src.hyper_search import build_model
+    strategy = cpu_mirrored_strategy(n_workers) if kind == "mirrored" else multi_worker_strategy()
+    rows = per_replica_batch*strategy.num_replicas_in_sync*(steps+5)
+    rng = np.random.default_rng(0)
+    inputs = rng.random((rows, 1993), dtype = np.float32)
+    labels = rng.random((rows, 6), dtype = np.float32)
+    with strategy.scope():
+        dnn_model = build_model(hparams, layers.experimental.preprocessing.Normalization(mean = 0.5, variance = 1/12))
+    dataset = make_dataset(inputs, labels, per_replica_batch, strategy, repeat = True)
+    #The first steps include tracing and are not timed
+    dnn_model.fit(dataset, epochs = 1, steps_per_epoch = 5, verbose = 0)
+    start = time.perf_counter()
+    dnn_model.fit(dataset, epochs = 1, steps_per_epoch = steps, verbose = 0)
+    elapsed = time.perf_counter() - start
+    samples = steps*per_replica_batch*strategy.num_replicas_in_sync
+    print(json.dumps({"kind": kind, "workers": n_workers, "samples_per_sec": samples/elapsed}))
+    return
+
+def scaling_benchmark(kind, worker_counts, steps = 50, per_replica_batch = 32):
+    """
+    Measures training throughput against the number of replicas.
+
+    Parameters
+    -------
+    kind : str
+        "mirrored" for logical CPU devices in one process, "multi_worker" for local processes.
+    worker_counts : list
+        Replica counts to measure.
+    steps : int
+        Timed training steps per measurement.
+    per_replica_batch : int
+        Rows per replica per step.
+
+    Returns
+    -------
+    results : list
+        Dicts of kind, workers, samples_per_sec and speedup relative to the first count.
+    """
+    if kind not in ("mirrored", "multi_worker"):
+        raise ValueError("kind needs to be 'mirrored' or 'multi_worker'!")
+    results = []
+    for n_workers in worker_counts:
+        arguments = ["-m", "src.distributed", "--kind", kind, "--workers", str(n_workers), "--steps", str(steps),
+                     "--batch", str(per_replica_batch), "--role", "worker"]
+        if kind == "mirrored":
+            output = launch_local_workers(arguments, 1, threads = os.cpu_count())[0]
+        else:
+            output = launch_local_workers(arguments, n_workers)[0]
+        result = json.loads(output.strip().splitlines()[-1])
+        result["speedup"] = result["samples_per_sec"]/results[0]["samples_per_sec"] if results else 1.0
+        results.append(result)
+        print(str(n_workers) + " workers: " + str(round(result["samples_per_sec"])) + " samples/sec ("
+              + str(round(result["speedup"], 2)) + "x)")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Scaling benchmark of CPU data-parallel training")
+    parser.add_argument("--kind", choices = ["mirrored", "multi_worker"], default = "mirrored")
+    parser.add_argument("--workers", type = int, nargs = "+", default = [1, 2, 4])
+    parser.add_argument("--steps", type = int, default = 50)
+    parser.add_argument("--batch", type = int, default = 32)
+    parser.add_argument("--role", choices = ["driver", "worker"], default = "driver")
+    args = parser.parse_args()
+    #Network from best_real_world.py
+    from src.hyper_search import default_hparams
+    real_world_hparams = dict(default_hparams, n_layers = 8, n_neurons = 2048, h_neurons = 2048, h2_neurons = 2048,
+                              drp_rate2 = 0.1, drp_rate3 = 0.1, output_activation = "sigmoid")
+    if args.role == "worker":
+        _benchmark_worker(args.kind, args.workers[0], args.steps, args.batch, real_world_hparams)
+    else:
+        scaling_benchmark(args.kind, args.workers, args.steps, args.batch)
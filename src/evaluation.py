@@ -0,0 +1,267 @@
+"""
+Streaming evaluation of predictions over parameter space.
+
+residual_accumulator reads predictions and labels chunk by chunk and accumulates, for every
+cell of a set of groupings, the count, sum, absolute sum and squared sum of the residuals
+(prediction - label, in normalized units) of the six parameters, along with a fixed-bin
+histogram of them from which quantiles are read. The groupings are all rows, every label cut
+into bins (e.g. the residuals of all six parameters in each astar bin) and every rmf and arf id.
+All of these are sums, so accumulators of different shards are merged by adding their arrays,
+which is how evaluate spreads a dataset over worker processes; nothing of size N is kept.
+    python -m src.cli evaluate --predictions predictions.npy --labels labels.npy --inputs inputs.npy
+"""
+import os
+import multiprocessing
+import numpy as np
+
+label_names = ["mass", "dist", "logmdot", "astar", "cosi", "redshift"]
+
+class residual_accumulator:
+    def __init__(self, label_bins = 10, n_rmf = 2, n_arf = 15, hist_bins = 400, hist_range = 1.0):
+        """
+        Parameters
+        -------
+        label_bins : int
+            Bins every normalized label is cut into.
+        n_rmf, n_arf : int
+            Number of rmf and arf ids (len(gen.rmf_list), len(gen.arf_list)).
+        hist_bins : int
+            Histogram bins of the residuals between -hist_range and hist_range, so quantiles
+            are resolved to 2*hist_range/hist_bins. Residuals outside land in two overflow bins.
+        hist_range : float
+            Largest residual resolved by the histograms.
+        """
+        self.label_bins = label_bins
+        self.hist_bins = hist_bins
+        self.hist_range = hist_range
+        self.groups = {"all": 1}
+        for name in label_names:
+            self.groups[name] = label_bins
+        self.groups["rmf"] = n_rmf
+        self.groups["arf"] = n_arf
+        self.count = {name: np.zeros(cells, dtype = np.int64) for name, cells in self.groups.items()}
+        self.total = {name: np.zeros((cells, 6)) for name, cells in self.groups.items()}
+        self.total_abs = {name: np.zeros((cells, 6)) for name, cells in self.groups.items()}
+        self.total_sq = {name: np.zeros((cells, 6)) for name, cells in self.groups.items()}
+        self.hist = {name: np.zeros((cells, 6, hist_bins+2), dtype = np.int64) for name, cells in self.groups.items()}
+        #Rows whose rmf or arf id is unknown (e.g. -1 for real spectra), left out of those groups
+        self.unknown_ids = 0
+
+    def __add(self, name, cells, residuals, hist_index):
+        n_cells = self.groups[name]
+        self.count[name] += np.bincount(cells, minlength = n_cells)
+        for total, values in [(self.total, residuals), (self.total_abs, np.abs(residuals)), (self.total_sq, residuals**2)]:
+            for j in range(6):
+                total[name][:, j] += np.bincount(cells, weights = values[:, j], minlength = n_cells)
+        #One flat bincount over (cell, parameter, histogram bin)
+        flat = (cells[:, None]*6 + np.arange(6))*(self.hist_bins+2) + hist_index
+        self.hist[name] += np.bincount(flat.ravel(), minlength = n_cells*6*(self.hist_bins+2)).reshape(n_cells, 6, self.hist_bins+2)
+
+    def update(self, predictions, labels, rmf_ids = None, arf_ids = None):
+        """
+        Adds a chunk of rows.
+
+        Parameters
+        -------
+        predictions, labels : np.ndarray
+            (n, 6) normalized predictions and labels.
+        rmf_ids, arf_ids : np.ndarray
+            (n,) ids from the inputs, if available.
+        """
+        predictions = np.asarray(predictions, dtype = np.float64)
+        labels = np.asarray(labels, dtype = np.float64)
+        if predictions.shape != labels.shape or predictions.ndim != 2 or predictions.shape[1] != 6:
+            raise ValueError("predictions and labels need to have the same (n, 6) shape!")
+        residuals = predictions - labels
+        #Bin 0 is underflow, hist_bins+1 overflow
+        scaled = (residuals + self.hist_range)/(2*self.hist_range)*self.hist_bins
+        hist_index = np.clip(np.floor(scaled), -1, self.hist_bins).astype(np.int64) + 1
+        self.__add("all", np.zeros(len(labels), dtype = np.int64), residuals, hist_index)
+        label_cells = np.clip(np.floor(labels*self.label_bins), 0, self.label_bins-1).astype(np.int64)
+        for j, name in enumerate(label_names):
+            self.__add(name, label_cells[:, j], residuals, hist_index)
+        for name, ids in [("rmf", rmf_ids), ("arf", arf_ids)]:
+            if ids is None:
+                continue
+            ids = np.asarray(ids).astype(np.int64)
+            known = (ids >= 0) & (ids < self.groups[name])
+            self.unknown_ids += int((~known).sum())
+            self.__add(name, ids[known], residuals[known], hist_index[known])
+        return self
+
+    def merge(self, other):
+        """
+        Adds the rows of another accumulator with the same settings into this one.
+        """
+        if (other.groups != self.groups or other.hist_bins != self.hist_bins or other.hist_range != self.hist_range):
+            raise ValueError("Can only merge accumulators with the same settings!")
+        for arrays, other_arrays in [(self.count, other.count), (self.total, other.total), (self.total_abs, other.total_abs),
+                                     (self.total_sq, other.total_sq), (self.hist, other.hist)]:
+            for name in self.groups:
+                arrays[name] += other_arrays[name]
+        self.unknown_ids += other.unknown_ids
+        return self
+
+    def quantiles(self, name, qs):
+        """
+        Quantiles of the residuals of every cell of a grouping, interpolated within the
+        histogram bins.
+
+        Returns
+        -------
+        values : np.ndarray
+            (cells, 6, len(qs)), NaN for empty cells.
+        """
+        hist = self.hist[name].astype(np.float64)
+        cumulative = np.cumsum(hist, axis = 2)
+        total = cumulative[:, :, -1:]
+        edges = np.linspace(-self.hist_range, self.hist_range, self.hist_bins+1)
+        #Overflow bins are given zero width at the ends of the range
+        lower_edges = np.concatenate([[-self.hist_range], edges])
+        upper_edges = np.concatenate([edges, [self.hist_range]])
+        values = np.full(hist.shape[:2] + (len(qs),), np.nan)
+        for k, q in enumerate(qs):
+            target = q*total
+            index = np.minimum((cumulative < target).sum(axis = 2, keepdims = True), self.hist_bins+1)
+            below = np.take_along_axis(cumulative, index, axis = 2) - np.take_along_axis(hist, index, axis = 2)
+            inside = np.take_along_axis(hist, index, axis = 2)
+            fraction = np.where(inside > 0, (target - below)/np.where(inside > 0, inside, 1), 0)
+            value = lower_edges[index] + fraction*(upper_edges[index] - lower_edges[index])
+            values[:, :, k] = np.where(total > 0, value, np.nan)[:, :, 0]
+        return values
+
+    def arrays(self, qs = (0.05, 0.5, 0.95)):
+        """
+        Statistics of every grouping, for plotting.
+
+        Returns
+        -------
+        results : dict
+            Maps every grouping to a dict of count (cells,), bias, mae and rmse (cells, 6)
+            and quantiles (cells, 6, len(qs)). Empty cells are NaN.
+        """
+        results = {}
+        for name in self.groups:
+            count = self.count[name][:, None]
+            with np.errstate(invalid = "ignore", divide = "ignore"):
+                results[name] = {"count": self.count[name], "bias": self.total[name]/count,
+                                 "mae": self.total_abs[name]/count, "rmse": np.sqrt(self.total_sq[name]/count),
+                                 "quantiles": self.quantiles(name, qs)}
+        return results
+
+    def save(self, path):
+        """
+        Saves the accumulated sums, which load reads back to keep merging.
+        """
+        arrays = {"settings": np.array([self.label_bins, self.groups["rmf"], self.groups["arf"], self.hist_bins]),
+                  "hist_range": np.array(self.hist_range), "unknown_ids": np.array(self.unknown_ids)}
+        for name in self.groups:
+            arrays["count_" + name] = self.count[name]
+            arrays["total_" + name] = self.total[name]
+            arrays["total_abs_" + name] = self.total_abs[name]
+            arrays["total_sq_" + name] = self.total_sq[name]
+            arrays["hist_" + name] = self.hist[name]
+        np.savez_compressed(path, **arrays)
+        return
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            label_bins, n_rmf, n_arf, hist_bins = (int(value) for value in f["settings"])
+            accumulator = cls(label_bins, n_rmf, n_arf, hist_bins, float(f["hist_range"]))
+            accumulator.unknown_ids = int(f["unknown_ids"])
+            for name in accumulator.groups:
+                accumulator.count[name] = f["count_" + name]
+                accumulator.total[name] = f["total_" + name]
+                accumulator.total_abs[name] = f["total_abs_" + name]
+                accumulator.total_sq[name] = f["total_sq_" + name]
+                accumulator.hist[name] = f["hist_" + name]
+        return accumulator
+
+    def __combined_rmse(self, name):
+        """
+        RMSE of every cell of a grouping over all six parameters, 0 for empty cells.
+        """
+        return np.sqrt(self.total_sq[name].sum(axis = 1)/np.maximum(6*self.count[name], 1))
+
+    def report(self, worst = 5):
+        """
+        Compact text report: overall statistics of every parameter, the label bins with the
+        largest RMSE and the statistics per rmf and arf id.
+        """
+        results = self.arrays()
+        overall = results["all"]
+        lines = [str(int(overall["count"][0])) + " rows" + (", " + str(self.unknown_ids) + " unknown rmf/arf ids" if self.unknown_ids else ""),
+                 "parameter   bias      mae       rmse      q05       median    q95"]
+        for j, name in enumerate(label_names):
+            lines.append(name.ljust(12) + "".join(("%.5f" % value).rjust(10) for value in
+                         [overall["bias"][0, j], overall["mae"][0, j], overall["rmse"][0, j]] + list(overall["quantiles"][0, j])))
+        #Cells of the label grids ranked by their RMSE over all six parameters
+        cells = []
+        for name in label_names:
+            rmse = self.__combined_rmse(name)
+            for cell in range(self.label_bins):
+                if results[name]["count"][cell] > 0:
+                    cells.append((rmse[cell], name, cell, int(results[name]["count"][cell])))
+        cells.sort(reverse = True)
+        lines.append("Worst label bins (rmse over all parameters):")
+        for rmse, name, cell, count in cells[:worst]:
+            lines.append("    " + name + " in [" + str(round(cell/self.label_bins, 3)) + ", " + str(round((cell+1)/self.label_bins, 3))
+                         + "): rmse " + "%.5f" % rmse + " over " + str(count) + " rows")
+        for name in ["rmf", "arf"]:
+            rmse = self.__combined_rmse(name)
+            used = [str(cell) + ": " + "%.5f" % rmse[cell] for cell in range(self.groups[name]) if results[name]["count"][cell] > 0]
+            if used:
+                lines.append(name + " rmse by id: " + ", ".join(used))
+        return "\n".join(lines)
+
+def _evaluate_shard(arguments):
+    prediction_path, label_path, input_path, start, stop, chunk_rows, settings = arguments
+    predictions = np.load(prediction_path, mmap_mode = "r")
+    labels = np.load(label_path, mmap_mode = "r")
+    inputs = None if input_path is None else np.load(input_path, mmap_mode = "r")
+    accumulator = residual_accumulator(**settings)
+    for chunk_start in range(start, stop, chunk_rows):
+        chunk_stop = min(chunk_start+chunk_rows, stop)
+        ids = [None, None] if inputs is None else [inputs[chunk_start:chunk_stop, -3], inputs[chunk_start:chunk_stop, -2]]
+        accumulator.update(predictions[chunk_start:chunk_stop], labels[chunk_start:chunk_stop], *ids)
+    return accumulator
+
+def evaluate(prediction_path, label_path, input_path = None, processes = None, chunk_rows = 65536, **settings):
+    """
+    Evaluates .npy predictions against labels, spreading shards of rows over worker processes
+    and merging their accumulators.
+
+    Parameters
+    -------
+    prediction_path, label_path : str
+        (N, 6) .npy predictions (e.g. from the predict subcommand) and labels.
+    input_path : str
+        .npy inputs the rmf and arf ids are read from, optional.
+    processes : int
+        Worker processes, defaults to the number of CPU cores; 1 runs in process.
+    chunk_rows : int
+        Rows read at a time by every worker.
+    settings
+        Passed to residual_accumulator.
+
+    Returns
+    -------
+    accumulator : residual_accumulator
+    """
+    n_rows = np.load(label_path, mmap_mode = "r").shape[0]
+    if np.load(prediction_path, mmap_mode = "r").shape[0] != n_rows:
+        raise ValueError("Predictions and labels need to have the same number of rows!")
+    processes = max(1, min(processes or os.cpu_count(), -(-n_rows//chunk_rows)))
+    bounds = np.linspace(0, n_rows, processes+1).astype(np.int64)
+    tasks = [(prediction_path, label_path, input_path, int(bounds[i]), int(bounds[i+1]), chunk_rows, settings)
+             for i in range(processes)]
+    if processes == 1:
+        shards = [_evaluate_shard(task) for task in tasks]
+    else:
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            shards = pool.map(_evaluate_shard, tasks)
+    accumulator = shards[0]
+    for shard in shards[1:]:
+        accumulator.merge(shard)
+    return accumulator
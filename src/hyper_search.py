@@ -0,0 +1,343 @@
+"""
+Parallel hyperparameter search for the dense networks in best_simulation.py and best_real_world.py.
+
+Trials are sampled from a search space over the same hyperparameters the training scripts
+define (n_neurons, h*_neurons, drp_rate*, initial_learning_rate), trained concurrently in a
+process pool and pruned with successive halving on val_loss: every rung trains the surviving
+trials for eta times more epochs and keeps the best 1/eta of them, resuming each from the
+checkpoint of its model and optimizer state. All trials stream their batches from the same
+memory-mapped .npy files with distributed.make_dataset, so the dataset is held once in the
+page cache rather than once per process, and each process is limited to its share of the CPU
+cores.
+"""
+import os
+import csv
+import math
+import random
+import multiprocessing
+import numpy as np
+
+#Defaults taken from best_simulation.py
+default_hparams = {"initial_learning_rate": 0.0001, "n_layers": 3, "n_neurons": 1024, "h_neurons": 512,
+                   "h2_neurons": 256, "h3_neurons": 1024, "h4_neurons": 1024, "h5_neurons": 512,
+                   "h6_neurons": 512, "h7_neurons": 256, "drp_rate2": 0.2, "drp_rate3": 0.2,
+                   "drp_rate4": 0.1, "drp_rate5": 0.1, "drp_rate6": 0.1, "drp_rate7": 0.1,
+                   "batch_size": 32, "output_activation": None}
+neuron_keys = ["n_neurons", "h_neurons", "h2_neurons", "h3_neurons", "h4_neurons", "h5_neurons", "h6_neurons", "h7_neurons"]
+#Dropout after each hidden layer, as laid out in best_real_world.py
+dropout_keys = ["drp_rate2", "drp_rate3", "drp_rate4", "drp_rate5", "drp_rate5", "drp_rate6", "drp_rate7"]
+
+def sample_trials(search_space, n_trials, seed = None):
+    """
+    Randomly draws trials from a search space.
+
+    Parameters
+    -------
+    search_space : dict
+        Maps hyperparameter names to lists of candidate values. Names not given keep
+        their value from default_hparams.
+    n_trials : int
+        Number of trials to draw.
+    seed : int
+        Seed for reproducible draws.
+
+    Returns
+    -------
+    trials : list
+        List of complete hyperparameter dicts, without duplicates.
+    """
+    unknown = [name for name in search_space if name not in default_hparams]
+    if unknown:
+        raise ValueError("Unknown hyperparameters in search space: " + ", ".join(unknown))
+    n_combinations = math.prod(len(values) for values in search_space.values())
+    if any(not 1 <= n_layers <= len(neuron_keys) for n_layers in search_space.get("n_layers", [])):
+        raise ValueError("n_layers needs to be between 1 and " + str(len(neuron_keys)) + "!")
+    if n_trials > n_combinations:
+        raise ValueError("Search space only contains " + str(n_combinations) + " distinct trials!")
+    rng = random.Random(seed)
+    trials = []
+    seen = set()
+    while len(trials) < n_trials:
+        hparams = dict(default_hparams)
+        for name, values in search_space.items():
+            hparams[name] = rng.choice(values)
+        signature = tuple(sorted(hparams.items(), key = lambda item: item[0]))
+        if signature not in seen:
+            seen.add(signature)
+            trials.append(hparams)
+    return trials
+
+def build_model(hparams, norm):
+    """
+    Builds and compiles the dense network described by hparams, in the layout used by
+    the training scripts: Dense(relu, L2) layers separated by Dropout, then a 6 unit output.
+
+    Parameters
+    -------
+    hparams : dict
+        Hyperparameters, see default_hparams.
+    norm : tf.keras.layers.Layer
+        Normalization layer placed in front of the network.
+
+    Returns
+    -------
+    dnn_model : tf.keras.Sequential
+        The compiled model.
+    """
+    import tensorflow as tf
+    from tensorflow.keras import layers
+    stack = [norm]
+    for i in range(hparams["n_layers"]):
+        stack.append(layers.Dense(hparams[neuron_keys[i]], activation = 'relu',
+                                  kernel_regularizer = tf.keras.regularizers.L2(0.00005)))
+        if i < hparams["n_layers"]-1:
+            stack.append(layers.Dropout(hparams[dropout_keys[i]]))
+    stack.append(layers.Dense(6, activation = hparams["output_activation"]))
+    dnn_model = tf.keras.Sequential(stack)
+    dnn_model.compile(loss = 'mean_squared_error',
+              optimizer = tf.keras.optimizers.Adam(learning_rate = hparams["initial_learning_rate"]),
+              metrics = [tf.keras.metrics.MeanAbsoluteError()])
+    return dnn_model
+
+def feature_statistics(input_path, chunk_rows = 65536):
+    """
+    Computes the per-feature mean and variance of a memory-mapped dataset in chunks, so the
+    Normalization layer does not have to be adapted separately in every trial.
+
+    Parameters
+    -------
+    input_path : str
+        Path to the .npy inputs.
+    chunk_rows : int
+        Rows read at a time.
+
+    Returns
+    -------
+    mean : np.ndarray
+    variance : np.ndarray
+    """
+    return array_statistics(np.load(input_path, mmap_mode = "r"), chunk_rows)
+
+def array_statistics(inputs, chunk_rows = 65536):
+    """
+    Computes the per-feature mean and variance of a (memory-mapped) array in chunks.
+
+    Returns
+    -------
+    mean : np.ndarray
+    variance : np.ndarray
+    """
+    total = np.zeros(inputs.shape[1])
+    total_sq = np.zeros(inputs.shape[1])
+    for start in range(0, inputs.shape[0], chunk_rows):
+        chunk = np.asarray(inputs[start:start+chunk_rows], dtype = np.float64)
+        total += chunk.sum(axis = 0)
+        total_sq += (chunk**2).sum(axis = 0)
+    mean = total/inputs.shape[0]
+    variance = np.maximum(total_sq/inputs.shape[0] - mean**2, 0)
+    return mean, variance
+
+def limit_threads(threads):
+    """
+    Pool initializer restricting a worker to a number of CPU threads. Must run before
+    TensorFlow is imported in the worker.
+    """
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                     "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"]:
+        os.environ[variable] = str(threads)
+    os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+    return
+
+class trial_runner:
+    def __init__(self, input_path, label_path, work_dir, val_input_path = None, val_label_path = None,
+                 validation_split = .2, statistics = None, shared = None):
+        """
+        Trains one trial for one rung. Instances are sent to the worker processes, so they only
+        hold paths; the arrays are memory-mapped inside each worker.
+
+        Parameters
+        -------
+        input_path, label_path : str
+            Training .npy files.
+        work_dir : str
+            Directory where the checkpoints of the trials (weights and optimizer state) are
+            kept between rungs.
+        val_input_path, val_label_path : str
+            Optional validation .npy files. If not given, the last validation_split of the
+            training files is used, as in best_simulation.py.
+        statistics : tuple
+            (mean, variance) for the Normalization layer, see feature_statistics.
+        shared : dict
+            Manifest of a shared_arrays.shared_registry. Arrays published there as val_inputs,
+            val_labels, mean and variance are attached instead of loaded by every worker.
+        """
+        self.input_path = input_path
+        self.label_path = label_path
+        self.work_dir = work_dir
+        self.val_input_path = val_input_path
+        self.val_label_path = val_label_path
+        self.validation_split = validation_split
+        self.statistics = statistics
+        self.shared = shared
+
+    def __call__(self, trial_id, hparams, initial_epoch, epochs):
+        """
+        Trains a trial from initial_epoch to epochs, resuming from its checkpoint.
+
+        Returns
+        -------
+        val_loss : float
+            Best validation loss reached in this rung.
+        """
+        import tensorflow as tf
+        from tensorflow.keras import layers
+        from src.distributed import make_dataset
+        threads = int(os.environ.get("TF_NUM_INTRAOP_THREADS", "0"))
+        if threads:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(threads)
+                tf.config.threading.set_inter_op_parallelism_threads(min(threads, 2))
+            except RuntimeError:
+                #Already initialized by an earlier trial in this worker
+                pass
+        inputs = np.load(self.input_path, mmap_mode = "r")
+        labels = np.load(self.label_path, mmap_mode = "r")
+        shared = {} if self.shared is None else self.shared["entries"]
+        if shared:
+            from src.shared_arrays import attach
+        statistics = self.statistics
+        if "mean" in shared and "variance" in shared:
+            statistics = (attach(self.shared, "mean"), attach(self.shared, "variance"))
+        if "val_inputs" in shared and "val_labels" in shared:
+            validation = (attach(self.shared, "val_inputs"), attach(self.shared, "val_labels"))
+        elif self.val_input_path is None:
+            split = int(inputs.shape[0]*(1-self.validation_split))
+            validation = (inputs[split:], labels[split:])
+            inputs, labels = inputs[:split], labels[:split]
+        else:
+            validation = (np.load(self.val_input_path, mmap_mode = "r"), np.load(self.val_label_path, mmap_mode = "r"))
+        if statistics is None:
+            #Read in chunks, adapting the layer would load the whole map
+            statistics = array_statistics(inputs)
+        norm = layers.experimental.preprocessing.Normalization(mean = statistics[0], variance = statistics[1])
+        dnn_model = build_model(hparams, norm)
+        dnn_model.build((None, inputs.shape[1]))
+        #The optimizer is checkpointed with the model, so a promoted trial resumes with its step count
+        #and Adam moments (restored when Adam creates them on the first step)
+        checkpoint = tf.train.Checkpoint(model = dnn_model, optimizer = dnn_model.optimizer)
+        checkpoint_path = os.path.join(self.work_dir, "trial" + str(trial_id))
+        if initial_epoch > 0 and os.path.exists(checkpoint_path + ".index"):
+            checkpoint.read(checkpoint_path)
+        #Batches are gathered from the maps as they are needed, rather than Keras copying the arrays
+        strategy = tf.distribute.get_strategy()
+        train = make_dataset(inputs, labels, hparams["batch_size"], strategy)
+        validation = make_dataset(validation[0], validation[1], hparams["batch_size"], strategy, shuffle = False,
+                                  drop_remainder = False)
+        history = dnn_model.fit(train, validation_data = validation, initial_epoch = initial_epoch, epochs = epochs,
+                                verbose = 0)
+        checkpoint.write(checkpoint_path)
+        return min(history.history["val_loss"])
+
+def _run(task):
+    objective, trial_id, hparams, initial_epoch, epochs = task
+    return objective(trial_id, hparams, initial_epoch, epochs)
+
+def successive_halving(trials, objective, min_epochs = 10, max_epochs = 1000, eta = 3, processes = None,
+                       results_path = None):
+    """
+    Runs trials concurrently and prunes the worst performers at every rung.
+
+    Parameters
+    -------
+    trials : list
+        Hyperparameter dicts, see sample_trials.
+    objective : callable
+        objective(trial_id, hparams, initial_epoch, epochs) -> val_loss. Must be picklable,
+        e.g. a trial_runner.
+    min_epochs : int
+        Epochs given to every trial in the first rung.
+    max_epochs : int
+        Epochs the best trials are trained up to.
+    eta : int
+        Fraction of trials kept (1/eta) and growth of the budget (eta times) per rung.
+    processes : int
+        Number of concurrent trials. Defaults to the number of CPU cores; 1 runs in process.
+    results_path : str
+        Optional csv file every finished rung of every trial is appended to.
+
+    Returns
+    -------
+    results : list
+        One dict per trial and rung with trial_id, rung, epochs, val_loss, pruned and the
+        hyperparameters, sorted by val_loss within the final rung.
+    """
+    if type(eta) != int or eta < 2:
+        raise ValueError("eta needs to be an integer of at least 2!")
+    if min_epochs < 1 or max_epochs < min_epochs:
+        raise ValueError("Need 1 <= min_epochs <= max_epochs!")
+    processes = processes or os.cpu_count()
+    budgets = [min_epochs]
+    while budgets[-1] < max_epochs:
+        budgets.append(min(budgets[-1]*eta, max_epochs))
+    alive = list(range(len(trials)))
+    results = []
+    pool = None
+    if processes > 1:
+        threads = max(1, os.cpu_count()//processes)
+        #Spawned rather than forked, as TensorFlow is not fork safe
+        pool = multiprocessing.get_context("spawn").Pool(processes, initializer = limit_threads, initargs = (threads,))
+    try:
+        previous = 0
+        for rung, budget in enumerate(budgets):
+            tasks = [(objective, trial_id, trials[trial_id], previous, budget) for trial_id in alive]
+            losses = pool.map(_run, tasks, chunksize = 1) if pool else [_run(task) for task in tasks]
+            ranked = sorted(zip(losses, alive), key = lambda pair: (math.isnan(pair[0]), pair[0]))
+            keep = max(1, len(alive)//eta) if rung < len(budgets)-1 else len(alive)
+            survivors = set(trial_id for _, trial_id in ranked[:keep])
+            rung_results = []
+            for val_loss, trial_id in ranked:
+                row = {"trial_id": trial_id, "rung": rung, "epochs": budget, "val_loss": val_loss,
+                       "pruned": trial_id not in survivors}
+                row.update(trials[trial_id])
+                rung_results.append(row)
+            if results_path is not None:
+                write_results(rung_results, results_path)
+            results.extend(rung_results)
+            alive = [trial_id for _, trial_id in ranked[:keep]]
+            previous = budget
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return results
+
+def write_results(results, results_path):
+    """
+    Appends rows of a results table to a csv file, writing the header if the file is new.
+    """
+    columns = ["trial_id", "rung", "epochs", "val_loss", "pruned"] + list(default_hparams)
+    new_file = not os.path.exists(results_path)
+    with open(results_path, "a", newline = "") as f:
+        writer = csv.DictWriter(f, fieldnames = columns, extrasaction = "ignore")
+        if new_file:
+            writer.writeheader()
+        writer.writerows(results)
+    return
+
+#Run Script:
+##space = {"initial_learning_rate": [0.001, 0.0001, 0.00001], "n_layers": [3, 5, 8],
+##         "n_neurons": [512, 1024, 2048], "h_neurons": [512, 1024, 2048], "drp_rate2": [0.1, 0.2]}
+##runner = trial_runner("megacleansedinputs.npy", "megacleansedlabels.npy", "./ckpt",
+##                      statistics = feature_statistics("megacleansedinputs.npy"))
+##results = successive_halving(sample_trials(space, 27, seed = 1), runner, min_epochs = 10, max_epochs = 270,
+##                             processes = 4, results_path = "plots/search_results.csv")
+##Validation arrays and statistics held once in shared memory for all trials:
+##from src.shared_arrays import shared_registry
+##with shared_registry() as registry:
+##    mean, variance = feature_statistics("megacleansedinputs.npy")
+##    registry.publish("mean", mean)
+##    registry.publish("variance", variance)
+##    registry.publish_file("val_inputs", "Inbetween/combined_real_inputs1.npy")
+##    registry.publish_file("val_labels", "Inbetween/combined_real_labels1.npy")
+##    runner = trial_runner("megacleansedinputs.npy", "megacleansedlabels.npy", "./ckpt", shared = registry.manifest())
+##    results = successive_halving(sample_trials(space, 27, seed = 1), runner, processes = 4)
@@ -0,0 +1,218 @@
+"""
+Bulk ingestion of real Swift XRT spectra into the input layout the networks expect.
+
+Every source directory laid out like build/rmf_arf/<source>/ (a .pha or .pi spectrum, the
+<source>pc.arf and optionally an .rmf) is read through XSPEC in parallel worker processes, with
+the same channel 1-29 ignore and plotted energies/rates as generator.__xspec_data_retriever.
+Each spectrum becomes one 1993 wide row: 995 energies and 995 rates (zero padded, as in the
+recycled training data), the rmf and arf ids from the generator's rmf_list and arf_list, and
+the exposure feature. Rows are written to a .npy file that can be memory mapped, with the
+source names alongside. Parsed spectra are cached by the checksums of their files, so a re-run
+only reads observations that are new or have changed. An observation XSPEC fails to read is
+skipped with a warning, without losing the others.
+"""
+import os
+import glob
+import hashlib
+import warnings
+import multiprocessing
+import numpy as np
+from src.spectra_cache import spectra_cache
+
+n_bins = 995
+
+def file_checksum(path):
+    """
+    Returns
+    -------
+    digest : str
+        Hex sha256 of the contents of a file.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024*1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def find_observations(data_dir = "build/rmf_arf"):
+    """
+    Lists the observations laid out as <data_dir>/<source>/.
+
+    Parameters
+    -------
+    data_dir : str
+        Directory holding one subdirectory per source.
+
+    Returns
+    -------
+    observations : list
+        Dicts of source, pha, arf and rmf (None if the spectrum header names the response)
+        for every source with a spectrum, sorted by source.
+    """
+    observations = []
+    for source in sorted(os.listdir(data_dir)):
+        directory = os.path.join(data_dir, source)
+        if source == "rmfs" or not os.path.isdir(directory):
+            continue
+        spectra = sorted(glob.glob(os.path.join(directory, "*.pha")) + glob.glob(os.path.join(directory, "*.pi")))
+        if not spectra:
+            warnings.warn("No .pha or .pi spectrum found for " + source + ", skipping it")
+            continue
+        rmfs = sorted(glob.glob(os.path.join(directory, "*.rmf")))
+        observations.append({"source": source, "pha": spectra[0], "arf": os.path.join(directory, source + "pc.arf"),
+                             "rmf": rmfs[0] if rmfs else None})
+    return observations
+
+def _try_parse(observation):
+    """
+    Runs _parse, returning the error message instead of raising so one bad observation does
+    not stop the pool.
+
+    Returns
+    -------
+    parsed : dict
+        Output of _parse, or None if it failed.
+    error : str
+        The error, or None.
+    """
+    try:
+        return _parse(observation), None
+    except Exception as error:
+        return None, type(error).__name__ + ": " + str(error)
+
+def _parse(observation):
+    """
+    Extracts the energies and rates of one observation with XSPEC.
+
+    Returns
+    -------
+    parsed : dict
+        energies, rates, exposure and the name of the rmf used.
+    """
+    import xspec
+    xspec.Xset.chatter = -100
+    xspec.Xset.logChatter = -100
+    xspec.AllData.clear()
+    spectrum = xspec.Spectrum(observation["pha"])
+    if observation["rmf"] is not None:
+        spectrum.response = observation["rmf"]
+    spectrum.response.arf = observation["arf"]
+    #Same conventions as generator.__xspec_data_retriever
+    xspec.AllData.ignore("1:1-29")
+    #Nothing is drawn, so parallel workers do not all write pgplot.ps
+    xspec.Plot.device = '/null'
+    xspec.Plot.xAxis = "keV"
+    xspec.Plot.xLog = True
+    xspec.Plot.yLog = True
+    xspec.Plot('data')
+    parsed = {"energies": list(xspec.Plot.x()), "rates": list(xspec.Plot.y()),
+              "exposure": spectrum.exposure, "rmf": os.path.basename(spectrum.response.rmf)}
+    xspec.AllData.clear()
+    return parsed
+
+def to_row(parsed, source, gen):
+    """
+    Lays a parsed observation out as an input row.
+
+    Parameters
+    -------
+    parsed : dict
+        Output of _parse.
+    source : str
+        Name of the source, looked up in gen.arf_list.
+    gen : generator
+        Generator providing the rmf/arf vocabulary and exposure convention.
+
+    Returns
+    -------
+    row : np.ndarray
+        1993 values: energies, rates, rmf id, arf id and exposure feature. Unknown
+        responses get the id -1.
+    """
+    if len(parsed["energies"]) > n_bins:
+        raise ValueError(source + " has " + str(len(parsed["energies"])) + " bins, more than the " + str(n_bins) + " the networks take!")
+    rmf_names = [os.path.basename(rmf) for rmf in gen.rmf_list]
+    if parsed["rmf"] in rmf_names:
+        rmf_number = rmf_names.index(parsed["rmf"])
+    else:
+        warnings.warn(source + " uses " + parsed["rmf"] + ", which is not in rmf_list")
+        rmf_number = -1
+    if source in gen.arf_list:
+        arf_number = gen.arf_list.index(source)
+    else:
+        warnings.warn(source + " is not in arf_list")
+        arf_number = -1
+    row = np.zeros(2*n_bins + 3)
+    row[:len(parsed["energies"])] = parsed["energies"]
+    row[n_bins:n_bins+len(parsed["rates"])] = parsed["rates"]
+    row[2*n_bins:] = [rmf_number, arf_number, gen.exposure_feature(parsed["exposure"])]
+    return row
+
+def ingest(gen, output_path, data_dir = "build/rmf_arf", cache_dir = "ingest_cache", processes = None):
+    """
+    Converts every observation under data_dir into one memory-mappable dataset.
+
+    Parameters
+    -------
+    gen : generator
+        Generator providing the rmf/arf vocabulary and exposure convention.
+    output_path : str
+        .npy file the rows are written to. The source of every row is written, one per line,
+        to the same path with _sources.txt in place of .npy.
+    data_dir : str
+        Directory holding one subdirectory per source.
+    cache_dir : str
+        Directory of the checksum keyed cache of parsed observations.
+    processes : int
+        Number of XSPEC worker processes, defaults to the number of CPU cores.
+
+    Returns
+    -------
+    sources : list
+        Source of every row written. Observations that could not be parsed are left out.
+    """
+    observations = find_observations(data_dir)
+    cache = spectra_cache(cache_dir)
+    parsed = {}
+    missing = []
+    unreadable = []
+    failed = []
+    for observation in observations:
+        files = [observation["pha"], observation["arf"]] + ([observation["rmf"]] if observation["rmf"] else [])
+        try:
+            key = hashlib.sha256(" ".join(file_checksum(path) for path in files).encode()).hexdigest()
+        except OSError as error:
+            warnings.warn("Could not read the files of " + observation["source"] + ", skipping it: " + str(error))
+            unreadable.append(observation["source"])
+            continue
+        cached = cache.get(key)
+        if cached is None:
+            missing.append((key, observation))
+        else:
+            parsed[observation["source"]] = cached
+    if missing:
+        #XSPEC keeps global state, so every worker is a fresh spawned process
+        with multiprocessing.get_context("spawn").Pool(min(processes or os.cpu_count(), len(missing))) as pool:
+            results = pool.map(_try_parse, [observation for _, observation in missing], chunksize = 1)
+        for (key, observation), (result, error) in zip(missing, results):
+            if error is not None:
+                warnings.warn("Could not parse " + observation["pha"] + ", skipping " + observation["source"] + ": " + error)
+                failed.append(observation["source"])
+                continue
+            cache.put(key, result)
+            parsed[observation["source"]] = result
+    print("Ingested " + str(len(parsed)) + " observations, " + str(len(missing) - len(failed)) + " newly parsed, "
+          + str(len(unreadable) + len(failed)) + " failed. " + cache.report())
+    sources = [observation["source"] for observation in observations if observation["source"] in parsed]
+    rows = np.lib.format.open_memmap(output_path, mode = "w+", dtype = np.float64, shape = (len(sources), 2*n_bins + 3))
+    for i, source in enumerate(sources):
+        rows[i] = to_row(parsed[source], source, gen)
+    rows.flush()
+    del rows
+    with open(os.path.splitext(output_path)[0] + "_sources.txt", "w") as f:
+        f.write("\n".join(sources) + "\n")
+    return sources
+
+#Run Script:
+##gen = generator(rmf_list, arf_list)
+##ingest(gen, "Inbetween/real_inputs.npy", processes = 8)
@@ -0,0 +1,301 @@
+"""
+Parameter-space index over generated datasets.
+
+The six normalized labels, the rmf and arf ids and the exposure of every row are kept column by
+column, each with its values sorted and the row ids in that order. A range query finds how many
+rows every bounded column lets through with two binary searches, takes the rows of the most
+selective column as one contiguous slice and checks only those against the other bounds; when
+even that column keeps a large part of the dataset, one pass over the bounded columns is faster
+and is used instead. Nearest-neighbour queries use a grid over the labels, whose bins are chosen
+from the number of rows so that every cell holds a few dozen of them: cells are visited outwards
+from the point until no unvisited cell can hold anything closer than the k-th row found. The
+index is kept next to the dataset as a directory of .npy files that are memory mapped when
+opened, and queries return sorted row ids that can be turned into contiguous slices of the
+dataset memmap.
+"""
+import os
+import json
+import numpy as np
+
+names = ["mass", "dist", "logmdot", "astar", "cosi", "redshift", "rmf", "arf", "exposure"]
+
+def index_path(label_path):
+    return os.path.splitext(label_path)[0] + ".index"
+
+def key_ranges(gen):
+    """
+    Gives the range of every indexed column, from the generator's limits.
+
+    Parameters
+    -------
+    gen : generator
+        Generator the dataset was made with.
+
+    Returns
+    -------
+    lows, highs : np.ndarray
+        Ranges of the labels (normalized to 0-1), rmf ids, arf ids and exposure features.
+    """
+    lows = np.array([0, 0, 0, 0, 0, 0, 0, 0, gen.exposure_feature(gen.exposure_time_min)], dtype = np.float64)
+    highs = np.array([1, 1, 1, 1, 1, 1, len(gen.rmf_list)-1, len(gen.arf_list)-1,
+                      gen.exposure_feature(gen.exposure_time_max)], dtype = np.float64)
+    return lows, highs
+
+def build_index(label_path, input_path, gen, label_bins = None, rows_per_cell = 32, chunk_rows = 262144):
+    """
+    Builds the index of a dataset and saves it next to the labels.
+
+    Parameters
+    -------
+    label_path : str
+        .npy labels of shape (N, 6).
+    input_path : str
+        .npy inputs of shape (N, 1993); only the last three columns are read.
+    gen : generator
+        Generator the dataset was made with, for the ranges of the columns.
+    label_bins : int
+        Bins per label of the nearest-neighbour grid. By default chosen so that a cell holds
+        about rows_per_cell rows.
+    rows_per_cell : int
+        Average rows per cell the default label_bins aims for.
+    chunk_rows : int
+        Rows read at a time.
+
+    Returns
+    -------
+    index : param_index
+    """
+    labels = np.load(label_path, mmap_mode = "r")
+    inputs = np.load(input_path, mmap_mode = "r")
+    if labels.shape[0] != inputs.shape[0]:
+        raise ValueError("Labels and inputs need to have the same number of rows!")
+    n = labels.shape[0]
+    if label_bins is None:
+        #Capped so the table of cell starts stays small (10**6 cells)
+        label_bins = int(np.clip(round((n/rows_per_cell)**(1/6)), 1, 10))
+    lows, highs = key_ranges(gen)
+    directory = index_path(label_path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    #One contiguous row per column, so scanning or binary searching a column reads nothing else
+    keys = np.lib.format.open_memmap(os.path.join(directory, "keys.npy"), mode = "w+", dtype = np.float32,
+                                     shape = (len(names), n))
+    codes = np.empty(n, dtype = np.int64)
+    for start in range(0, n, chunk_rows):
+        stop = min(start+chunk_rows, n)
+        raw = np.concatenate([labels[start:stop], inputs[start:stop, -3:]], axis = 1)
+        unit = (raw - lows)/(highs - lows)
+        keys[:, start:stop] = unit.T
+        #Rows outside the ranges go into the edge cells
+        cell = np.clip(np.floor(unit[:, :6]*label_bins), 0, label_bins-1).astype(np.int64)
+        codes[start:stop] = np.ravel_multi_index(tuple(cell.T), (label_bins,)*6)
+    keys.flush()
+    row_type = np.int32 if n < 2**31 else np.int64
+    sorted_keys = np.lib.format.open_memmap(os.path.join(directory, "sorted.npy"), mode = "w+", dtype = np.float32,
+                                            shape = (len(names), n))
+    orders = np.lib.format.open_memmap(os.path.join(directory, "order.npy"), mode = "w+", dtype = row_type,
+                                       shape = (len(names), n))
+    for i in range(len(names)):
+        column = np.asarray(keys[i])
+        order = np.argsort(column, kind = "stable")
+        sorted_keys[i] = column[order]
+        orders[i] = order
+    sorted_keys.flush()
+    orders.flush()
+    cell_rows = np.argsort(codes, kind = "stable")
+    np.save(os.path.join(directory, "cell_rows.npy"), cell_rows.astype(row_type))
+    np.save(os.path.join(directory, "cell_starts.npy"), np.searchsorted(codes[cell_rows], np.arange(label_bins**6 + 1)))
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump({"label_bins": label_bins, "lows": lows.tolist(), "highs": highs.tolist(), "rows": int(n)}, f)
+    return param_index(directory)
+
+def row_slices(rows):
+    """
+    Groups sorted row ids into contiguous runs, so a memmap can be read as views
+    (memmap[start:stop]) instead of being copied by fancy indexing.
+
+    Parameters
+    -------
+    rows : np.ndarray
+        Sorted row ids.
+
+    Returns
+    -------
+    slices : list
+        List of slice objects covering the rows.
+    """
+    if len(rows) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    run_starts = np.concatenate([[0], breaks])
+    run_stops = np.concatenate([breaks, [len(rows)]])
+    return [slice(int(rows[a]), int(rows[b-1])+1) for a, b in zip(run_starts, run_stops)]
+
+class param_index:
+    #Gathering a value by row id costs about as much as comparing this many values in a scan
+    #(measured on 4M rows), which decides when a query scans the columns instead
+    scan_fraction = 0.1
+
+    def __init__(self, directory):
+        """
+        Opens an index written by build_index, memory mapping its arrays.
+
+        Parameters
+        -------
+        directory : str
+            Index directory, see index_path.
+        """
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if "label_bins" not in meta:
+            raise ValueError("Index in " + directory + " is in an older layout, rebuild it!")
+        self.label_bins = meta["label_bins"]
+        self.lows = np.array(meta["lows"])
+        self.highs = np.array(meta["highs"])
+        self.n = meta["rows"]
+        self.keys = np.load(os.path.join(directory, "keys.npy"), mmap_mode = "r")
+        self.sorted_keys = np.load(os.path.join(directory, "sorted.npy"), mmap_mode = "r")
+        self.orders = np.load(os.path.join(directory, "order.npy"), mmap_mode = "r")
+        self.cell_rows = np.load(os.path.join(directory, "cell_rows.npy"), mmap_mode = "r")
+        self.cell_starts = np.load(os.path.join(directory, "cell_starts.npy"))
+
+    def __to_unit(self, bounds):
+        """
+        Converts {name: (low, high)} in dataset units into unit interval bounds for all columns.
+        Sides that are None or not given are infinite, as rows can lie outside the generator's
+        ranges (e.g. real spectra with unknown responses have rmf and arf ids of -1).
+        """
+        unknown = [name for name in bounds if name not in names]
+        if unknown:
+            raise ValueError("Unknown columns: " + ", ".join(unknown))
+        low = np.full(len(names), -np.inf)
+        high = np.full(len(names), np.inf)
+        for name, (a, b) in bounds.items():
+            i = names.index(name)
+            if a is not None:
+                low[i] = (a - self.lows[i])/(self.highs[i] - self.lows[i])
+            if b is not None:
+                high[i] = (b - self.lows[i])/(self.highs[i] - self.lows[i])
+        #Converted like the keys, so a bound equal to a value keeps its row
+        return low.astype(np.float32), high.astype(np.float32)
+
+    def __scan(self, bounded, low, high, chunk_rows = 262144):
+        """
+        Finds the rows inside a box by comparing every row, a chunk of all bounded columns at a time
+        so the mask stays in cache.
+        """
+        inside = np.empty(self.n, dtype = bool)
+        scratch = np.empty(min(chunk_rows, self.n), dtype = bool)
+        tests = [(i, np.greater_equal, low[i]) for i in bounded if np.isfinite(low[i])]
+        tests += [(i, np.less_equal, high[i]) for i in bounded if np.isfinite(high[i])]
+        for start in range(0, self.n, chunk_rows):
+            stop = min(start+chunk_rows, self.n)
+            chunk = inside[start:stop]
+            (i, compare, bound), others = tests[0], tests[1:]
+            compare(self.keys[i, start:stop], bound, out = chunk)
+            for i, compare, bound in others:
+                chunk &= compare(self.keys[i, start:stop], bound, out = scratch[:stop-start])
+        return np.flatnonzero(inside)
+
+    def range_query(self, bounds):
+        """
+        Finds the rows inside a box.
+
+        Parameters
+        -------
+        bounds : dict
+            Maps column names (see names) to (low, high), either of which may be None. Labels
+            are in normalized units, rmf and arf are ids and exposure is the exposure feature.
+            Columns not given and None sides are unbounded, also beyond the generator's ranges.
+
+        Returns
+        -------
+        rows : np.ndarray
+            Sorted ids of the rows inside the box.
+        """
+        low, high = self.__to_unit(bounds)
+        bounded = [i for i in range(len(names)) if np.isfinite(low[i]) or np.isfinite(high[i])]
+        if not bounded:
+            return np.arange(self.n)
+        #Rows let through by every bounded column, each a contiguous run of its sorted values
+        spans = [(np.searchsorted(self.sorted_keys[i], low[i], "left"), np.searchsorted(self.sorted_keys[i], high[i], "right"))
+                 for i in bounded]
+        best = int(np.argmin([stop-start for start, stop in spans]))
+        start, stop = spans[best]
+        #Checking the slice gathers its rows from every bounded column, a scan compares every
+        #row once per finite side
+        sides = np.isfinite(low[bounded]).sum() + np.isfinite(high[bounded]).sum()
+        if (stop - start)*len(bounded) > self.scan_fraction*self.n*sides:
+            return self.__scan(bounded, low, high)
+        rows = np.asarray(self.orders[bounded[best], start:stop], dtype = np.int64)
+        for i in bounded[:best] + bounded[best+1:]:
+            values = self.keys[i][rows]
+            rows = rows[(values >= low[i]) & (values <= high[i])]
+        return np.sort(rows)
+
+    def __closest(self, rows, used, target, k):
+        """
+        Returns the k of rows (all rows if None) closest to target in the used columns, nearest first.
+        """
+        if rows is None:
+            rows = np.arange(self.n)
+            distances = np.sqrt(sum((self.keys[i] - np.float32(t))**2 for i, t in zip(used, target)))
+        else:
+            distances = np.sqrt(sum((self.keys[i][rows] - np.float32(t))**2 for i, t in zip(used, target)))
+        keep = np.argpartition(distances, k-1)[:k] if len(rows) > k else np.arange(len(rows))
+        keep = keep[np.lexsort((rows[keep], distances[keep]))]
+        return rows[keep], distances[keep]
+
+    def nearest(self, point, k = 10):
+        """
+        Finds the k rows closest to a point, in the unit scaled space of the given columns.
+
+        Parameters
+        -------
+        point : dict
+            Maps column names to values; columns not given are ignored in the distance.
+        k : int
+            Number of neighbours.
+
+        Returns
+        -------
+        rows : np.ndarray
+            Row ids, nearest first.
+        distances : np.ndarray
+            Their distances.
+        """
+        low, _ = self.__to_unit({name: (value, None) for name, value in point.items()})
+        used = [names.index(name) for name in point]
+        target = [float(low[i]) for i in used]
+        bins = self.label_bins
+        #The grid only covers the labels; the other columns add to the distance but are not pruned on
+        centre = {i: int(np.clip(np.floor(t*bins), 0, bins-1)) for i, t in zip(used, target) if i < 6}
+        reach = 0
+        while centre:
+            #Block of cells within reach of the point's cell in every label of the point
+            first = [max(centre[i]-reach, 0) if i in centre else 0 for i in range(6)]
+            last = [min(centre[i]+reach, bins-1) if i in centre else bins-1 for i in range(6)]
+            codes = np.zeros(1, dtype = np.int64)
+            for a, b in zip(first, last):
+                codes = (codes[:, None]*bins + np.arange(a, b+1)).ravel()
+            starts = self.cell_starts[codes]
+            sizes = self.cell_starts[codes+1] - starts
+            if sizes.sum() > self.scan_fraction*self.n or (first.count(0) == 6 and last.count(bins-1) == 6):
+                break
+            offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(sizes)[:-1]]), sizes)
+            rows = np.asarray(self.cell_rows[np.arange(sizes.sum()) + offsets], dtype = np.int64)
+            #Anything outside the block is at least this far away; the edge cells also hold the
+            #rows outside the ranges, so a block reaching an edge is unbounded on that side
+            free = np.inf
+            for i, t in zip(used, target):
+                if i in centre and first[i] > 0:
+                    free = min(free, t - first[i]/bins)
+                if i in centre and last[i] < bins-1:
+                    free = min(free, (last[i]+1)/bins - t)
+            if len(rows) >= k:
+                best_rows, best_distances = self.__closest(rows, used, target, k)
+                if best_distances[-1] <= free:
+                    return best_rows, best_distances
+            reach = max(1, 2*reach)
+        #Too few rows can be pruned, so every row is compared
+        return self.__closest(None, used, target, k)
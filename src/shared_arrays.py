@@ -0,0 +1,419 @@
+"""
+Shared memory registry of read-only arrays for the processes on one host.
+
+Concurrent training trials otherwise each load their own copy of the normalization statistics
+and validation arrays. A parent process publishes them once into multiprocessing.shared_memory
+segments with shared_registry, and passes registry.manifest() (or the path of the manifest
+file) to its children, which attach to the arrays by name without copying; hyper_search's
+trial_runner attaches val_inputs, val_labels, mean and variance this way:
+    with shared_registry() as registry:
+        registry.publish_file("val_inputs", "Inbetween/combined_real_inputs1.npy")
+        ...pool.map(work, [(registry.manifest(), ...)])
+    #in a child
+    val_inputs = attach(manifest, "val_inputs")
+publish_responses also publishes the rmf/arf responses as arrays for numpy code that folds
+spectra itself. The generator and the fitter do not use them: XSPEC loads responses from
+files only, so every XSPEC worker still reads its own copy from disk.
+Segments are named <prefix>_<owner pid>_<n> and unlinked when the registry is closed, at exit,
+or, if the owner crashes, by its resource tracker; cleanup_stale removes whatever is left of
+owners that are no longer running. memory_usage reads the RSS and PSS of a process, in which
+a shared page counts once in total rather than once per process.
+"""
+import os
+import re
+import json
+import atexit
+import inspect
+import itertools
+import tempfile
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+prefix = "agn"
+#Attached segments of this process, kept open for as long as their arrays are used
+_attached = {}
+#Numbers the segments of all registries of this process
+_segment_numbers = itertools.count()
+
+def memory_usage(pid = "self"):
+    """
+    Reads the memory of a process from /proc/<pid>/smaps_rollup (Linux only).
+
+    Returns
+    -------
+    usage : dict
+        Rss, Pss, Shared_Clean, Shared_Dirty, Private_Clean and Private_Dirty in kB (and
+        Pss_Shmem on newer kernels), or an empty dict where smaps_rollup is not available.
+    """
+    path = "/proc/" + str(pid) + "/smaps_rollup"
+    if not os.path.exists(path):
+        return {}
+    usage = {}
+    with open(path) as f:
+        for line in f:
+            match = re.match(r"(\w+):\s+(\d+) kB", line)
+            if match:
+                usage[match.group(1)] = int(match.group(2))
+    return usage
+
+def _fits():
+    #astropy is only needed to read responses, so it is not required by the rest of the registry
+    try:
+        from astropy.io import fits
+    except ImportError:
+        raise ImportError("Reading rmf/arf files needs astropy, install it with pip install astropy!") from None
+    return fits
+
+def read_rmf(path):
+    """
+    Reads an OGIP response matrix into a dense array.
+
+    Returns
+    -------
+    matrix : np.ndarray
+        float32 (energies, channels) redistribution matrix.
+    energies : np.ndarray
+        (energies, 2) lower and upper energies of the rows in keV.
+    """
+    fits = _fits()
+    with fits.open(path, memmap = False) as hdul:
+        hdu = hdul["MATRIX"] if "MATRIX" in hdul else hdul["SPECRESP MATRIX"]
+        data = hdu.data
+        first_channel = hdu.header.get("TLMIN" + str(data.columns.names.index("F_CHAN") + 1), 1)
+        matrix = np.zeros((len(data), hdu.header["DETCHANS"]), dtype = np.float32)
+        for i, row in enumerate(data):
+            values = np.atleast_1d(row["MATRIX"])
+            position = 0
+            for f_chan, n_chan in zip(np.atleast_1d(row["F_CHAN"])[:row["N_GRP"]], np.atleast_1d(row["N_CHAN"])[:row["N_GRP"]]):
+                start = int(f_chan) - first_channel
+                matrix[i, start:start+int(n_chan)] = values[position:position+int(n_chan)]
+                position += int(n_chan)
+        energies = np.stack([data["ENERG_LO"], data["ENERG_HI"]], axis = 1).astype(np.float64)
+    return matrix, energies
+
+def read_arf(path):
+    """
+    Reads an OGIP ancillary response.
+
+    Returns
+    -------
+    area : np.ndarray
+        float32 effective area per energy row, in cm^2.
+    energies : np.ndarray
+        (energies, 2) lower and upper energies of the rows in keV.
+    """
+    fits = _fits()
+    with fits.open(path, memmap = False) as hdul:
+        data = hdul["SPECRESP"].data
+        return np.asarray(data["SPECRESP"], dtype = np.float32), np.stack([data["ENERG_LO"], data["ENERG_HI"]], axis = 1).astype(np.float64)
+
+def _open(name):
+    """
+    Attaches to an existing segment without registering it with this process's resource
+    tracker. Before Python 3.13 attaching always registers, and a process with its own tracker
+    would then unlink the segment when it exits, taking it away from the owner and the other
+    processes; unregistering afterwards instead would drop the owner's registration in a
+    tracker shared with it (as in spawned children), losing the cleanup on a crash.
+    """
+    if "track" in inspect.signature(shared_memory.SharedMemory).parameters:
+        return shared_memory.SharedMemory(name = name, track = False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name = name)
+    finally:
+        resource_tracker.register = register
+
+def _unlink_untracked(name):
+    """
+    Unlinks a segment this process did not create, without telling the resource tracker
+    (which never registered it here) about it.
+    """
+    segment = _open(name)
+    segment.close()
+    unregister = resource_tracker.unregister
+    resource_tracker.unregister = lambda name, rtype: None
+    try:
+        segment.unlink()
+    finally:
+        resource_tracker.unregister = unregister
+    return
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def cleanup_stale(prefix = prefix):
+    """
+    Unlinks the segments and manifests of registries whose owner is no longer running,
+    e.g. after it was killed together with its resource tracker. Linux only, as it lists
+    /dev/shm.
+
+    Returns
+    -------
+    removed : list
+        Names of the removed segments.
+    """
+    removed = []
+    pattern = re.compile(re.escape(prefix) + r"_(\d+)_\d+$")
+    if os.path.isdir("/dev/shm"):
+        for name in os.listdir("/dev/shm"):
+            match = pattern.match(name)
+            if match and not _is_running(int(match.group(1))):
+                try:
+                    _unlink_untracked(name)
+                    removed.append(name)
+                except FileNotFoundError:
+                    pass
+    manifest_pattern = re.compile(re.escape(prefix) + r"_(\d+)\.json$")
+    for name in os.listdir(tempfile.gettempdir()):
+        match = manifest_pattern.match(name)
+        if match and not _is_running(int(match.group(1))):
+            try:
+                os.remove(os.path.join(tempfile.gettempdir(), name))
+            except FileNotFoundError:
+                pass
+    return removed
+
+class shared_registry:
+    def __init__(self, manifest_path = None, prefix = prefix):
+        """
+        Parameters
+        -------
+        manifest_path : str
+            JSON file the manifest is kept in, so processes not started by this one can find
+            the arrays. Defaults to <tmp>/<prefix>_<pid>.json.
+        prefix : str
+            Prefix of the segment names.
+        """
+        self.prefix = prefix
+        self.owner = os.getpid()
+        self.manifest_path = manifest_path or os.path.join(tempfile.gettempdir(), prefix + "_" + str(self.owner) + ".json")
+        self.entries = {}
+        self.__segments = {}
+        self.closed = False
+        cleanup_stale(prefix)
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def publish(self, key, array):
+        """
+        Copies an array into a new shared segment.
+
+        Parameters
+        -------
+        key : str
+            Name the array is attached by.
+        array : np.ndarray
+
+        Returns
+        -------
+        shared : np.ndarray
+            Read-only view of the shared copy.
+        """
+        array = np.asarray(array)
+        shared = self.__create(key, array.shape, array.dtype)
+        shared[...] = array
+        shared.flags.writeable = False
+        return shared
+
+    def publish_file(self, key, npy_path, chunk_rows = 65536):
+        """
+        Copies a .npy file into a new shared segment in chunks, without loading it whole.
+        """
+        source = np.load(npy_path, mmap_mode = "r")
+        shared = self.__create(key, source.shape, source.dtype)
+        for start in range(0, source.shape[0], chunk_rows):
+            shared[start:start+chunk_rows] = source[start:start+chunk_rows]
+        shared.flags.writeable = False
+        return shared
+
+    def publish_responses(self, gen, build_dir = "build", combined = False):
+        """
+        Publishes the response matrix of every rmf in gen.rmf_list as rmf/<rmf_number>, the
+        effective area of every arf in gen.arf_list as arf/<arf_number> and their energy grid
+        as energies. With combined, the product of every rmf and arf is published as well,
+        as response/<rmf_number>/<arf_number>.
+        """
+        energies = None
+        for rmf_number, rmf in enumerate(gen.rmf_list):
+            matrix, energies = read_rmf(os.path.join(build_dir, rmf))
+            self.publish("rmf/" + str(rmf_number), matrix)
+        for arf_number, arf_type in enumerate(gen.arf_list):
+            area, arf_energies = read_arf(os.path.join(build_dir, "rmf_arf", arf_type, arf_type + "pc.arf"))
+            if energies is not None and not np.allclose(arf_energies, energies, rtol = 1e-5):
+                raise ValueError("Energy grid of " + arf_type + " does not match the rmfs!")
+            self.publish("arf/" + str(arf_number), area)
+        self.publish("energies", energies)
+        if combined:
+            for rmf_number in range(len(gen.rmf_list)):
+                for arf_number in range(len(gen.arf_list)):
+                    self.publish("response/" + str(rmf_number) + "/" + str(arf_number),
+                                 response(self.manifest(), rmf_number, arf_number))
+        return
+
+    def __create(self, key, shape, dtype):
+        if self.closed:
+            raise ValueError("Registry is closed!")
+        if key in self.entries:
+            raise ValueError("An array is already published as " + key + "!")
+        name = self.prefix + "_" + str(self.owner) + "_" + str(next(_segment_numbers))
+        nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+        #Registered with the resource tracker, which unlinks it if this process dies
+        segment = shared_memory.SharedMemory(name = name, create = True, size = max(nbytes, 1))
+        self.__segments[key] = segment
+        self.entries[key] = {"name": name, "shape": list(shape), "dtype": np.dtype(dtype).str}
+        self.__write_manifest()
+        return np.ndarray(shape, dtype = dtype, buffer = segment.buf)
+
+    def __write_manifest(self):
+        path = self.manifest_path + ".tmp"
+        with open(path, "w") as f:
+            json.dump(self.manifest(), f)
+        os.replace(path, self.manifest_path)
+        return
+
+    def manifest(self):
+        """
+        Returns
+        -------
+        manifest : dict
+            Owner pid and the segment name, shape and dtype of every array, to pass to attach.
+        """
+        return {"owner": self.owner, "entries": dict(self.entries)}
+
+    def nbytes(self):
+        return sum(int(np.prod(entry["shape"]))*np.dtype(entry["dtype"]).itemsize for entry in self.entries.values())
+
+    def close(self):
+        """
+        Unlinks every segment and removes the manifest. Arrays returned by publish must not
+        be used afterwards.
+        """
+        if self.closed or os.getpid() != self.owner:
+            return
+        self.closed = True
+        for segment in self.__segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                #Views of it are still alive in this process; unlinking still frees it once they go
+                pass
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        self.__segments = {}
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        return
+
+def load_manifest(manifest):
+    """
+    Accepts a manifest dict or the path of a manifest file.
+    """
+    if isinstance(manifest, str):
+        with open(manifest) as f:
+            return json.load(f)
+    return manifest
+
+def attach(manifest, key):
+    """
+    Attaches to a published array without copying it.
+
+    Parameters
+    -------
+    manifest : dict or str
+        From shared_registry.manifest, or the path of its manifest file.
+    key : str
+        Name the array was published as.
+
+    Returns
+    -------
+    array : np.ndarray
+        Read-only view of the shared array.
+    """
+    manifest = load_manifest(manifest)
+    if key not in manifest["entries"]:
+        raise KeyError("No array published as " + key)
+    entry = manifest["entries"][key]
+    if entry["name"] not in _attached:
+        _attached[entry["name"]] = _open(entry["name"])
+    array = np.ndarray(tuple(entry["shape"]), dtype = np.dtype(entry["dtype"]), buffer = _attached[entry["name"]].buf)
+    array.flags.writeable = False
+    return array
+
+def attach_all(manifest):
+    manifest = load_manifest(manifest)
+    return {key: attach(manifest, key) for key in manifest["entries"]}
+
+def detach():
+    """
+    Closes this process's handles of attached segments. Arrays returned by attach must not
+    be used afterwards.
+    """
+    for name in list(_attached):
+        try:
+            _attached.pop(name).close()
+        except BufferError:
+            pass
+    return
+
+def response(manifest, rmf_number, arf_number):
+    """
+    Response (rmf times arf effective area) of a rmf/arf combination, attached if it was
+    published combined, otherwise computed from the shared rmf and arf.
+    """
+    manifest = load_manifest(manifest)
+    key = "response/" + str(rmf_number) + "/" + str(arf_number)
+    if key in manifest["entries"]:
+        return attach(manifest, key)
+    return attach(manifest, "rmf/" + str(rmf_number))*attach(manifest, "arf/" + str(arf_number))[:, None]
+
+def _touch(arguments):
+    """
+    Reads a published array (attached, or a private copy loaded from disk) in a worker and
+    reports the worker's memory.
+    """
+    manifest, key, npy_path = arguments
+    array = np.load(npy_path) if npy_path is not None else attach(manifest, key)
+    total = float(array.sum())
+    return total, memory_usage()
+
+def accounting(npy_path, n_workers = 4):
+    """
+    Compares the memory of workers that each load a private copy of a .npy file against
+    workers attached to one shared copy.
+
+    Returns
+    -------
+    usage : dict
+        For "private" and "shared", the total Rss and Pss of the workers in kB; Pss counts
+        shared pages once across them.
+    """
+    results = {}
+    with shared_registry() as registry:
+        registry.publish_file("array", npy_path)
+        context = multiprocessing.get_context("spawn")
+        for mode, path in [("private", npy_path), ("shared", None)]:
+            with context.Pool(n_workers) as pool:
+                usages = [usage for total, usage in pool.map(_touch, [(registry.manifest(), "array", path)]*n_workers, chunksize = 1)]
+            results[mode] = {"Rss": sum(usage.get("Rss", 0) for usage in usages), "Pss": sum(usage.get("Pss", 0) for usage in usages)}
+    return results
+
+if __name__ == "__main__":
+    import sys
+    usage = accounting(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 4)
+    for mode in ["private", "shared"]:
+        print(mode + ": RSS " + str(round(usage[mode]["Rss"]/1024, 1)) + " MB, PSS " + str(round(usage[mode]["Pss"]/1024, 1)) + " MB in total")
@@ -0,0 +1,196 @@
+"""
+Content-addressed on-disk cache for simulated spectra.
+
+Results of a single XSPEC simulation are stored under the sha256 of everything that
+determines them (model parameters, response files, exposure time, seed and backend version),
+so identical simulations are only ever computed once. Entries are sharded into
+subdirectories named after the first two hex digits of their key, and the total size
+of the store is capped by evicting the least recently used entries.
+"""
+import os
+import hashlib
+import pickle
+import tempfile
+from collections import OrderedDict
+
+class spectra_cache:
+    def __init__(self, cache_dir, max_bytes = 2*1024**3):
+        if type(max_bytes) != int or max_bytes <= 0:
+            raise ValueError("max_bytes needs to be a positive integer!")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        #Content hashes of the response files, so each file is only read once
+        self.__file_digests = {}
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.__entries = self.__scan()
+        self.total_bytes = sum(self.__entries.values())
+
+    def __scan(self):
+        """
+        Finds the entries already present in the cache directory.
+
+        Returns
+        -------
+        entries : OrderedDict
+            Maps each entry path to its size in bytes, least recently used first.
+        """
+        found = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".pkl"):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.path, stat.st_size))
+        found.sort()
+        return OrderedDict((path, size) for _, path, size in found)
+
+    def __file_digest(self, path):
+        """
+        Hashes the contents of a response file.
+
+        Parameters
+        -------
+        path : str
+            Path to the rmf or arf.
+
+        Returns
+        -------
+        digest : str
+            Hex sha256 of the file contents.
+        """
+        stat = os.stat(path)
+        memo_key = (path, stat.st_size, stat.st_mtime)
+        if memo_key not in self.__file_digests:
+            sha = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024*1024), b""):
+                    sha.update(block)
+            self.__file_digests[memo_key] = sha.hexdigest()
+        return self.__file_digests[memo_key]
+
+    def key(self, params, rmf, arf, exposure_time, seed, version):
+        """
+        Builds the content address of a simulation.
+
+        Parameters
+        -------
+        params : list
+            Unnormalized QSOSED parameters [mass, dist, logmdot, astar, cosi, redshift].
+        rmf : str
+            Path to the rmf used.
+        arf : str
+            Path to the arf used.
+        exposure_time : int
+            Exposure time of the simulated observation in seconds.
+        seed : tuple or None
+            Random state of the simulator, or None when it has not been seeded.
+        version : str
+            Version of the simulation backend.
+
+        Returns
+        -------
+        key : str
+            Hex sha256 identifying the simulation.
+        """
+        description = repr((tuple(float(p) for p in params), self.__file_digest(rmf), self.__file_digest(arf),
+                            float(exposure_time), seed, str(version)))
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def get(self, key):
+        """
+        Retrieves a cached simulation, marking it as recently used.
+
+        Parameters
+        -------
+        key : str
+            Content address returned by key().
+
+        Returns
+        -------
+        value : object or None
+            The cached simulation, or None on a miss.
+        """
+        path = self.__path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        #The modification time records recency for the next time the directory is scanned
+        os.utime(path)
+        if path in self.__entries:
+            self.__entries.move_to_end(path)
+        else:
+            #Written by another process since this cache was opened
+            self.__entries[path] = os.path.getsize(path)
+            self.total_bytes += self.__entries[path]
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Stores a simulation, evicting old entries if the size cap is exceeded.
+
+        Parameters
+        -------
+        key : str
+            Content address returned by key().
+        value : object
+            Picklable simulation result.
+        """
+        path = self.__path(key)
+        shard = os.path.dirname(path)
+        if not os.path.exists(shard):
+            os.makedirs(shard, exist_ok = True)
+        #Written to a temporary file first so a crash never leaves a truncated entry
+        fd, tmp_path = tempfile.mkstemp(dir = shard, suffix = ".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        if path in self.__entries:
+            self.total_bytes -= self.__entries.pop(path)
+        self.__entries[path] = size
+        self.total_bytes += size
+        self.__evict()
+        return
+
+    def __evict(self):
+        """
+        Removes least recently used entries until the store is under its size cap.
+        """
+        while self.total_bytes > self.max_bytes and self.__entries:
+            path, size = self.__entries.popitem(last = False)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+            self.evictions += 1
+        return
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits/lookups if lookups else 0.0
+
+    def report(self):
+        """
+        Summarizes the cache usage.
+
+        Returns
+        -------
+        summary : str
+            Hits, misses, hit rate, evictions and store size.
+        """
+        return ("Spectra cache: " + str(self.hits) + " hits, " + str(self.misses) + " misses ("
+                + str(round(100*self.hit_rate(), 1)) + "% hit rate), " + str(self.evictions) + " evictions, "
+                + str(len(self.__entries)) + " entries using " + str(round(self.total_bytes/1024**2, 1)) + " MB")
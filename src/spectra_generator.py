@@ -5,13 +5,12 @@ Citations:
 xspec: Arnaud, K.A., 1996, Astronomical Data Analysis Software and Systems V, eds. Jacoby G. and Barnes J., p17, ASP Conf. Series volume 101.
 """
 import sys
-import xspec
-import matplotlib.pyplot as plt
 import random
 import math
 import pickle
 import os
 import warnings
+import numpy as np
 
 #The RMF and ARF names
 rmf_list = ['rmf_arf/rmfs/swxpc0to12s0_20010101v010.rmf', 'rmf_arf/rmfs/swxpc0to12s6_20010101v010.rmf']
@@ -39,6 +38,16 @@ class generator:
         self.exposure_time_max = 20000
         #For testing purposes
         self.test = False
+        #Optional spectra_cache placed in front of XSPEC
+        self.cache = None
+        #Seed of the parameter draws and of XSPEC, the spectra cache is only used when it is set
+        self.seed = None
+        #Seed of the current run of simulations and number of spectra drawn since seeding
+        self.__runs = 0
+        self.__run_seed = None
+        self.__draws = 0
+        self.__seeded_hits = 0
+        self.__cache_bypassed = False
         
     def __rmf_picker(self):
         """
@@ -68,9 +77,11 @@ class generator:
             Numerical representation of arf
         """
         number = random.randint(0,14)
+        return self.__arf_location(number), number
+
+    def __arf_location(self, number):
         arf_type = self.arf_list[number]
-        arf_location = 'rmf_arf/' + arf_type + '/' +arf_type + 'pc.arf'
-        return arf_location, number
+        return 'rmf_arf/' + arf_type + '/' +arf_type + 'pc.arf'
     
     def __param_selector(self):
         """
@@ -189,6 +200,8 @@ class generator:
                 raise TypeError("Parameters need to be numbers!") 
         if mass < self.mass_min*10**6 or mass > self.mass_max*10**6 or dist < self.dist_min or dist > self.dist_max  or logmdot < self.logmdot_min or logmdot > self.logmdot_max  or astar < self.astar_min or astar > self.astar_max  or cosi > math.cos(math.radians(self.i_min)) or cosi < math.cos(math.radians(self.i_max))  or redshift < self.redshift_min or redshift > self.redshift_max  or exposure_time < self.exposure_time_min or exposure_time > self.exposure_time_max:
             raise ValueError("Parameters are out of defined bounds!")
+        #Imported here so the module can be loaded without XSPEC
+        import xspec
         xspec.Xset.chatter = -100
         xspec.Xset.logChatter = -100
         data = xspec.AllData
@@ -213,6 +226,38 @@ class generator:
         xspec.AllModels.clear()
         return energies, rates, [energy_err, rate_err, modvals]
 
+    def __cached_data_retriever(self, mass, dist, logmdot, astar, cosi, redshift, nSpectra, rmf, arf, exposure_time, counter):
+        """
+        Looks the simulation up in self.cache before falling back to XSPEC.
+        Takes the same parameters and returns the same values as __xspec_data_retriever.
+
+        Only seeded simulations are cached: without a seed every simulation is an independent
+        Poisson draw, and returning a stored one would repeat its noise. When seeded, a
+        simulation also depends on how many spectra were drawn before it, so the draw index is
+        part of the key. A miss after a hit would leave XSPEC's random state behind the keys,
+        so the cache is bypassed for the rest of such a run.
+        """
+        if self.cache is None or self.__run_seed is None or self.__cache_bypassed:
+            return self.__xspec_data_retriever(mass, dist, logmdot, astar, cosi, redshift,
+                                               nSpectra, rmf, arf, exposure_time, counter)
+        import xspec
+        seed = (self.__run_seed, self.__draws)
+        self.__draws += nSpectra
+        key = self.cache.key([mass, dist, logmdot, astar, cosi, redshift], rmf, arf, exposure_time,
+                             seed, xspec.Xset.version)
+        cached = self.cache.get(key)
+        if cached is not None:
+            energies, rates, uncertainty_list = cached
+            return list(energies), list(rates), uncertainty_list
+        if self.cache.hits > self.__seeded_hits:
+            warnings.warn("Seeded run diverged from the cache, bypassing it for the remaining spectra")
+            self.__cache_bypassed = True
+        result = self.__xspec_data_retriever(mass, dist, logmdot, astar, cosi, redshift,
+                                             nSpectra, rmf, arf, exposure_time, counter)
+        if not self.__cache_bypassed:
+            self.cache.put(key, result)
+        return result
+
     def looper(self, num_of_iterations):
         """
         Outward facing function which generates a given number of AGN spectra.
@@ -241,9 +286,11 @@ class generator:
         counter = 0
         nSpectra = 1
         if self.test:
+            import xspec
             xspec.Xset.seed = 1
             if num_of_iterations > 10000:
                 return
+        self.__begin_run()
         for i in range(num_of_iterations):
             #Pick RMF,ARF
             rmf, rmf_number = self.__rmf_picker()
@@ -252,24 +299,134 @@ class generator:
             arf = "build/"+ arf
             #Define Parameters
             mass, dist, logmdot, astar, cosi, redshift, exposure_time, normalized_labels = self.__param_selector()
-            energies, rates, uncertainty_list = self.__xspec_data_retriever(mass, dist, logmdot, astar, cosi,
+            energies, rates, uncertainty_list = self.__cached_data_retriever(mass, dist, logmdot, astar, cosi,
                                                    redshift, nSpectra, rmf, arf, exposure_time,
                                                    counter)
             #Ensure data is bright enough
             while sum(rates)/exposure_time < 0.001:
                 mass, dist, logmdot, astar, cosi, redshift, exposure_time, normalized_labels = self.__param_selector()
-                energies, rates, uncertainty_list = self.__xspec_data_retriever(mass, dist, logmdot, astar, cosi,
+                energies, rates, uncertainty_list = self.__cached_data_retriever(mass, dist, logmdot, astar, cosi,
                                                        redshift, nSpectra, rmf, arf, exposure_time,
                                                        counter)
             answers[i] = normalized_labels
-            energies.extend(rates)
-            energies.append(rmf_number)
-            energies.append(arf_number)
-            energies.append(exposure_time-self.exposure_time_min/(self.exposure_time_max-self.exposure_time_min))
-            inputs[i] = energies
+            inputs[i] = self.__input_row(energies, rates, rmf_number, arf_number, exposure_time)
             uncertainties[i] = uncertainty_list
+        if self.cache is not None:
+            print(self.cache.report())
         return answers, inputs, uncertainties
 
+    def __begin_run(self):
+        """
+        Resets the draw count and cache state at the start of a run of simulations. With a seed,
+        Python's random (which draws the parameters) and XSPEC are both seeded, so the n-th run of
+        a seeded generator repeats its spectra and cache keys. Every run gets its own seed so
+        runs of one generator do not repeat each other's noise.
+        """
+        self.__draws = 0
+        self.__cache_bypassed = False
+        self.__run_seed = None
+        if self.seed is not None:
+            self.__run_seed = self.seed + self.__runs
+            random.seed(self.__run_seed)
+            import xspec
+            xspec.Xset.seed = self.__run_seed
+        self.__runs += 1
+        if self.cache is not None:
+            self.__seeded_hits = self.cache.hits
+
+    def __input_row(self, energies, rates, rmf_number, arf_number, exposure_time):
+        """
+        Lays out one input row: energies, rates, rmf_number, arf_number, exposure feature.
+        """
+        row = list(energies)
+        row.extend(rates)
+        row.append(rmf_number)
+        row.append(arf_number)
+        row.append(self.exposure_feature(exposure_time))
+        return row
+
+    def draw_parameters(self, num_of_proposals):
+        """
+        Draws parameter sets from the prior used by looper, without simulating them.
+
+        Parameters
+        -------
+        num_of_proposals : int
+            Number of parameter sets to draw.
+
+        Returns
+        -------
+        proposals : list
+            List of [rmf_number, arf_number, mass, dist, logmdot, astar, cosi, redshift,
+            exposure_time, normalized_labels], to pass to simulate.
+        """
+        proposals = []
+        for i in range(num_of_proposals):
+            rmf, rmf_number = self.__rmf_picker()
+            arf, arf_number = self.__arf_picker()
+            proposals.append([rmf_number, arf_number] + list(self.__param_selector()))
+        return proposals
+
+    def simulate(self, proposals):
+        """
+        Generates the spectra of given parameter sets, e.g. those chosen from draw_parameters.
+        Unlike looper, parameters giving a spectrum too faint to use are not redrawn but dropped.
+
+        Parameters
+        -------
+        proposals : list
+            Parameter sets laid out as returned by draw_parameters.
+
+        Returns
+        -------
+        answers : list
+            Y data for NN.
+        inputs : list
+            X data for NN.
+        uncertainties : list
+            Uncertainty data for NN.
+        kept : list
+            Indices of the proposals that were kept.
+        """
+        answers = []
+        inputs = []
+        uncertainties = []
+        kept = []
+        self.__begin_run()
+        for i, proposal in enumerate(proposals):
+            rmf_number, arf_number, mass, dist, logmdot, astar, cosi, redshift, exposure_time, normalized_labels = proposal
+            rmf = "build/" + self.rmf_list[rmf_number]
+            arf = "build/" + self.__arf_location(arf_number)
+            energies, rates, uncertainty_list = self.__cached_data_retriever(mass, dist, logmdot, astar, cosi,
+                                                   redshift, 1, rmf, arf, exposure_time, 0)
+            #Ensure data is bright enough
+            if sum(rates)/exposure_time < 0.001:
+                continue
+            answers.append(normalized_labels)
+            inputs.append(self.__input_row(energies, rates, rmf_number, arf_number, exposure_time))
+            uncertainties.append(uncertainty_list)
+            kept.append(i)
+        if self.cache is not None:
+            print(self.cache.report())
+        return answers, inputs, uncertainties, kept
+
+    def exposure_feature(self, exposure_time):
+        """
+        Converts an exposure time into the last element of an input row. Shared with the ingestion
+        of real spectra, so real and simulated rows follow the same convention.
+
+        Parameters
+        -------
+        exposure_time : int
+            Exposure time of the observation in seconds.
+
+        Returns
+        -------
+        feature : float
+            The value stored in the input row.
+        """
+        return exposure_time-self.exposure_time_min/(self.exposure_time_max-self.exposure_time_min)
+
     def plotter(x,y):
         """
         Creates a scatter plot.
@@ -282,10 +439,40 @@ class generator:
         y : list
             y data to plot.   
         """
+        import matplotlib.pyplot as plt
         plt.scatter(x,y)
         plt.show()
         return
 
+    def __is_numerical(self, values):
+        """
+        Checks that a (possibly nested) list only holds numbers, converting it to an array in one
+        go rather than checking every element. Ragged lists fall back to checking every sublist.
+
+        Parameters
+        -------
+        values : list
+            List to check.
+
+        Returns
+        -------
+        numerical : bool
+        """
+        try:
+            array = np.asarray(values)
+        except ValueError:
+            #Ragged nested lists can not be made into an array
+            array = None
+        if array is not None and array.dtype.kind != "O":
+            return array.dtype.kind in "iuf"
+        for vals in values:
+            if isinstance(vals, (list, tuple)):
+                if not self.__is_numerical(vals):
+                    return False
+            elif type(vals) != int and type(vals) != float:
+                return False
+        return True
+
     def saver(self, answers, inputs, uncertainties, number):
         """
         Saves the lists to the disk. 
@@ -313,9 +500,8 @@ class generator:
         if len(uncertainties) != 3:
             raise ValueError('uncertainties list should contain exactly 3 lists')
         for lists in all_list:
-            for vals in lists:
-                if type(vals) != int and type(vals) != float:
-                    raise ValueError("All elements of given list must be numerical!")
+            if not self.__is_numerical(lists):
+                raise ValueError("All elements of given list must be numerical!")
         with open('label'+str(number), "wb") as f:
             pickle.dump(answers, f)
         with open('inputs'+str(number), "wb") as f:
@@ -327,5 +513,7 @@ class generator:
 #Run Script:
 ##num_of_iterations = 300
 ##gen = generator(rmf_list, arf_list)
+##gen.seed = 1 #Optional, repeats the run and lets the cache below be used
+##gen.cache = spectra_cache("spectra_cache") #Optional, from spectra_cache.py
 ##answers, inputs, uncertainties = gen.looper(num_of_iterations)
 
@@ -0,0 +1,421 @@
+"""
+Batched maximum-likelihood fitting of the QSOSED parameters, used as the standard spectral-fitting
+baseline the network predictions on the real AGN are compared against.
+
+Every source is fitted in its own worker process (each with its own XSPEC session) using the
+C-statistic. Fits start from the best point of a bank of folded QSOSED templates evaluated once
+per response: the C-statistic of every spectrum against every template is computed in a single
+vectorized numpy call, which also gives the starting points of all bootstrap resamples at once.
+Error bars come from a parametric bootstrap: resamples are faked from the best fit with the
+same response and exposure, and refitted in parallel.
+
+The response files and parameter bounds are taken from a spectra_generator.generator, so fits
+and simulations share the same responses and limits: the rmf of every spectrum (given, or named
+in its header) is matched by file name against gen.rmf_list and the generator's copy, found
+under the build directory like spectra_generator.looper does, is used.
+A failed fit only fails its own source, whose result then holds the error.
+"""
+import os
+import glob
+import math
+import shutil
+import tempfile
+import warnings
+import multiprocessing
+import numpy as np
+
+param_names = ["mass", "dist", "logmdot", "astar", "cosi", "redshift"]
+
+def cstat(counts, model_counts):
+    """
+    Computes the C-statistic (Cash 1979, in the form used by XSPEC) of observed counts against
+    model counts. Leading axes broadcast, so many spectra can be compared against many models
+    in one call.
+
+    Parameters
+    -------
+    counts : np.ndarray
+        Observed counts, shape (..., n_channels).
+    model_counts : np.ndarray
+        Predicted counts, shape broadcastable to counts.
+
+    Returns
+    -------
+    statistic : np.ndarray
+        C-statistic summed over the channel axis.
+    """
+    counts = np.asarray(counts, dtype = np.float64)
+    model_counts = np.maximum(np.asarray(model_counts, dtype = np.float64), 1e-10)
+    #d*ln(d/m) vanishes for empty channels
+    log_term = np.where(counts > 0, counts*(np.log(np.maximum(counts, 1e-300)) - np.log(model_counts)), 0.0)
+    return 2*np.sum(model_counts - counts + log_term, axis = -1)
+
+def parameter_bounds(gen):
+    """
+    Gives the QSOSED parameter limits used by the generator, in the units XSPEC expects.
+
+    Parameters
+    -------
+    gen : generator
+        Generator whose limits are used.
+
+    Returns
+    -------
+    bounds : np.ndarray
+        Array of shape (6, 2) of [min, max] for mass, dist, logmdot, astar, cosi and redshift.
+    """
+    return np.array([[gen.mass_min*10**6, gen.mass_max*10**6],
+                     [gen.dist_min, gen.dist_max],
+                     [gen.logmdot_min, gen.logmdot_max],
+                     [gen.astar_min, gen.astar_max],
+                     [math.cos(math.radians(gen.i_max)), math.cos(math.radians(gen.i_min))],
+                     [gen.redshift_min, gen.redshift_max]], dtype = np.float64)
+
+def normalize(params, bounds):
+    """
+    Normalizes fitted parameters to the [0, 1] labels the networks predict, as
+    generator.__normalizer does for single values.
+
+    Parameters
+    -------
+    params : np.ndarray
+        Parameters of shape (..., 6).
+    bounds : np.ndarray
+        Limits from parameter_bounds.
+
+    Returns
+    -------
+    normalized : np.ndarray
+    """
+    return (np.asarray(params) - bounds[:, 0])/(bounds[:, 1] - bounds[:, 0])
+
+def template_parameters(bounds, n_templates, frozen = None, seed = 0):
+    """
+    Spreads template parameters over the bounds with a Latin hypercube.
+
+    Parameters
+    -------
+    bounds : np.ndarray
+        Limits from parameter_bounds.
+    n_templates : int
+        Number of templates.
+    frozen : dict
+        Maps parameter indices to fixed values, e.g. {5: redshift} for a source of known redshift.
+
+    Returns
+    -------
+    params : np.ndarray
+        Array of shape (n_templates, 6).
+    """
+    rng = np.random.default_rng(seed)
+    strata = np.argsort(rng.random((n_templates, 6)), axis = 0)
+    unit = (strata + rng.random((n_templates, 6)))/n_templates
+    params = bounds[:, 0] + unit*(bounds[:, 1] - bounds[:, 0])
+    for index, value in (frozen or {}).items():
+        params[:, index] = value
+    return params
+
+def find_source_files(source, data_dir = "build/rmf_arf"):
+    """
+    Locates the spectrum and arf of a real source in the build/rmf_arf/<source>/ layout.
+
+    Returns
+    -------
+    pha : str
+        Path to the source spectrum (.pha or .pi).
+    arf : str
+        Path to the arf.
+    """
+    directory = os.path.join(data_dir, source)
+    spectra = sorted(glob.glob(os.path.join(directory, "*.pha")) + glob.glob(os.path.join(directory, "*.pi")))
+    if not spectra:
+        raise FileNotFoundError("No .pha or .pi spectrum found for " + source + " in " + directory)
+    return spectra[0], os.path.join(directory, source + "pc.arf")
+
+def match_rmf(rmf, rmf_list):
+    """
+    Finds the response of rmf_list with the same file name as rmf, as ingest.to_row does.
+
+    Returns
+    -------
+    match : str
+        The entry of rmf_list, or None if no entry has that file name.
+    """
+    names = [os.path.basename(path) for path in rmf_list]
+    name = os.path.basename(rmf)
+    return rmf_list[names.index(name)] if name in names else None
+
+def response_files(gen, build_dir = "build"):
+    """
+    Paths of the rmfs of gen.rmf_list, whose entries are relative to the build directory.
+
+    Returns
+    -------
+    rmf_list : list
+        Path of every entry of gen.rmf_list, in the same order.
+    """
+    return [os.path.join(build_dir, rmf) for rmf in gen.rmf_list]
+
+def _error_message(error):
+    return type(error).__name__ + ": " + str(error)
+
+class fit_task:
+    def __init__(self, name, pha, arf, rmf = None, frozen = None):
+        """
+        Describes one spectrum to fit.
+
+        Parameters
+        -------
+        name : str
+            Name of the source.
+        pha : str
+            Path to the spectrum.
+        arf : str
+            Path to the arf.
+        rmf : str
+            Path to the rmf. If not given, the response named in the spectrum header is used.
+            Either way, fit_many replaces it by the entry of gen.rmf_list with the same name.
+        frozen : dict
+            Maps parameter indices to values held fixed during the fit.
+        """
+        self.name = name
+        self.pha = pha
+        self.arf = arf
+        self.rmf = rmf
+        self.frozen = frozen or {}
+
+#Per process XSPEC state
+_banks = {}
+
+def _setup_xspec():
+    import xspec
+    xspec.Xset.chatter = -100
+    xspec.Xset.logChatter = -100
+    xspec.Fit.statMethod = "cstat"
+    xspec.Fit.query = "yes"
+    return xspec
+
+def _load(xspec, pha, rmf, arf):
+    """
+    Loads a spectrum with its response, noticing the same channels as the generator.
+
+    Returns
+    -------
+    spectrum : xspec.Spectrum
+    counts : np.ndarray
+        Counts in the noticed channels.
+    """
+    xspec.AllData.clear()
+    spectrum = xspec.Spectrum(pha)
+    if rmf is not None:
+        spectrum.response = rmf
+    if arf is not None:
+        spectrum.response.arf = arf
+    #Ignores everything below 0.3 keV, as in generator.__xspec_data_retriever
+    xspec.AllData.ignore("1:1-29")
+    xspec.AllData.ignore("bad")
+    counts = np.rint(np.asarray(spectrum.values)*spectrum.exposure)
+    return spectrum, counts
+
+def _set_parameters(model, params, bounds, frozen):
+    for index in range(6):
+        par = getattr(model.qsosed, model.qsosed.parameterNames[index])
+        low, high = bounds[index]
+        value = min(max(params[index], low), high)
+        par.values = [value, abs(high-low)*1e-3, low, low, high, high]
+        par.frozen = index in frozen
+    #The QSOSED normalization has to stay at 1
+    model.qsosed.norm.frozen = True
+    return
+
+def _load_response(xspec, task, rmf_list):
+    """
+    Loads the spectrum of a task with the generator's copy of its rmf.
+
+    Returns
+    -------
+    spectrum : xspec.Spectrum
+    counts : np.ndarray
+        Counts in the noticed channels.
+    rmf : str
+        Path of the rmf used.
+    matched : bool
+        Whether the rmf is one of rmf_list.
+    """
+    spectrum, counts = _load(xspec, task.pha, task.rmf, task.arf)
+    match = match_rmf(spectrum.response.rmf, rmf_list)
+    if match is None:
+        return spectrum, counts, spectrum.response.rmf, False
+    if match != spectrum.response.rmf:
+        spectrum, counts = _load(xspec, task.pha, match, task.arf)
+    return spectrum, counts, match, True
+
+def _bank(xspec, spectrum, task, bounds, n_templates, seed):
+    """
+    Evaluates the folded template bank for a response, once per process.
+
+    Returns
+    -------
+    params : np.ndarray
+        Template parameters, shape (n_templates, 6).
+    model_counts : np.ndarray
+        Folded model counts in the noticed channels, shape (n_templates, n_channels).
+    """
+    #Keyed by the rmf loaded, which may come from the spectrum header
+    key = (spectrum.response.rmf, task.arf, round(spectrum.exposure), tuple(sorted(task.frozen.items())), n_templates, seed)
+    if key not in _banks:
+        params = template_parameters(bounds, n_templates, task.frozen, seed)
+        model = xspec.Model("qsosed")
+        model_counts = np.empty((n_templates, len(spectrum.noticed)))
+        for i, row in enumerate(params):
+            model.setPars(*[float(value) for value in row])
+            model_counts[i] = np.asarray(model.folded(1))*spectrum.exposure
+        _banks[key] = (params, model_counts)
+    return _banks[key]
+
+def _fit(xspec, start, bounds, frozen):
+    """
+    Runs the C-statistic fit of the loaded spectrum from a starting point.
+
+    Returns
+    -------
+    params : np.ndarray
+        Best fit parameters.
+    statistic : float
+    dof : int
+    """
+    model = xspec.Model("qsosed")
+    _set_parameters(model, start, bounds, frozen)
+    xspec.Fit.nIterations = 1000
+    xspec.Fit.perform()
+    params = np.array([getattr(model.qsosed, name).values[0] for name in model.qsosed.parameterNames[:6]])
+    return params, xspec.Fit.statistic, xspec.Fit.dof
+
+def _fit_source(arguments):
+    task, bounds, n_templates, seed, rmf_list = arguments
+    try:
+        xspec = _setup_xspec()
+        spectrum, counts, rmf, matched = _load_response(xspec, task, rmf_list)
+        bank_params, bank_counts = _bank(xspec, spectrum, task, bounds, n_templates, seed)
+        start = bank_params[np.argmin(cstat(counts, bank_counts))]
+        params, statistic, dof = _fit(xspec, start, bounds, task.frozen)
+    except Exception as error:
+        return {"name": task.name, "error": _error_message(error)}
+    return {"name": task.name, "params": params, "cstat": statistic, "dof": dof, "exposure": spectrum.exposure,
+            "rmf": rmf, "rmf_matched": matched}
+
+def _bootstrap_chunk(arguments):
+    task, bounds, best, exposure, n_resamples, n_templates, seed = arguments
+    try:
+        return task.name, _bootstrap(task, bounds, best, exposure, n_resamples, n_templates, seed), None
+    except Exception as error:
+        return task.name, None, _error_message(error)
+
+def _bootstrap(task, bounds, best, exposure, n_resamples, n_templates, seed):
+    xspec = _setup_xspec()
+    work_dir = tempfile.mkdtemp(prefix = "bootstrap")
+    try:
+        spectrum, _ = _load(xspec, task.pha, task.rmf, task.arf)
+        bank_params, bank_counts = _bank(xspec, spectrum, task, bounds, n_templates, 0)
+        rmf = spectrum.response.rmf
+        arf = spectrum.response.arf
+        xspec.Xset.seed = seed
+        #Fakes every resample first so their starting points are found in one vectorized call
+        files = []
+        counts = np.empty((n_resamples, bank_counts.shape[1]))
+        for b in range(n_resamples):
+            xspec.AllData.clear()
+            model = xspec.Model("qsosed")
+            _set_parameters(model, best, bounds, task.frozen)
+            files.append(os.path.join(work_dir, str(b) + ".fak"))
+            xspec.AllData.fakeit(1, [xspec.FakeitSettings(response = rmf, arf = arf, exposure = exposure,
+                                                          fileName = files[-1])], applyStats = True)
+            xspec.AllData.ignore("1:1-29")
+            xspec.AllData.ignore("bad")
+            counts[b] = np.rint(np.asarray(xspec.AllData(1).values)*exposure)
+        starts = bank_params[np.argmin(cstat(counts[:, None, :], bank_counts[None, :, :]), axis = 1)]
+        samples = np.empty((n_resamples, 6))
+        for b in range(n_resamples):
+            _load(xspec, files[b], rmf, arf)
+            samples[b] = _fit(xspec, starts[b], bounds, task.frozen)[0]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+    return samples
+
+def fit_many(tasks, gen, n_bootstrap = 100, n_templates = 512, processes = None, chunk_size = 10, seed = 1,
+             build_dir = "build"):
+    """
+    Fits the QSOSED model to many spectra concurrently, with bootstrap error bars.
+
+    Parameters
+    -------
+    tasks : list
+        List of fit_task.
+    gen : generator
+        Generator providing the parameter bounds and the rmfs.
+    n_bootstrap : int
+        Bootstrap resamples per source, 0 to skip the error bars.
+    n_templates : int
+        Size of the template bank used for starting points.
+    processes : int
+        Number of worker processes, defaults to the number of CPU cores.
+    chunk_size : int
+        Bootstrap resamples fitted per worker task.
+    seed : int
+        Seed of the bootstrap resamples.
+    build_dir : str
+        Directory the entries of gen.rmf_list are relative to.
+
+    Returns
+    -------
+    results : list
+        One dict per task with name, params, normalized (the network's label scale), cstat, dof,
+        rmf (the response used), rmf_matched (whether it is one of gen.rmf_list), and when
+        bootstrapped, samples, lower and upper (16th and 84th percentiles). A source whose fit
+        failed only has name and error; failed bootstrap chunks are listed in bootstrap_errors,
+        and the percentiles come from the resamples that succeeded.
+    """
+    if type(n_bootstrap) != int or n_bootstrap < 0:
+        raise ValueError("n_bootstrap needs to be a non-negative integer!")
+    bounds = parameter_bounds(gen)
+    rmf_list = response_files(gen, build_dir)
+    processes = processes or os.cpu_count()
+    #XSPEC keeps global state, so every worker is a fresh spawned process
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        results = pool.map(_fit_source, [(task, bounds, n_templates, 0, rmf_list) for task in tasks], chunksize = 1)
+        chunks = []
+        for task, result in zip(tasks, results):
+            if "error" in result:
+                warnings.warn("Fit of " + task.name + " failed: " + result["error"])
+                continue
+            if not result["rmf_matched"]:
+                warnings.warn(task.name + " uses " + os.path.basename(result["rmf"]) + ", which is not in rmf_list")
+            #Resamples are faked with the response the source was fitted with
+            resolved = fit_task(task.name, task.pha, task.arf, result["rmf"], task.frozen)
+            for start in range(0, n_bootstrap, chunk_size):
+                chunks.append((resolved, bounds, result["params"], result["exposure"], min(chunk_size, n_bootstrap-start),
+                               n_templates, seed + len(chunks)))
+        samples = {}
+        errors = {}
+        for name, chunk, error in pool.imap(_bootstrap_chunk, chunks):
+            if error is None:
+                samples.setdefault(name, []).append(chunk)
+            else:
+                errors.setdefault(name, []).append(error)
+    for result in results:
+        if "error" in result:
+            continue
+        result["normalized"] = normalize(result["params"], bounds)
+        if result["name"] in errors:
+            result["bootstrap_errors"] = errors[result["name"]]
+            warnings.warn(str(len(errors[result["name"]])) + " bootstrap chunks of " + result["name"] + " failed: "
+                          + errors[result["name"]][0])
+        if result["name"] in samples:
+            result["samples"] = np.concatenate(samples[result["name"]])
+            result["lower"], result["upper"] = np.percentile(result["samples"], [16, 84], axis = 0)
+    return results
+
+#Run Script:
+##gen = generator(rmf_list, arf_list)
+##tasks = [fit_task(source, *find_source_files(source)) for source in os.listdir("build/rmf_arf") if source != "rmfs"]
+##results = fit_many(tasks, gen, n_bootstrap = 100, processes = 8)
@@ -0,0 +1,254 @@
+"""
+Training throughput instrumentation.
+
+Inside Keras' compiled train function the wait for the next batch cannot be told apart from the
+dense stack, and timing the steps from the batch hooks makes Keras convert the logs to numpy,
+which syncs the host every step. Instead time_steps replaces the train function with one that
+fetches the batch from the iterator itself and then runs the compiled step on it: the time
+next(iterator) blocks is the time the step waited for its input (with prefetching this is only
+the part of the memmap reads not hidden behind the previous steps), and the time of the step
+call is the compute. Both are added to a step_timer, which throughput_monitor, a Keras callback
+that installs the timing on the model it is given, reads once per epoch. Every epoch gives the
+training time, the input wait, the compute, samples/sec, peak RSS and page faults; each is
+appended as one line to a csv log. Epochs whose steps spend more than half their time waiting
+for batches are flagged as input bound.
+Print a summary of a log with:
+    python -m src.throughput logs/throughput.csv
+"""
+import os
+import sys
+import csv
+import time
+import resource
+
+columns = ["epoch", "steps", "samples", "step_s", "input_s", "compute_s", "validation_s", "samples_per_sec",
+           "input_fraction", "peak_rss_mb", "minor_faults", "major_faults", "input_bound"]
+
+class step_timer:
+    """
+    Time training steps spent waiting for their batches and computing.
+    """
+    def __init__(self):
+        self.__wait = 0.0
+        self.__compute = 0.0
+        self.__steps = 0
+
+    def add(self, wait, compute):
+        self.__wait += wait
+        self.__compute += compute
+        self.__steps += 1
+        return
+
+    def take(self):
+        """
+        Returns the input wait, compute time and number of steps timed since the last call, and
+        resets them.
+        """
+        totals = (self.__wait, self.__compute, self.__steps)
+        self.__wait = 0.0
+        self.__compute = 0.0
+        self.__steps = 0
+        return totals
+
+def time_steps(model, timer):
+    """
+    Makes Keras train model with a train function that times every step, split into the time
+    it blocks on the iterator for its batch and the time the compiled step then takes.
+
+    Parameters
+    -------
+    model : tf.keras.Model
+        Compiled model, which may be built under a tf.distribute strategy.
+    timer : step_timer
+        Timer the wait and compute time of every step are added to.
+    """
+    import tensorflow as tf
+    strategy = model.distribute_strategy
+    clock = time.perf_counter
+
+    def run_step(data):
+        outputs = model.train_step(data)
+        model._train_counter.assign_add(1)
+        return outputs
+
+    @tf.function
+    def step(data):
+        outputs = strategy.run(run_step, args = (data,))
+        #Metric results are the same on every replica, Keras reports the first
+        return tf.nest.map_structure(lambda value: strategy.experimental_local_results(value)[0], outputs)
+
+    def train_function(iterator):
+        #Eager calls return once their ops have run, so neither clock adds a host sync, and the
+        #logs stay tensors as in Keras' own train function
+        start = clock()
+        data = next(iterator)
+        ready = clock()
+        outputs = step(data)
+        timer.add(ready - start, clock() - ready)
+        return outputs
+
+    #Keras calls make_train_function at the start of every fit
+    model.make_train_function = lambda force = False: train_function
+    model.train_function = train_function
+    return
+
+def _define_monitor():
+    """
+    Defines throughput_monitor on first use, so summarizing a log does not import TensorFlow.
+    """
+    import tensorflow as tf
+
+    class throughput_monitor(tf.keras.callbacks.Callback):
+        def __init__(self, batch_size, log_path = "logs/throughput.csv", input_bound_fraction = 0.5, verbose = True):
+            """
+            Parameters
+            -------
+            batch_size : int
+                Rows per training step (the global batch when training with a tf.distribute strategy).
+            log_path : str
+                csv file the per epoch statistics are appended to.
+            input_bound_fraction : float
+                Epochs whose steps wait for their batches for more than this fraction of the
+                training time are flagged as input bound.
+            verbose : bool
+                Whether to print a one line summary after every epoch.
+            """
+            super().__init__()
+            if input_bound_fraction <= 0 or input_bound_fraction >= 1:
+                raise ValueError("input_bound_fraction needs to be between 0 and 1!")
+            self.batch_size = batch_size
+            self.log_path = log_path
+            self.timer = step_timer()
+            self.input_bound_fraction = input_bound_fraction
+            self.verbose = verbose
+            self.epochs = []
+            self.__clock = time.perf_counter
+
+        def set_model(self, model):
+            #Called by fit before it builds the train function
+            super().set_model(model)
+            time_steps(model, self.timer)
+
+        def on_epoch_begin(self, epoch, logs = None):
+            self.__validation = 0.0
+            self.__usage = resource.getrusage(resource.RUSAGE_SELF)
+            #Drops steps timed outside an epoch
+            self.timer.take()
+            self.__epoch_begin = self.__clock()
+
+        def on_test_begin(self, logs = None):
+            self.__test_begin = self.__clock()
+
+        def on_test_end(self, logs = None):
+            self.__validation += self.__clock() - self.__test_begin
+
+        def on_epoch_end(self, epoch, logs = None):
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            step_time = self.__clock() - self.__epoch_begin - self.__validation
+            input_time, compute_time, steps = self.timer.take()
+            samples = steps*self.batch_size
+            input_fraction = input_time/step_time if step_time else 0.0
+            stats = {"epoch": epoch, "steps": steps, "samples": samples, "step_s": round(step_time, 4),
+                     "input_s": round(input_time, 4), "compute_s": round(compute_time, 4),
+                     "validation_s": round(self.__validation, 4),
+                     "samples_per_sec": round(samples/step_time, 1) if step_time else 0.0,
+                     "input_fraction": round(input_fraction, 4),
+                     #ru_maxrss is in kilobytes on Linux and bytes on macOS
+                     "peak_rss_mb": round(usage.ru_maxrss/(1024**2 if sys.platform == "darwin" else 1024), 1),
+                     "minor_faults": usage.ru_minflt - self.__usage.ru_minflt,
+                     "major_faults": usage.ru_majflt - self.__usage.ru_majflt,
+                     "input_bound": input_fraction > self.input_bound_fraction}
+            self.epochs.append(stats)
+            self.__write(stats)
+            if logs is not None:
+                logs["samples_per_sec"] = stats["samples_per_sec"]
+                logs["input_fraction"] = stats["input_fraction"]
+            if self.verbose:
+                print(format_epoch(stats))
+
+        def __write(self, stats):
+            directory = os.path.dirname(self.log_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            new_file = not os.path.exists(self.log_path)
+            with open(self.log_path, "a", newline = "") as f:
+                writer = csv.DictWriter(f, fieldnames = columns)
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(stats)
+            return
+
+    return throughput_monitor
+
+def __getattr__(name):
+    if name == "throughput_monitor":
+        globals()["throughput_monitor"] = _define_monitor()
+        return globals()["throughput_monitor"]
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
+
+def format_epoch(stats):
+    """
+    Formats one epoch of statistics as a single line.
+    """
+    line = ("Epoch " + str(stats["epoch"]) + ": " + str(stats["samples_per_sec"]) + " samples/sec, steps "
+            + str(stats["step_s"]) + "s, input wait " + str(stats["input_s"]) + "s, compute " + str(stats["compute_s"])
+            + "s, validation " + str(stats["validation_s"]) + "s, peak RSS " + str(stats["peak_rss_mb"]) + " MB, page faults "
+            + str(stats["major_faults"]) + " major/" + str(stats["minor_faults"]) + " minor")
+    if str(stats["input_bound"]) == "True":
+        line += " [INPUT BOUND]"
+    return line
+
+def read_log(log_path):
+    """
+    Reads a throughput log written by throughput_monitor.
+
+    Returns
+    -------
+    epochs : list
+        One dict of statistics per epoch.
+    """
+    with open(log_path, newline = "") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for name in columns:
+            if name == "input_bound":
+                row[name] = row[name] == "True"
+            elif name in ("epoch", "steps", "samples", "minor_faults", "major_faults"):
+                row[name] = int(row[name])
+            else:
+                row[name] = float(row[name])
+    return rows
+
+def summarize(log_path):
+    """
+    Summarizes a throughput log.
+
+    Returns
+    -------
+    summary : str
+        Totals over all epochs, the epochs flagged as input bound and the overall verdict.
+    """
+    epochs = read_log(log_path)
+    if not epochs:
+        return "No epochs logged in " + log_path
+    steps = sum(e["step_s"] for e in epochs)
+    inputs = sum(e["input_s"] for e in epochs)
+    compute = sum(e["compute_s"] for e in epochs)
+    validation = sum(e["validation_s"] for e in epochs)
+    samples = sum(e["samples"] for e in epochs)
+    input_bound = [e["epoch"] for e in epochs if e["input_bound"]]
+    lines = [str(len(epochs)) + " epochs, " + str(samples) + " samples, "
+             + str(round(samples/steps, 1) if steps else 0.0) + " samples/sec",
+             "steps " + str(round(steps, 1)) + "s, input wait " + str(round(inputs, 1)) + "s ("
+             + str(round(100*inputs/steps, 1) if steps else 0.0) + "% of the step time), compute "
+             + str(round(compute, 1)) + "s, validation " + str(round(validation, 1)) + "s",
+             "peak RSS " + str(max(e["peak_rss_mb"] for e in epochs)) + " MB, major page faults "
+             + str(sum(e["major_faults"] for e in epochs))]
+    if input_bound:
+        lines.append("Input bound epochs (" + str(len(input_bound)) + "): " + ", ".join(str(e) for e in input_bound))
+    else:
+        lines.append("No input bound epochs")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    print(summarize(sys.argv[1] if len(sys.argv) > 1 else "logs/throughput.csv"))
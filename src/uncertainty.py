@@ -0,0 +1,169 @@
+"""
+Uncertainties of the predicted parameters from Monte Carlo dropout and ensembles.
+
+The networks have Dropout between every dense layer, so running them with dropout active gives
+a different prediction every time, and the spread of those predictions (or of the predictions
+of several independently trained checkpoints) is an estimate of the uncertainty. Instead of
+calling predict K times, every micro-batch of rows is tiled K times and sent through all
+models in one compiled call, so the work is a few large matrix products per micro-batch:
+    draws = models x samples forward passes per row
+    rows per call = micro_batch // draws
+The draws of each call are reduced to the mean, standard deviation and quantiles of the six
+parameters straight away, so memory is bounded by micro_batch and not by the dataset size.
+Compare against K separate predict calls with:
+    python -m src.uncertainty ckpt_looper --inputs real_inputs.npy --samples 30
+"""
+import sys
+import time
+import argparse
+import numpy as np
+
+def rows_per_call(micro_batch, draws):
+    """
+    Number of rows sent per call so that at most micro_batch rows go through the network.
+    """
+    if micro_batch < 1 or draws < 1:
+        raise ValueError("micro_batch and draws need to be at least 1!")
+    return max(1, micro_batch//draws)
+
+def summarize(draws, quantiles = (0.05, 0.95)):
+    """
+    Reduces draws of shape (draws, rows, 6) to per row statistics.
+
+    Returns
+    -------
+    mean, std : np.ndarray
+        Shape (rows, 6).
+    bounds : np.ndarray
+        Shape (len(quantiles), rows, 6).
+    """
+    draws = np.asarray(draws, dtype = np.float64)
+    std = draws.std(axis = 0, ddof = 1) if draws.shape[0] > 1 else np.zeros(draws.shape[1:])
+    return draws.mean(axis = 0), std, np.quantile(draws, quantiles, axis = 0)
+
+def load_ensemble(paths):
+    import tensorflow as tf
+    return [tf.keras.models.load_model(path) for path in paths]
+
+def sampler(models, samples = 1):
+    """
+    Compiles one call drawing every model samples times for a batch of rows.
+
+    Parameters
+    -------
+    models : list
+        Keras models with the same inputs, e.g. from load_ensemble.
+    samples : int
+        Dropout samples per model. 1 runs the models deterministically (plain ensemble).
+
+    Returns
+    -------
+    draw : tf.function
+        Maps a (rows, features) batch to (len(models)*samples, rows, 6) predictions.
+    """
+    import tensorflow as tf
+    n_features = models[0].input_shape[-1]
+    #Dropout is only active when sampling, Normalization behaves the same either way
+    training = samples > 1
+
+    @tf.function(input_signature = [tf.TensorSpec((None, n_features), tf.float32)])
+    def draw(x):
+        rows = tf.shape(x)[0]
+        tiled = tf.tile(x, [samples, 1])
+        outputs = [tf.reshape(model(tiled, training = training), (samples, rows, -1)) for model in models]
+        return tf.concat(outputs, axis = 0)
+    return draw
+
+def predict_with_uncertainty(models, inputs, samples = 30, micro_batch = 8192, quantiles = (0.05, 0.95),
+                             output_prefix = None):
+    """
+    Predicts the mean, standard deviation and quantiles of the parameters of every row.
+
+    Parameters
+    -------
+    models : list
+        One model for Monte Carlo dropout, several for an ensemble (optionally also sampled).
+    inputs : np.ndarray
+        (N, features) inputs, may be a memmap.
+    samples : int
+        Dropout samples per model.
+    micro_batch : int
+        Maximum rows (after tiling) per call, bounding memory.
+    quantiles : tuple
+        Quantiles giving the interval, e.g. (0.05, 0.95) for 90%.
+    output_prefix : str
+        If given, results are written to <prefix>_mean.npy, _std.npy, _lower.npy and
+        _upper.npy memmaps instead of held in memory.
+
+    Returns
+    -------
+    results : dict
+        mean, std, lower and upper arrays of shape (N, 6).
+    """
+    if len(quantiles) != 2:
+        raise ValueError("quantiles needs to give a lower and an upper quantile!")
+    draw = sampler(models, samples)
+    step = rows_per_call(micro_batch, len(models)*samples)
+    shape = (inputs.shape[0], 6)
+    results = {}
+    for name in ["mean", "std", "lower", "upper"]:
+        if output_prefix is None:
+            results[name] = np.empty(shape, dtype = np.float32)
+        else:
+            results[name] = np.lib.format.open_memmap(output_prefix + "_" + name + ".npy", mode = "w+",
+                                                      dtype = np.float32, shape = shape)
+    for start in range(0, inputs.shape[0], step):
+        chunk = np.asarray(inputs[start:start+step], dtype = np.float32)
+        mean, std, bounds = summarize(draw(chunk).numpy(), quantiles)
+        results["mean"][start:start+step] = mean
+        results["std"][start:start+step] = std
+        results["lower"][start:start+step] = bounds[0]
+        results["upper"][start:start+step] = bounds[1]
+    if output_prefix is not None:
+        for array in results.values():
+            array.flush()
+    return results
+
+def benchmark(models, inputs, samples = 30, micro_batch = 8192, batch_size = 1024):
+    """
+    Times the tiled sampling against one predict call per draw, on the same rows.
+
+    Returns
+    -------
+    timings : dict
+        Seconds taken by each, and the draws per second of the tiled sampling relative to
+        a single deterministic predict.
+    """
+    inputs = np.asarray(inputs, dtype = np.float32)
+    draws = len(models)*samples
+    predict_with_uncertainty(models, inputs[:rows_per_call(micro_batch, draws)], samples, micro_batch)
+    start = time.perf_counter()
+    predict_with_uncertainty(models, inputs, samples, micro_batch)
+    tiled = time.perf_counter() - start
+    models[0].predict(inputs[:batch_size], batch_size = batch_size, verbose = 0)
+    start = time.perf_counter()
+    single = models[0].predict(inputs, batch_size = batch_size, verbose = 0)
+    single_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for model in models:
+        for i in range(samples):
+            #Dropout is only active in predict when called as model(x, training = True)
+            for batch_start in range(0, inputs.shape[0], batch_size):
+                model(inputs[batch_start:batch_start+batch_size], training = samples > 1)
+    separate = time.perf_counter() - start
+    return {"draws": draws, "tiled_s": tiled, "separate_calls_s": separate, "single_predict_s": single_time,
+            "speedup": separate/tiled, "efficiency": draws*single_time/tiled, "rows": len(single)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Time Monte Carlo dropout / ensemble predictions")
+    parser.add_argument("models", nargs = "+", help = "saved models or checkpoints")
+    parser.add_argument("--inputs", required = True)
+    parser.add_argument("--rows", type = int, default = 10000)
+    parser.add_argument("--samples", type = int, default = 30)
+    parser.add_argument("--micro-batch", type = int, default = 8192)
+    args = parser.parse_args(sys.argv[1:])
+    timings = benchmark(load_ensemble(args.models), np.load(args.inputs, mmap_mode = "r")[:args.rows],
+                        args.samples, args.micro_batch)
+    print(str(timings["draws"]) + " draws of " + str(timings["rows"]) + " rows: tiled " + str(round(timings["tiled_s"], 2))
+          + "s, separate calls " + str(round(timings["separate_calls_s"], 2)) + "s (" + str(round(timings["speedup"], 2))
+          + "x), " + str(round(100*timings["efficiency"], 1)) + "% of the throughput of one predict per draw")
@@ -0,0 +1,180 @@
+"""
+Validation of the .npy datasets the training scripts memory map.
+
+validate checks the shapes and dtypes of an inputs/labels pair, then streams the rows through
+worker processes in chunks, each worker reading its own contiguous shard, and looks for
+    - NaN or infinite values in the inputs or labels,
+    - labels outside [0, 1] (or outside the generator's limits for unnormalized labels),
+    - rmf and arf ids that are not whole numbers indexing gen.rmf_list and gen.arf_list,
+    - exposure features outside those of the generator's exposure time limits,
+    - rows whose rates are all zero,
+    - duplicated input rows.
+Duplicates are found by hashing every row with two vectorized 64 bit multiply-add hashes of its
+bytes; rows sharing both hashes are compared in full before being reported. Every check reports
+its number of offending rows and the first max_rows of their ids.
+    python -m src.cli validate --inputs inputs.npy --labels labels.npy
+"""
+import os
+import multiprocessing
+import numpy as np
+from src.spectral_fitter import parameter_bounds
+
+n_bins = 995
+checks = ["nonfinite_inputs", "nonfinite_labels", "label_range", "rmf_id", "arf_id", "exposure", "zero_rates", "duplicates"]
+
+def row_hashes(chunk, seed = 0):
+    """
+    Hashes every row of a 2D array from its bytes.
+
+    Returns
+    -------
+    hashes : np.ndarray
+        (rows, 2) uint64 hashes.
+    """
+    words = np.ascontiguousarray(chunk).view(np.uint8).reshape(chunk.shape[0], -1)
+    #Pads the rows to whole 8 byte words
+    if words.shape[1] % 8:
+        words = np.concatenate([words, np.zeros((words.shape[0], 8 - words.shape[1] % 8), dtype = np.uint8)], axis = 1)
+    words = words.view(np.uint64)
+    multipliers = np.random.default_rng(seed).integers(1, 2**63, size = (words.shape[1], 2), dtype = np.uint64) | np.uint64(1)
+    #Integer products wrap around modulo 2**64
+    with np.errstate(over = "ignore"):
+        return words @ multipliers
+
+def _validate_shard(arguments):
+    input_path, label_path, start, stop, chunk_rows, limits, max_rows = arguments
+    inputs = np.load(input_path, mmap_mode = "r")
+    labels = np.load(label_path, mmap_mode = "r")
+    found = {name: [] for name in checks if name != "duplicates"}
+    counts = {name: 0 for name in found}
+    hashes = np.empty((stop - start, 2), dtype = np.uint64)
+    for chunk_start in range(start, stop, chunk_rows):
+        chunk_stop = min(chunk_start + chunk_rows, stop)
+        x = np.asarray(inputs[chunk_start:chunk_stop])
+        y = np.asarray(labels[chunk_start:chunk_stop])
+        rates = x[:, n_bins:2*n_bins]
+        rmf_ids, arf_ids, exposure = x[:, -3], x[:, -2], x[:, -1]
+        with np.errstate(invalid = "ignore"):
+            bad = {"nonfinite_inputs": ~np.isfinite(x).all(axis = 1),
+                   "nonfinite_labels": ~np.isfinite(y).all(axis = 1),
+                   "label_range": ((y < limits["labels"][:, 0]) | (y > limits["labels"][:, 1])).any(axis = 1),
+                   "rmf_id": (rmf_ids != np.round(rmf_ids)) | (rmf_ids < 0) | (rmf_ids >= limits["n_rmf"]),
+                   "arf_id": (arf_ids != np.round(arf_ids)) | (arf_ids < 0) | (arf_ids >= limits["n_arf"]),
+                   "exposure": (exposure < limits["exposure"][0]) | (exposure > limits["exposure"][1]),
+                   "zero_rates": ~(rates != 0).any(axis = 1)}
+        for name, mask in bad.items():
+            rows = np.flatnonzero(mask) + chunk_start
+            counts[name] += len(rows)
+            if len(found[name]) < max_rows:
+                found[name].extend(rows[:max_rows - len(found[name])].tolist())
+        hashes[chunk_start - start:chunk_stop - start] = row_hashes(x)
+    return found, counts, hashes
+
+def find_duplicates(hashes, inputs):
+    """
+    Finds rows identical to an earlier row, from their hashes.
+
+    Parameters
+    -------
+    hashes : np.ndarray
+        (N, 2) row hashes, see row_hashes.
+    inputs : np.ndarray
+        The rows, used to confirm candidates byte for byte.
+
+    Returns
+    -------
+    duplicates : np.ndarray
+        Sorted ids of rows equal to a row before them.
+    """
+    order = np.lexsort((np.arange(len(hashes)), hashes[:, 1], hashes[:, 0]))
+    ordered = hashes[order]
+    new_group = np.concatenate([[True], (ordered[1:] != ordered[:-1]).any(axis = 1)])
+    #The first row of every group of equal hashes is kept as the original
+    first = order[np.maximum.accumulate(np.where(new_group, np.arange(len(order)), 0))]
+    candidates = np.flatnonzero(~new_group)
+    duplicates = []
+    for start in range(0, len(candidates), 1024):
+        rows = order[candidates[start:start+1024]]
+        originals = first[candidates[start:start+1024]]
+        #Compared as bytes, so NaNs in identical rows still count as equal
+        same = (np.asarray(inputs[rows]).view(np.uint8) == np.asarray(inputs[originals]).view(np.uint8)).all(axis = 1)
+        duplicates.append(rows[same])
+    return np.sort(np.concatenate(duplicates)) if duplicates else np.zeros(0, dtype = np.int64)
+
+def validate(input_path, label_path, gen, normalized = True, processes = None, chunk_rows = 16384, max_rows = 1000):
+    """
+    Validates an inputs/labels pair of .npy files.
+
+    Parameters
+    -------
+    input_path, label_path : str
+        .npy inputs of shape (N, 1993) and labels of shape (N, 6).
+    gen : generator
+        Generator whose limits, rmf_list and arf_list the data is checked against.
+    normalized : bool
+        Whether the labels are normalized to [0, 1], as written by looper.
+    processes : int
+        Worker processes, defaults to the number of CPU cores; 1 runs in process.
+    chunk_rows : int
+        Rows read at a time by every worker.
+    max_rows : int
+        Offending row ids kept per check.
+
+    Returns
+    -------
+    report : dict
+        Maps every check to {"count": int, "rows": list of row ids}, and "errors" to a list of
+        problems with the files as a whole (shape and dtype) that stopped the row checks.
+    """
+    inputs = np.load(input_path, mmap_mode = "r")
+    labels = np.load(label_path, mmap_mode = "r")
+    errors = []
+    if inputs.ndim != 2 or inputs.shape[1] != 2*n_bins + 3:
+        errors.append("inputs have shape " + str(inputs.shape) + ", expected (N, " + str(2*n_bins + 3) + ")")
+    if labels.ndim != 2 or labels.shape[1] != 6:
+        errors.append("labels have shape " + str(labels.shape) + ", expected (N, 6)")
+    if inputs.shape[0] != labels.shape[0]:
+        errors.append(str(inputs.shape[0]) + " input rows but " + str(labels.shape[0]) + " label rows")
+    for name, array in [("inputs", inputs), ("labels", labels)]:
+        if array.dtype.kind not in "iuf":
+            errors.append(name + " have non numerical dtype " + str(array.dtype))
+    report = {"errors": errors, "rows": int(inputs.shape[0])}
+    if errors:
+        return report
+    limits = {"labels": np.array([[0.0, 1.0]]*6) if normalized else parameter_bounds(gen),
+              "n_rmf": len(gen.rmf_list), "n_arf": len(gen.arf_list),
+              "exposure": sorted([gen.exposure_feature(gen.exposure_time_min), gen.exposure_feature(gen.exposure_time_max)])}
+    n_rows = inputs.shape[0]
+    processes = max(1, min(processes or os.cpu_count(), -(-n_rows//chunk_rows)))
+    bounds = np.linspace(0, n_rows, processes + 1).astype(np.int64)
+    tasks = [(input_path, label_path, int(bounds[i]), int(bounds[i+1]), chunk_rows, limits, max_rows)
+             for i in range(processes)]
+    if processes == 1:
+        shards = [_validate_shard(task) for task in tasks]
+    else:
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            shards = pool.map(_validate_shard, tasks)
+    for name in checks[:-1]:
+        rows = [row for found, counts, hashes in shards for row in found[name]]
+        report[name] = {"count": sum(counts[name] for found, counts, hashes in shards), "rows": rows[:max_rows]}
+    duplicates = find_duplicates(np.concatenate([hashes for found, counts, hashes in shards]), inputs)
+    report["duplicates"] = {"count": len(duplicates), "rows": duplicates[:max_rows].tolist()}
+    return report
+
+def format_report(report):
+    """
+    Formats a report from validate, one line per check.
+    """
+    if report["errors"]:
+        return "\n".join(["Invalid dataset:"] + ["    " + error for error in report["errors"]])
+    lines = [str(report["rows"]) + " rows checked"]
+    for name in checks:
+        result = report[name]
+        line = name.ljust(18) + str(result["count"])
+        if result["count"]:
+            line += " rows, e.g. " + ", ".join(str(row) for row in result["rows"][:10])
+        lines.append(line)
+    return "\n".join(lines)
+
+def is_valid(report):
+    return not report["errors"] and all(report[name]["count"] == 0 for name in checks)
@@ -0,0 +1,49 @@
+"""
+Test Class for the active learning generation of training sets
+"""
+import unittest
+import numpy as np
+from src.active_learning import knn_error, acquisition, select, shuffle_rows
+from src.spectra_generator import generator, rmf_list, arf_list
+
+class TestActiveLearning(unittest.TestCase):
+    def test_knn_error_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        reference = rng.random((200, 6))
+        errors = rng.random(200)
+        candidates = rng.random((50, 6))
+        expected = [errors[np.argsort(((reference - c)**2).sum(axis = 1))[:5]].mean() for c in candidates]
+        np.testing.assert_allclose(knn_error(reference, errors, candidates, k = 5, chunk_rows = 7), expected)
+
+    def test_importance_weights_are_unbiased(self):
+        #Weighted means over the selected candidates estimate the mean over the prior
+        rng = np.random.default_rng(1)
+        candidates = rng.random(20000)
+        errors = candidates**2
+        chosen, weights = select(errors, 200000, mix = 0.2, rng = rng)
+        self.assertAlmostEqual(np.mean(weights*candidates[chosen]), candidates.mean(), places = 2)
+        self.assertLessEqual(weights.max(), 1/0.2)
+
+    def test_shuffle_rows_keeps_rows_aligned(self):
+        #Rows selected in later rounds are appended last and must not stay at the end
+        inputs = np.arange(1000, dtype = np.float64)[:, None]*np.ones((1, 3))
+        labels = np.arange(1000, dtype = np.float64)[:, None]*np.ones((1, 6))
+        weights = np.concatenate([np.ones(800), np.full(200, 5.0)])
+        inputs, labels, weights = shuffle_rows(np.random.default_rng(2), inputs, labels, weights)
+        np.testing.assert_array_equal(inputs[:, 0], labels[:, 0])
+        np.testing.assert_array_equal(weights, np.where(labels[:, 0] < 800, 1.0, 5.0))
+        self.assertLess(np.count_nonzero(weights[-200:] == 5.0), 100)
+
+    def test_acquisition_exception(self):
+        with self.assertRaises(ValueError) as exception_context:
+            acquisition(np.ones(3), mix = 0)
+        self.assertEqual(str(exception_context.exception), "mix needs to be between 0 and 1!")
+
+    def test_draw_parameters(self):
+        gen = generator(rmf_list, arf_list)
+        proposals = gen.draw_parameters(20)
+        self.assertEqual(len(proposals), 20)
+        for rmf_number, arf_number, *params, exposure_time, normalized_labels in proposals:
+            self.assertIn(rmf_number, [0, 1])
+            self.assertTrue(0 <= arf_number < len(arf_list))
+            self.assertTrue(all(0 <= value <= 1 for value in normalized_labels))
@@ -0,0 +1,59 @@
+"""
+Test Class for the simulated spectra cache
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from src.spectra_cache import spectra_cache
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.rmf = os.path.join(self.cache_dir, "test.rmf")
+        self.arf = os.path.join(self.cache_dir, "test.arf")
+        with open(self.rmf, "wb") as f:
+            f.write(b"rmf")
+        with open(self.arf, "wb") as f:
+            f.write(b"arf")
+        self.cache = spectra_cache(os.path.join(self.cache_dir, "store"))
+        self.params = [10*10**6, 74, -1.5, 0.6, 0.98, 0.03]
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_key_changes_with_inputs(self):
+        key = self.cache.key(self.params, self.rmf, self.arf, 15000, None, "12.12")
+        self.assertEqual(key, self.cache.key(self.params, self.rmf, self.arf, 15000, None, "12.12"))
+        self.assertNotEqual(key, self.cache.key(self.params, self.rmf, self.arf, 15001, None, "12.12"))
+        self.assertNotEqual(key, self.cache.key(self.params, self.rmf, self.arf, 15000, (1, 0), "12.12"))
+        self.assertNotEqual(key, self.cache.key(self.params, self.arf, self.rmf, 15000, None, "12.12"))
+
+    def test_get_put_success(self):
+        key = self.cache.key(self.params, self.rmf, self.arf, 15000, None, "12.12")
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, ([0.3, 0.4], [1.0, 2.0], [[], [], []]))
+        self.assertEqual(self.cache.get(key), ([0.3, 0.4], [1.0, 2.0], [[], [], []]))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, "store", key[:2])))
+        reopened = spectra_cache(os.path.join(self.cache_dir, "store"))
+        self.assertEqual(reopened.total_bytes, self.cache.total_bytes)
+
+    def test_lru_eviction(self):
+        keys = [self.cache.key(self.params, self.rmf, self.arf, 2000+i, None, "12.12") for i in range(3)]
+        self.cache.put(keys[0], list(range(100)))
+        entry_size = self.cache.total_bytes
+        self.cache.max_bytes = 2*entry_size
+        self.cache.put(keys[1], list(range(100)))
+        #Using the oldest entry makes the middle one least recently used
+        self.cache.get(keys[0])
+        self.cache.put(keys[2], list(range(100)))
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+        self.assertIsNone(self.cache.get(keys[1]))
+
+    def test_max_bytes_exception(self):
+        with self.assertRaises(ValueError) as exception_context:
+            spectra_cache(self.cache_dir, max_bytes = 0)
+        self.assertEqual(str(exception_context.exception), "max_bytes needs to be a positive integer!")
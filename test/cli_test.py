@@ -0,0 +1,118 @@
+"""
+Test Class for the command line entry point
+"""
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import types
+import subprocess
+import unittest
+from unittest import mock
+from src.cli import parse_overrides, parse_bounds, make_parser, worker_arguments, train
+from src.spectra_generator import generator
+
+class TestCli(unittest.TestCase):
+    def test_parse_overrides_success(self):
+        actual = parse_overrides(["epochs=10", "initial_learning_rate=1e-4", "work_dir=/tmp/run", "strategy=\"mirrored\""])
+        self.assertEqual(actual, {"epochs": 10, "initial_learning_rate": 0.0001, "work_dir": "/tmp/run", "strategy": "mirrored"})
+
+    def test_parse_overrides_exception(self):
+        with self.assertRaises(ValueError) as exception_context:
+            parse_overrides(["epochs"])
+        self.assertEqual(str(exception_context.exception), "Overrides need to be of the form name=value, got epochs")
+
+    def test_parse_bounds(self):
+        self.assertEqual(parse_bounds(["astar=0.9:", "cosi=:0.2", "rmf=0:1"]),
+                         {"astar": (0.9, None), "cosi": (None, 0.2), "rmf": (0.0, 1.0)})
+
+    def test_parser_subcommands(self):
+        args = make_parser().parse_args(["train", "real_world", "--set", "epochs=1", "--set", "replicas=2"])
+        self.assertEqual((args.script, args.set), ("real_world", ["epochs=1", "replicas=2"]))
+
+    def test_worker_arguments(self):
+        args = make_parser().parse_args(["train", "real_world", "--config", "run.json", "--set", "epochs=1", "--workers", "4"])
+        self.assertEqual(args.workers, 4)
+        self.assertEqual(worker_arguments(args), ["-m", "src.cli", "train", "real_world", "--config", "run.json",
+                                                  "--set", "epochs=1", "--set", "strategy=\"multi_worker\""])
+        #Every worker parses back to the multi_worker strategy, without starting workers itself
+        worker = make_parser().parse_args(worker_arguments(args)[2:])
+        self.assertEqual((worker.workers, parse_overrides(worker.set)), (1, {"epochs": 1, "strategy": "multi_worker"}))
+
+    def test_workers_exception(self):
+        args = make_parser().parse_args(["train", "simulation", "--workers", "2"])
+        with self.assertRaises(ValueError) as exception_context:
+            train(args)
+        self.assertEqual(str(exception_context.exception), "--workers is only supported by real_world!")
+
+    def test_help_is_lightweight(self):
+        code = ("import sys\nfrom src.cli import make_parser\nmake_parser().format_help()\n"
+                "print(sorted(m for m in ['xspec', 'tensorflow', 'matplotlib', 'numpy'] if m in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", code], capture_output = True, text = True, check = True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_generate_saves_looper_output(self):
+        calls = []
+        #Stands in for XSPEC with spectra of the shapes it returns, so looper and saver run unchanged
+        def simulate(self, *args):
+            calls.append(args)
+            n = 5 + len(calls)
+            return ([0.3 + 0.1*i for i in range(n)], [100.0 + i for i in range(n)],
+                    [[0.05]*n, [float(len(calls))]*n, [99.0]*n])
+        work_dir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        try:
+            os.chdir(work_dir)
+            args = make_parser().parse_args(["generate", "--iterations", "3", "--number", "4"])
+            with mock.patch.object(generator, "_generator__xspec_data_retriever", simulate):
+                args.function(args)
+            with open("label4", "rb") as f:
+                answers = pickle.load(f)
+            with open("inputs4", "rb") as f:
+                inputs = pickle.load(f)
+            with open("uncertainties4", "rb") as f:
+                uncertainties = pickle.load(f)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([len(row) for row in answers], [6, 6, 6])
+        #Ragged rows of energies, rates, rmf id, arf id and exposure feature
+        self.assertEqual([len(row) for row in inputs], [15, 17, 19])
+        self.assertEqual(inputs[0][6:12], [100.0 + i for i in range(6)])
+        self.assertEqual([len(column) for column in uncertainties], [3, 3, 3])
+        self.assertEqual(uncertainties[1][2], [3.0]*8)
+
+    def test_seeded_generate_reuses_cache(self):
+        calls = []
+        #Stands in for XSPEC with a spectrum determined by the parameters and the XSPEC seed
+        def simulate(self, mass, dist, logmdot, astar, cosi, redshift, *args):
+            calls.append(xspec.Xset.seed)
+            rates = [100.0*(logmdot + 2) + xspec.Xset.seed + i for i in range(6)]
+            return [0.3 + 0.1*i for i in range(6)], rates, [[0.05]*6, [1.0]*6, [99.0]*6]
+        xspec = types.SimpleNamespace(Xset = types.SimpleNamespace(seed = 0, version = "12.12.0"))
+        work_dir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        outputs = []
+        entries = []
+        try:
+            #The cache keys hash the response files, which looper takes from build/
+            os.symlink(os.path.abspath("build"), os.path.join(work_dir, "build"))
+            os.chdir(work_dir)
+            for run in range(2):
+                args = make_parser().parse_args(["generate", "--iterations", "5", "--number", str(run), "--seed", "7",
+                                                 "--cache-dir", "cache"])
+                with mock.patch.object(generator, "_generator__xspec_data_retriever", simulate), \
+                        mock.patch.dict(sys.modules, {"xspec": xspec}):
+                    args.function(args)
+                with open("inputs" + str(run), "rb") as f:
+                    outputs.append(pickle.load(f))
+                entries.append(sum(len(files) for _, _, files in os.walk("cache")))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir)
+        #The second run draws the same parameters, so every spectrum is a cache hit
+        self.assertEqual(calls, [7]*5)
+        self.assertEqual(entries, [5, 5])
+        self.assertEqual(outputs[0], outputs[1])
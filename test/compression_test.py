@@ -0,0 +1,57 @@
+"""
+Test Class for the principal component compression of the spectra
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from src.compression import fit_basis, load_basis, basis_path, transform, transform_dataset, reconstruction_error, projection_matrix
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        #Correlated spectral columns, a zero padded column and the three passthrough columns
+        latent = rng.normal(size = (500, 4))
+        spectra = latent @ rng.normal(size = (4, 20)) + 0.01*rng.normal(size = (500, 20))
+        spectra[:, -1] = 0
+        meta = np.stack([rng.integers(0, 2, 500), rng.integers(0, 15, 500), rng.random(500)], axis = 1)
+        self.inputs = np.concatenate([spectra, meta], axis = 1)
+        self.path = os.path.join(self.directory, "inputs.npy")
+        np.save(self.path, self.inputs)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fit_basis_matches_in_memory_pca(self):
+        basis = fit_basis(self.path, chunk_rows = 64)
+        z = (self.inputs[:, :-3] - basis["mean"][:-3])/basis["scale"][:-3]
+        expected = np.linalg.eigvalsh(np.cov(z, rowvar = False))[::-1]
+        np.testing.assert_allclose(basis["variance"], np.maximum(expected, 0), atol = 1e-9)
+        self.assertEqual(load_basis(basis_path(self.path))["components"].shape, (20, 20))
+
+    def test_reconstruction_error(self):
+        basis = fit_basis(self.path, chunk_rows = 64, save = False)
+        errors = reconstruction_error(self.path, basis, [1, 4], chunk_rows = 64)
+        z = (self.inputs[:, :-3] - basis["mean"][:-3])/basis["scale"][:-3]
+        for k in [1, 4]:
+            components = basis["components"][:, :k]
+            expected = ((z - z @ components @ components.T)**2).mean()
+            self.assertAlmostEqual(errors[k]["mse"], expected, places = 9)
+        #Four latent directions hold nearly all the variance
+        self.assertLess(errors[4]["relative"], 1e-3)
+
+    def test_projection_matrix_matches_transform(self):
+        basis = fit_basis(self.path, save = False)
+        weights, bias = projection_matrix(basis, 4, whiten = False)
+        np.testing.assert_allclose(self.inputs @ weights + bias, transform(basis, self.inputs, 4), rtol = 1e-4, atol = 1e-4)
+        output = os.path.join(self.directory, "compressed.npy")
+        self.assertEqual(transform_dataset(self.path, output, basis, 4, chunk_rows = 64), 500)
+        np.testing.assert_array_equal(np.load(output), transform(basis, self.inputs, 4))
+
+    def test_transform_exception(self):
+        basis = fit_basis(self.path, save = False)
+        with self.assertRaises(ValueError) as exception_context:
+            transform(basis, self.inputs, 0)
+        self.assertEqual(str(exception_context.exception), "k needs to be between 1 and 20!")
@@ -0,0 +1,37 @@
+"""
+Test Class for the data-parallel training helpers
+"""
+import os
+import json
+import unittest
+from src.distributed import tf_config, is_chief
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        self.tf_config = os.environ.pop("TF_CONFIG", None)
+
+    def tearDown(self):
+        os.environ.pop("TF_CONFIG", None)
+        if self.tf_config is not None:
+            os.environ["TF_CONFIG"] = self.tf_config
+
+    def test_tf_config(self):
+        config = json.loads(tf_config(3, 2, base_port = 2000))
+        self.assertEqual(config["cluster"]["worker"], ["localhost:2000", "localhost:2001", "localhost:2002"])
+        self.assertEqual(config["task"], {"type": "worker", "index": 2})
+
+    def test_tf_config_exception(self):
+        with self.assertRaises(ValueError) as exception_context:
+            tf_config(2, 2)
+        self.assertEqual(str(exception_context.exception), "Worker index needs to be between 0 and n_workers-1!")
+
+    def test_is_chief(self):
+        self.assertTrue(is_chief())
+        chiefs = []
+        for index in range(3):
+            os.environ["TF_CONFIG"] = tf_config(3, index)
+            chiefs.append(is_chief())
+        self.assertEqual(chiefs, [True, False, False])
+        os.environ["TF_CONFIG"] = json.dumps({"cluster": {"chief": ["localhost:1"], "worker": ["localhost:2"]},
+                                              "task": {"type": "worker", "index": 0}})
+        self.assertFalse(is_chief())
@@ -0,0 +1,66 @@
+"""
+Test Class for the streaming evaluation of predictions
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from src.evaluation import residual_accumulator, evaluate
+
+class TestEvaluation(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.labels = rng.random((5000, 6))
+        self.predictions = self.labels + rng.normal(0.01, 0.05, size = (5000, 6))
+        self.inputs = np.zeros((5000, 5))
+        self.inputs[:, -3] = rng.integers(0, 2, 5000)
+        self.inputs[:, -2] = rng.integers(-1, 15, 5000)
+
+    def test_statistics_match_direct_computation(self):
+        accumulator = residual_accumulator().update(self.predictions, self.labels, self.inputs[:, -3], self.inputs[:, -2])
+        results = accumulator.arrays(qs = (0.05, 0.5, 0.95))
+        residuals = self.predictions - self.labels
+        np.testing.assert_allclose(results["all"]["bias"][0], residuals.mean(axis = 0))
+        np.testing.assert_allclose(results["all"]["rmse"][0], np.sqrt((residuals**2).mean(axis = 0)))
+        #Quantiles are resolved to the histogram bin width
+        np.testing.assert_allclose(results["all"]["quantiles"][0], np.quantile(residuals, (0.05, 0.5, 0.95), axis = 0).T, atol = 0.005)
+        in_bin = (self.labels[:, 3] >= 0.9)
+        np.testing.assert_allclose(results["astar"]["mae"][9], np.abs(residuals[in_bin]).mean(axis = 0))
+        self.assertEqual(accumulator.unknown_ids, int((self.inputs[:, -2] == -1).sum()))
+        self.assertEqual(results["arf"]["count"].sum() + accumulator.unknown_ids, 5000)
+
+    def test_merge_and_save(self):
+        whole = residual_accumulator().update(self.predictions, self.labels)
+        first = residual_accumulator().update(self.predictions[:1234], self.labels[:1234])
+        second = residual_accumulator().update(self.predictions[1234:], self.labels[1234:])
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "shard.npz")
+            second.save(path)
+            merged = first.merge(residual_accumulator.load(path))
+        finally:
+            shutil.rmtree(directory)
+        for name in whole.groups:
+            np.testing.assert_array_equal(merged.hist[name], whole.hist[name])
+            np.testing.assert_allclose(merged.total_sq[name], whole.total_sq[name])
+        self.assertIn("5000 rows", merged.report())
+
+    def test_parallel_evaluate(self):
+        directory = tempfile.mkdtemp()
+        try:
+            paths = [os.path.join(directory, name + ".npy") for name in ["predictions", "labels", "inputs"]]
+            for path, array in zip(paths, [self.predictions, self.labels, self.inputs]):
+                np.save(path, array)
+            parallel = evaluate(*paths, processes = 2, chunk_rows = 1000)
+        finally:
+            shutil.rmtree(directory)
+        serial = residual_accumulator().update(self.predictions, self.labels, self.inputs[:, -3], self.inputs[:, -2])
+        for name in serial.groups:
+            np.testing.assert_array_equal(parallel.count[name], serial.count[name])
+            np.testing.assert_allclose(parallel.total[name], serial.total[name])
+
+    def test_merge_exception(self):
+        with self.assertRaises(ValueError) as exception_context:
+            residual_accumulator(label_bins = 10).merge(residual_accumulator(label_bins = 5))
+        self.assertEqual(str(exception_context.exception), "Can only merge accumulators with the same settings!")
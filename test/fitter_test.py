@@ -0,0 +1,72 @@
+"""
+Test Class for the spectral fitter (the parts that run without XSPEC)
+"""
+import os
+import math
+import types
+import warnings
+import unittest
+import numpy as np
+from src.spectral_fitter import cstat, parameter_bounds, normalize, template_parameters, match_rmf, fit_task, fit_many, \
+    response_files
+from src import spectra_generator
+
+class TestFitter(unittest.TestCase):
+    def setUp(self):
+        #Same limits as generator.__init__
+        self.gen = types.SimpleNamespace(mass_min = 2, mass_max = 450, dist_min = 65, dist_max = 6000,
+                                         logmdot_min = -1.65, logmdot_max = 0.39, astar_min = 0.5, astar_max = .998,
+                                         i_min = 10, i_max = 50, redshift_min = 0.002, redshift_max = 0.349,
+                                         rmf_list = ['rmf_arf/rmfs/swxpc0to12s0_20010101v010.rmf',
+                                                     'rmf_arf/rmfs/swxpc0to12s6_20010101v010.rmf'])
+
+    def test_cstat_success(self):
+        counts = np.array([0, 3, 5])
+        model = np.array([1.0, 2.0, 5.0])
+        expected = 2*((1-0) + (2-3+3*math.log(3/2)) + 0)
+        self.assertAlmostEqual(float(cstat(counts, model)), expected)
+        self.assertAlmostEqual(float(cstat(model, model)), 0.0)
+
+    def test_cstat_broadcast(self):
+        rng = np.random.default_rng(1)
+        counts = rng.poisson(5, (4, 1, 20))
+        bank = rng.random((1, 7, 20))*10
+        actual = cstat(counts, bank)
+        self.assertEqual(actual.shape, (4, 7))
+        self.assertAlmostEqual(actual[2, 3], float(cstat(counts[2, 0], bank[0, 3])))
+
+    def test_template_parameters_within_bounds(self):
+        bounds = parameter_bounds(self.gen)
+        params = template_parameters(bounds, 50, frozen = {5: 0.03})
+        normalized = normalize(params, bounds)
+        self.assertTrue(np.all(normalized[:, :5] >= 0) and np.all(normalized[:, :5] <= 1))
+        self.assertTrue(np.all(params[:, 5] == 0.03))
+        #One template in every stratum of every parameter
+        strata = np.floor(normalized[:, :5]*50).astype(int)
+        for column in strata.T:
+            self.assertEqual(sorted(column), list(range(50)))
+
+    def test_match_rmf(self):
+        self.assertEqual(match_rmf("/caldb/swift/swxpc0to12s6_20010101v010.rmf", self.gen.rmf_list),
+                         'rmf_arf/rmfs/swxpc0to12s6_20010101v010.rmf')
+        self.assertEqual(match_rmf("swxpc0to12s0_20010101v010.rmf", self.gen.rmf_list), self.gen.rmf_list[0])
+        self.assertIsNone(match_rmf("swxwt0to2s6_20131212v015.rmf", self.gen.rmf_list))
+
+    def test_response_files(self):
+        #Resolved like spectra_generator.looper does, so they are the files the simulations use
+        rmf_list = response_files(spectra_generator, build_dir = os.path.join(os.path.dirname(__file__), "..", "build"))
+        self.assertEqual(len(rmf_list), len(spectra_generator.rmf_list))
+        for rmf in rmf_list:
+            self.assertTrue(os.path.isfile(rmf), rmf + " does not exist")
+        match = match_rmf("/caldb/swift/swxpc0to12s6_20010101v010.rmf", response_files(self.gen))
+        self.assertEqual(match, os.path.join("build", "rmf_arf/rmfs/swxpc0to12s6_20010101v010.rmf"))
+
+    def test_fit_many_keeps_errors_per_source(self):
+        tasks = [fit_task("missing" + str(i), "no_such_dir/missing" + str(i) + ".pha", "no_such_dir/missing.arf")
+                 for i in range(2)]
+        with warnings.catch_warnings(record = True) as caught:
+            warnings.simplefilter("always")
+            results = fit_many(tasks, self.gen, n_bootstrap = 10, processes = 1)
+        self.assertEqual([result["name"] for result in results], ["missing0", "missing1"])
+        self.assertTrue(all(set(result) == {"name", "error"} for result in results))
+        self.assertEqual(len([w for w in caught if "failed" in str(w.message)]), 2)
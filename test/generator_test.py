@@ -12,7 +12,10 @@ import random
 import warnings
 import math
 import pickle
+import shutil
+import tempfile
 from src.spectra_generator import generator
+from src.spectra_cache import spectra_cache
 
 class TestDataset(unittest.TestCase):
     def setUp(self):
@@ -211,6 +214,54 @@ class TestDataset(unittest.TestCase):
             actual = self.spectra_generator.saver(answers, inputs, uncertainties, number)
         self.assertEqual(str(exception_context.exception),"All elements of given list must be numerical!")
 
+    def saved(self, answers, inputs, uncertainties, number):
+        self.spectra_generator.saver(answers, inputs, uncertainties, number)
+        loaded = []
+        for name in ['label', 'inputs', 'uncertainties']:
+            with open(name+str(number), "rb") as f:
+                loaded.append(pickle.load(f))
+            os.remove(name+str(number))
+        return loaded
+
+    def test_saver_nested_success(self):
+        answers = [[0.1, 0.2, 0.3, 0.4, 0.5, 0.6], [0.6, 0.5, 0.4, 0.3, 0.2, 0.1]]
+        inputs = [[0.3, 0.5, 12, 16, 0, 3, 0.25], [0.3, 0.6, 11, 15, 1, 4, 0.5]]
+        uncertainties = [[[0.1, 0.1], [0.1, 0.2]], [[1, 1], [2, 2]], [[5.5, 6], [7, 8]]]
+        self.assertEqual(self.saved(answers, inputs, uncertainties, 8), [answers, inputs, uncertainties])
 
+    def test_saver_ragged_success(self):
+        #Spectra with different numbers of bins, as looper gives
+        answers = [[0.1, 0.2, 0.3, 0.4, 0.5, 0.6], [0.6, 0.5, 0.4, 0.3, 0.2, 0.1]]
+        inputs = [[0.3, 0.5, 12, 16, 0, 3, 0.25], [0.3, 11, 1, 4, 0.5]]
+        uncertainties = [[[0.1, 0.1], [0.1]], [[1, 1], [2]], [[5.5, 6], [7]]]
+        self.assertEqual(self.saved(answers, inputs, uncertainties, 9), [answers, inputs, uncertainties])
 
+    def test_saver_nested_non_numeric_exception(self):
+        answers = [[0.1, 0.2], [0.3, 0.4]]
+        uncertainties = [[[0.1], [0.1]], [[1], [2]], [[5.5], [7]]]
+        #Rectangular, ragged, and ragged with deeper nesting
+        for inputs in [[[0.3, 0.5], [0.3, "0.6"]], [[0.3, 0.5], ["0.3"]], [[0.3, [0.5, "1"]], [0.3]]]:
+            with self.assertRaises(ValueError) as exception_context:
+                self.spectra_generator.saver(answers, inputs, uncertainties, 10)
+            self.assertEqual(str(exception_context.exception),"All elements of given list must be numerical!")
+        self.assertFalse(os.path.isfile('inputs10'))
 
+    def test_unseeded_simulations_bypass_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            self.spectra_generator.cache = spectra_cache(cache_dir)
+            draws = []
+            #Stands in for XSPEC, giving a new Poisson draw every call
+            def simulate(*args):
+                draws.append(args)
+                return [1.0], [float(len(draws))], [[0.1], [0.1], [1.0]]
+            self.spectra_generator._generator__xspec_data_retriever = simulate
+            params = (10, 74, -1.5, 0.6, 0.98, 0.03, 1, "test.rmf", "test.arf", 2000, 0)
+            first = self.spectra_generator._generator__cached_data_retriever(*params)
+            second = self.spectra_generator._generator__cached_data_retriever(*params)
+            self.assertEqual(len(draws), 2)
+            self.assertNotEqual(first[1], second[1])
+            self.assertEqual((self.spectra_generator.cache.hits, self.spectra_generator.cache.misses), (0, 0))
+            self.assertEqual(self.spectra_generator.cache.total_bytes, 0)
+        finally:
+            shutil.rmtree(cache_dir)
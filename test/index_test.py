@@ -0,0 +1,97 @@
+"""
+Test Class for the parameter-space index
+"""
+import os
+import shutil
+import tempfile
+import types
+import unittest
+import numpy as np
+from src.param_index import build_index, param_index, index_path, row_slices
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        #Same vocabulary and exposure convention as the generator
+        self.gen = types.SimpleNamespace(rmf_list = ["a", "b"], arf_list = list(range(15)), exposure_time_min = 2000,
+                                         exposure_time_max = 20000, exposure_feature = lambda t: t - 2000/18000)
+        rng = np.random.default_rng(1)
+        n = 20000
+        self.labels = rng.random((n, 6))
+        self.inputs = np.zeros((n, 12))
+        self.inputs[:, -3] = rng.integers(0, 2, n)
+        self.inputs[:, -2] = rng.integers(0, 15, n)
+        self.inputs[:, -1] = self.gen.exposure_feature(rng.integers(2000, 20001, n))
+        self.label_path = os.path.join(self.work_dir, "labels.npy")
+        self.input_path = os.path.join(self.work_dir, "inputs.npy")
+        np.save(self.label_path, self.labels)
+        np.save(self.input_path, self.inputs)
+        self.index = build_index(self.label_path, self.input_path, self.gen, chunk_rows = 3000)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_range_query_matches_scan(self):
+        actual = self.index.range_query({"astar": (0.8, None), "cosi": (None, 0.3), "arf": (3, 5)})
+        expected = np.flatnonzero((self.labels[:, 3] >= 0.8) & (self.labels[:, 4] <= 0.3)
+                                  & (self.inputs[:, -2] >= 3) & (self.inputs[:, -2] <= 5))
+        np.testing.assert_array_equal(actual, expected)
+        self.assertEqual(len(self.index.range_query({})), len(self.labels))
+
+    def test_nearest_matches_scan(self):
+        point = {"mass": 0.2, "dist": 0.5, "logmdot": 0.9, "astar": 0.1, "cosi": 0.5, "redshift": 0.33}
+        rows, distances = param_index(index_path(self.label_path)).nearest(point, k = 5)
+        brute = np.sqrt(((self.labels - np.array(list(point.values())))**2).sum(axis = 1))
+        np.testing.assert_array_equal(rows, np.argsort(brute)[:5])
+        np.testing.assert_allclose(distances, np.sort(brute)[:5], rtol = 1e-5)
+
+    def test_scan_matches_slices(self):
+        bounds = {"mass": (0.1, 0.6), "redshift": (None, 0.5), "exposure": (8000 - 2000/18000, None)}
+        expected = np.flatnonzero((self.labels[:, 0] >= 0.1) & (self.labels[:, 0] <= 0.6) & (self.labels[:, 5] <= 0.5)
+                                  & (self.inputs[:, -1] >= 8000 - 2000/18000))
+        #Always from the most selective column's slice, then always by scanning
+        for scan_fraction in [np.inf, 0]:
+            self.index.scan_fraction = scan_fraction
+            np.testing.assert_array_equal(self.index.range_query(bounds), expected)
+
+    def test_nearest_falls_back_to_scan(self):
+        #Adaptive grid: 20000 rows in cells of about 32 rows
+        self.assertEqual(self.index.label_bins, 3)
+        point = {"astar": 0.7, "cosi": 0.1}
+        brute = np.sqrt((self.labels[:, 3] - 0.7)**2 + (self.labels[:, 4] - 0.1)**2)
+        for k in [3, 5000]:
+            rows, distances = self.index.nearest(point, k = k)
+            np.testing.assert_allclose(distances, np.sort(brute)[:k], rtol = 1e-5)
+            np.testing.assert_allclose(brute[rows], distances, rtol = 1e-5)
+
+    def test_rows_outside_ranges(self):
+        #Rows like those of ingested real spectra: unknown responses (-1) and labels outside 0-1
+        labels = np.concatenate([self.labels, [[1.2, 0.5, 0.5, 0.5, 0.5, 0.5], [0.5, 0.5, 0.5, 0.5, -0.1, 0.5]]])
+        inputs = np.concatenate([self.inputs, self.inputs[:2]])
+        inputs[-2, -2] = -1
+        inputs[-1, -3] = -1
+        np.save(self.label_path, labels)
+        np.save(self.input_path, inputs)
+        index = build_index(self.label_path, self.input_path, self.gen, chunk_rows = 3000)
+        n = len(self.labels)
+        self.assertIn(n, index.range_query({"arf": (None, 5)}))
+        self.assertIn(n+1, index.range_query({"rmf": (None, 0)}))
+        self.assertIn(n, index.range_query({"mass": (0.4, None)}))
+        np.testing.assert_array_equal(index.range_query({"mass": (1.1, None)}), [n])
+        np.testing.assert_array_equal(index.range_query({"arf": (None, -0.5)}), [n])
+        np.testing.assert_array_equal(index.range_query({"cosi": (None, -0.05)}), [n+1])
+        #Explicit bounds still exclude them
+        self.assertNotIn(n, index.range_query({"mass": (0, 1)}))
+        self.assertEqual(len(index.range_query({})), n+2)
+        rows, distances = index.nearest({"mass": 1.2, "cosi": 0.5}, k = 1)
+        np.testing.assert_array_equal(rows, [n])
+        self.assertAlmostEqual(float(distances[0]), 0.0, places = 6)
+
+    def test_row_slices(self):
+        self.assertEqual(row_slices(np.array([1, 2, 3, 7, 9, 10])), [slice(1, 4), slice(7, 8), slice(9, 11)])
+        self.assertEqual(row_slices(np.array([], dtype = int)), [])
+
+    def test_unknown_column_exception(self):
+        with self.assertRaises(ValueError) as exception_context:
+            self.index.range_query({"spin": (0, 1)})
+        self.assertEqual(str(exception_context.exception), "Unknown columns: spin")
@@ -0,0 +1,100 @@
+"""
+Test Class for the ingestion of real spectra (the parts that run without XSPEC)
+"""
+import os
+import shutil
+import hashlib
+import tempfile
+import types
+import warnings
+import unittest
+import numpy as np
+from src.ingest import find_observations, to_row, ingest, file_checksum, n_bins
+from src.spectra_cache import spectra_cache
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.work_dir, "rmf_arf")
+        #Same vocabulary and exposure convention as the generator
+        self.gen = types.SimpleNamespace(rmf_list = ['rmf_arf/rmfs/swxpc0to12s0_20010101v010.rmf',
+                                                     'rmf_arf/rmfs/swxpc0to12s6_20010101v010.rmf'],
+                                         arf_list = ['Mkn1044', 'TonS180'],
+                                         exposure_feature = lambda t: (t - 2000)/18000)
+        self.parsed = {"energies": [0.3, 0.5, 1.0], "rates": [2.0, 1.5, 0.25], "exposure": 11000,
+                       "rmf": "swxpc0to12s6_20010101v010.rmf"}
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_source(self, source, files):
+        directory = os.path.join(self.data_dir, source)
+        os.makedirs(directory)
+        for name in files:
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(source.encode() + name.encode())
+        return directory
+
+    def test_to_row(self):
+        row = to_row(self.parsed, "TonS180", self.gen)
+        self.assertEqual(row.shape, (2*n_bins + 3,))
+        np.testing.assert_array_equal(row[:3], [0.3, 0.5, 1.0])
+        np.testing.assert_array_equal(row[n_bins:n_bins+3], [2.0, 1.5, 0.25])
+        #Zero padded after the bins of the spectrum
+        self.assertTrue(np.all(row[3:n_bins] == 0) and np.all(row[n_bins+3:2*n_bins] == 0))
+        np.testing.assert_array_equal(row[-3:], [1, 1, 0.5])
+
+    def test_to_row_unknown_responses(self):
+        with warnings.catch_warnings(record = True) as caught:
+            warnings.simplefilter("always")
+            row = to_row(dict(self.parsed, rmf = "swxwt0to2s6_20131212v015.rmf"), "NGC4051", self.gen)
+        np.testing.assert_array_equal(row[-3:-1], [-1, -1])
+        self.assertEqual([str(w.message) for w in caught],
+                         ["NGC4051 uses swxwt0to2s6_20131212v015.rmf, which is not in rmf_list",
+                          "NGC4051 is not in arf_list"])
+
+    def test_to_row_too_many_bins_exception(self):
+        parsed = dict(self.parsed, energies = [1.0]*(n_bins + 1), rates = [1.0]*(n_bins + 1))
+        with self.assertRaises(ValueError) as exception_context:
+            to_row(parsed, "TonS180", self.gen)
+        self.assertEqual(str(exception_context.exception), "TonS180 has 996 bins, more than the 995 the networks take!")
+
+    def test_find_observations(self):
+        self.make_source("TonS180", ["TonS180.pha", "TonS180pc.arf"])
+        self.make_source("Mkn1044", ["b.pi", "a.pha", "Mkn1044pc.arf", "own.rmf"])
+        self.make_source("Empty", ["Emptypc.arf"])
+        os.makedirs(os.path.join(self.data_dir, "rmfs"))
+        with warnings.catch_warnings(record = True) as caught:
+            warnings.simplefilter("always")
+            observations = find_observations(self.data_dir)
+        self.assertEqual([str(w.message) for w in caught], ["No .pha or .pi spectrum found for Empty, skipping it"])
+        mkn = os.path.join(self.data_dir, "Mkn1044")
+        ton = os.path.join(self.data_dir, "TonS180")
+        self.assertEqual(observations, [{"source": "Mkn1044", "pha": os.path.join(mkn, "a.pha"),
+                                         "arf": os.path.join(mkn, "Mkn1044pc.arf"), "rmf": os.path.join(mkn, "own.rmf")},
+                                        {"source": "TonS180", "pha": os.path.join(ton, "TonS180.pha"),
+                                         "arf": os.path.join(ton, "TonS180pc.arf"), "rmf": None}])
+
+    def test_ingest_skips_failed_observations(self):
+        ton = self.make_source("TonS180", ["TonS180.pha", "TonS180pc.arf"])
+        #Corrupt spectrum XSPEC cannot read
+        self.make_source("Mkn1044", ["Mkn1044.pha", "Mkn1044pc.arf"])
+        #Missing arf
+        self.make_source("NoArf", ["NoArf.pha"])
+        cache_dir = os.path.join(self.work_dir, "cache")
+        #TonS180 was parsed by an earlier run
+        key = hashlib.sha256(" ".join(file_checksum(os.path.join(ton, name))
+                                      for name in ["TonS180.pha", "TonS180pc.arf"]).encode()).hexdigest()
+        spectra_cache(cache_dir).put(key, self.parsed)
+        output_path = os.path.join(self.work_dir, "real_inputs.npy")
+        with warnings.catch_warnings(record = True) as caught:
+            warnings.simplefilter("always")
+            sources = ingest(self.gen, output_path, self.data_dir, cache_dir, processes = 1)
+        self.assertEqual(sources, ["TonS180"])
+        messages = [str(w.message) for w in caught]
+        self.assertTrue(any(message.startswith("Could not parse") and "Mkn1044" in message for message in messages))
+        self.assertTrue(any(message.startswith("Could not read the files of NoArf") for message in messages))
+        rows = np.load(output_path)
+        np.testing.assert_array_equal(rows, [to_row(self.parsed, "TonS180", self.gen)])
+        with open(os.path.join(self.work_dir, "real_inputs_sources.txt")) as f:
+            self.assertEqual(f.read(), "TonS180\n")
@@ -0,0 +1,75 @@
+"""
+Test Class for the preprocessing of generated spectra
+"""
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from src.saver import merge, make_real_world, augment, n_bins
+
+class TestSaver(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        random.seed(3)
+        #Rows of 995 energies, 995 rates, rmf id, arf id and exposure feature
+        self.inputs = [[float(i + 1) for i in range(n_bins)] + [float(-i - 1) for i in range(n_bins)] + [1, 4, 0.5]
+                       for row in range(4)]
+        self.labels = [[0.1*row]*6 for row in range(4)]
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def dump(self, name, values):
+        path = os.path.join(self.work_dir, name)
+        with open(path, "wb") as f:
+            pickle.dump(values, f)
+        return path
+
+    def test_make_real_world(self):
+        original = [list(row) for row in self.inputs]
+        recycled = make_real_world(self.inputs)
+        self.assertEqual(self.inputs, original)
+        self.assertEqual(len(recycled), len(self.inputs))
+        for row in recycled:
+            self.assertEqual(len(row), 2*n_bins + 3)
+            energies = np.array(row[:n_bins])
+            rates = np.array(row[n_bins:2*n_bins])
+            kept = int((energies != 0).sum())
+            self.assertTrue(n_bins - 900 <= kept <= n_bins - 250)
+            #The kept bins stay in order, paired with their rates, and the end is zero padded
+            self.assertTrue(np.all(np.diff(energies[:kept]) > 0))
+            np.testing.assert_array_equal(rates[:kept], -energies[:kept])
+            self.assertTrue(np.all(energies[kept:] == 0) and np.all(rates[kept:] == 0))
+            self.assertEqual(row[-3:], [1, 4, 0.5])
+
+    def test_augment(self):
+        output_inputs = os.path.join(self.work_dir, "real_inputs.npy")
+        output_labels = os.path.join(self.work_dir, "real_labels.npy")
+        rows = augment(self.dump("inputs", self.inputs), self.dump("labels", self.labels), output_inputs, output_labels,
+                       recycle_number = 3)
+        self.assertEqual(rows, 12)
+        self.assertEqual(np.load(output_inputs).shape, (12, 2*n_bins + 3))
+        #One copy of the labels per pass, in the order of the recycled rows
+        np.testing.assert_array_equal(np.load(output_labels), np.array(self.labels*3))
+
+    def test_merge(self):
+        output_inputs = os.path.join(self.work_dir, "inputs.npy")
+        output_labels = os.path.join(self.work_dir, "labels.npy")
+        rows = merge([self.dump("inputs1", self.inputs[:1]), self.dump("inputs2", self.inputs[1:])],
+                     [self.dump("labels1", self.labels[:1]), self.dump("labels2", self.labels[1:])],
+                     output_inputs, output_labels)
+        self.assertEqual(rows, 4)
+        np.testing.assert_array_equal(np.load(output_inputs), np.array(self.inputs))
+        np.testing.assert_array_equal(np.load(output_labels), np.array(self.labels))
+
+    def test_merge_exception(self):
+        with self.assertRaises(ValueError) as exception_context:
+            merge(["inputs1"], [], "inputs.npy", "labels.npy")
+        self.assertEqual(str(exception_context.exception), "Need as many label files as input files!")
+        with self.assertRaises(ValueError) as exception_context:
+            merge([self.dump("inputs1", self.inputs)], [self.dump("labels1", self.labels[:2])],
+                  os.path.join(self.work_dir, "inputs.npy"), os.path.join(self.work_dir, "labels.npy"))
+        self.assertEqual(str(exception_context.exception), "Inputs and labels have different lengths!")
@@ -0,0 +1,79 @@
+"""
+Test Class for the hyperparameter search scheduler
+"""
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from src.hyper_search import sample_trials, successive_halving, array_statistics, feature_statistics, \
+    trial_runner, default_hparams
+
+def toy_objective(trial_id, hparams, initial_epoch, epochs):
+    #Smaller learning rates are better and every trial improves with more epochs
+    return hparams["initial_learning_rate"] + 1/epochs
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.space = {"initial_learning_rate": [0.1, 0.01, 0.001, 0.0001], "n_neurons": [512, 1024]}
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_sample_trials_success(self):
+        trials = sample_trials(self.space, 8, seed = 1)
+        self.assertEqual(len(trials), 8)
+        self.assertEqual(len(set((t["initial_learning_rate"], t["n_neurons"]) for t in trials)), 8)
+        self.assertEqual(trials, sample_trials(self.space, 8, seed = 1))
+
+    def test_sample_trials_exception(self):
+        with self.assertRaises(ValueError) as exception_context:
+            sample_trials(self.space, 9)
+        self.assertEqual(str(exception_context.exception), "Search space only contains 8 distinct trials!")
+        with self.assertRaises(ValueError):
+            sample_trials({"n_layers": [9]}, 1)
+
+    def test_successive_halving_success(self):
+        trials = sample_trials(self.space, 8, seed = 1)
+        results_path = os.path.join(self.work_dir, "results.csv")
+        results = successive_halving(trials, toy_objective, min_epochs = 1, max_epochs = 9, eta = 2,
+                                     processes = 1, results_path = results_path)
+        self.assertEqual([r["epochs"] for r in results if r["rung"] == 0], [1]*8)
+        final = [r for r in results if r["epochs"] == 9]
+        self.assertEqual(len(final), 1)
+        self.assertEqual(final[0]["initial_learning_rate"], 0.0001)
+        with open(results_path) as f:
+            self.assertEqual(len(list(csv.DictReader(f))), len(results))
+
+    def test_successive_halving_parallel(self):
+        trials = sample_trials(self.space, 4, seed = 2)
+        serial = successive_halving(trials, toy_objective, min_epochs = 1, max_epochs = 3, eta = 2, processes = 1)
+        parallel = successive_halving(trials, toy_objective, min_epochs = 1, max_epochs = 3, eta = 2, processes = 2)
+        self.assertEqual(serial, parallel)
+
+    def test_feature_statistics(self):
+        inputs = np.random.default_rng(0).random((100, 5))
+        input_path = os.path.join(self.work_dir, "inputs.npy")
+        np.save(input_path, inputs)
+        mean, variance = feature_statistics(input_path, chunk_rows = 30)
+        np.testing.assert_allclose(mean, inputs.mean(axis = 0))
+        np.testing.assert_allclose(variance, inputs.var(axis = 0))
+        np.testing.assert_allclose(array_statistics(inputs)[1], variance)
+
+    def test_trial_runner_resumes_optimizer(self):
+        import tensorflow as tf
+        rng = np.random.default_rng(0)
+        input_path = os.path.join(self.work_dir, "inputs.npy")
+        label_path = os.path.join(self.work_dir, "labels.npy")
+        np.save(input_path, rng.random((80, 5), dtype = np.float32))
+        np.save(label_path, rng.random((80, 6), dtype = np.float32))
+        runner = trial_runner(input_path, label_path, self.work_dir)
+        hparams = dict(default_hparams, n_neurons = 8, h_neurons = 8, h2_neurons = 8, batch_size = 16)
+        for initial_epoch, epochs in [(0, 1), (1, 3)]:
+            self.assertTrue(np.isfinite(runner(0, hparams, initial_epoch, epochs)))
+        #64 training rows in batches of 16 for 3 epochs, counted across both rungs
+        reader = tf.train.load_checkpoint(os.path.join(self.work_dir, "trial0"))
+        iterations = [name for name in reader.get_variable_to_shape_map() if name.startswith("optimizer/iter")]
+        self.assertEqual(int(reader.get_tensor(iterations[0])), 12)
@@ -0,0 +1,80 @@
+"""
+Test Class for the shared memory registry
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import multiprocessing
+import numpy as np
+from src.shared_arrays import shared_registry, attach, detach, cleanup_stale, memory_usage, response, read_rmf, _touch
+
+class TestSharedArrays(unittest.TestCase):
+    def test_publish_and_attach(self):
+        array = np.arange(12, dtype = np.float32).reshape(3, 4)
+        with shared_registry() as registry:
+            registry.publish("statistics", array)
+            attached = attach(registry.manifest_path, "statistics")
+            np.testing.assert_array_equal(attached, array)
+            self.assertFalse(attached.flags.writeable)
+            with self.assertRaises(ValueError) as exception_context:
+                registry.publish("statistics", array)
+            self.assertEqual(str(exception_context.exception), "An array is already published as statistics!")
+            del attached
+            detach()
+        self.assertFalse(os.path.exists(registry.manifest_path))
+        with self.assertRaises(FileNotFoundError):
+            attach(registry.manifest(), "statistics")
+
+    def test_spawned_workers_attach(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "inputs.npy")
+            np.save(path, np.ones((1000, 50)))
+            with shared_registry() as registry:
+                registry.publish_file("inputs", path, chunk_rows = 64)
+                with multiprocessing.get_context("spawn").Pool(2) as pool:
+                    results = pool.map(_touch, [(registry.manifest(), "inputs", None)]*2)
+                #Workers exiting must not have unlinked the segment
+                self.assertEqual(float(attach(registry.manifest(), "inputs").sum()), 50000.0)
+                detach()
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([total for total, usage in results], [50000.0, 50000.0])
+
+    def test_response_from_factors(self):
+        with shared_registry() as registry:
+            registry.publish("rmf/0", np.ones((4, 3), dtype = np.float32))
+            registry.publish("arf/1", np.arange(4, dtype = np.float32))
+            np.testing.assert_array_equal(response(registry.manifest(), 0, 1), np.arange(4)[:, None]*np.ones((4, 3)))
+            detach()
+
+    def test_responses_without_astropy(self):
+        with mock.patch.dict("sys.modules", {"astropy": None, "astropy.io": None}):
+            with self.assertRaises(ImportError) as exception_context:
+                read_rmf("build/rmf_arf/rmfs/missing.rmf")
+        self.assertEqual(str(exception_context.exception), "Reading rmf/arf files needs astropy, install it with pip install astropy!")
+
+    def test_cleanup_stale(self):
+        if not os.path.isdir("/dev/shm"):
+            self.skipTest("Needs /dev/shm")
+        #A process that has exited stands in for a crashed owner
+        process = multiprocessing.get_context("spawn").Process(target = os.getpid)
+        process.start()
+        process.join()
+        from multiprocessing import shared_memory
+        name = "agntest_" + str(process.pid) + "_0"
+        segment = shared_memory.SharedMemory(name = name, create = True, size = 16)
+        segment.close()
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, "shared_memory")
+        self.assertEqual(cleanup_stale("agntest"), [name])
+        self.assertFalse(os.path.exists("/dev/shm/" + name))
+
+    def test_memory_usage(self):
+        if not os.path.exists("/proc/self/smaps_rollup"):
+            self.skipTest("Needs /proc/self/smaps_rollup")
+        usage = memory_usage()
+        self.assertGreater(usage["Rss"], 0)
+        self.assertIn("Pss", usage)
@@ -0,0 +1,84 @@
+"""
+Test Class for the training throughput log
+"""
+import os
+import csv
+import time
+import shutil
+import tempfile
+import unittest
+from src.throughput import step_timer, columns, format_epoch, read_log, summarize
+
+class TestThroughput(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.work_dir, "throughput.csv")
+        self.epochs = [{"epoch": 0, "steps": 100, "samples": 3200, "step_s": 2.0, "input_s": 0.5, "compute_s": 1.5,
+                        "validation_s": 0.25, "samples_per_sec": 1600.0, "input_fraction": 0.25, "peak_rss_mb": 512.5, "minor_faults": 10,
+                        "major_faults": 2, "input_bound": False},
+                       {"epoch": 1, "steps": 100, "samples": 3200, "step_s": 2.0, "input_s": 1.9, "compute_s": 0.1,
+                        "validation_s": 0.25, "samples_per_sec": 1600.0, "input_fraction": 0.95, "peak_rss_mb": 600.0, "minor_faults": 5,
+                        "major_faults": 3, "input_bound": True}]
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def write_log(self, epochs):
+        with open(self.log_path, "w", newline = "") as f:
+            writer = csv.DictWriter(f, fieldnames = columns)
+            writer.writeheader()
+            writer.writerows(epochs)
+
+    def test_step_timer(self):
+        timer = step_timer()
+        for wait, compute in [(0.25, 1.0), (0.5, 0.75), (0.0, 1.25)]:
+            timer.add(wait, compute)
+        self.assertEqual(timer.take(), (0.75, 3.0, 3))
+        self.assertEqual(timer.take(), (0.0, 0.0, 0))
+
+    def test_monitor_separates_input_wait(self):
+        import numpy as np
+        import tensorflow as tf
+        from src.throughput import throughput_monitor
+        #Every batch takes 20 ms to produce and nothing is prefetched, so the steps wait for their input
+        def slow(i):
+            time.sleep(0.02)
+            return np.ones((8, 4), dtype = np.float32), np.zeros((8, 1), dtype = np.float32)
+        dataset = tf.data.Dataset.range(10).map(lambda i: tf.numpy_function(slow, [i], [tf.float32, tf.float32]))
+        dataset = dataset.map(lambda x, y: (tf.ensure_shape(x, [8, 4]), tf.ensure_shape(y, [8, 1])))
+        model = tf.keras.Sequential([tf.keras.layers.Dense(1, input_shape = (4,))])
+        model.compile(optimizer = "adam", loss = "mse")
+        monitor = throughput_monitor(8, log_path = self.log_path, verbose = False)
+        history = model.fit(dataset, epochs = 2, verbose = 0, callbacks = [monitor])
+        self.assertEqual(len(history.history["loss"]), 2)
+        epoch = read_log(self.log_path)[-1]
+        self.assertEqual((epoch["steps"], epoch["samples"]), (10, 80))
+        self.assertGreaterEqual(epoch["input_s"], 0.18)
+        self.assertLessEqual(epoch["input_s"] + epoch["compute_s"], epoch["step_s"])
+        self.assertTrue(epoch["input_bound"])
+
+    def test_read_log(self):
+        self.write_log(self.epochs)
+        self.assertEqual(read_log(self.log_path), self.epochs)
+
+    def test_format_epoch(self):
+        self.assertEqual(format_epoch(self.epochs[0]), "Epoch 0: 1600.0 samples/sec, steps 2.0s, input wait 0.5s, compute 1.5s, "
+                                                       "validation 0.25s, "
+                                                       "peak RSS 512.5 MB, page faults 2 major/10 minor")
+        self.assertTrue(format_epoch(self.epochs[1]).endswith(" [INPUT BOUND]"))
+        #Read back from the csv, input_bound is a string
+        self.assertTrue(format_epoch(dict(self.epochs[1], input_bound = "True")).endswith(" [INPUT BOUND]"))
+
+    def test_summarize(self):
+        self.write_log(self.epochs)
+        self.assertEqual(summarize(self.log_path).split("\n"),
+                         ["2 epochs, 6400 samples, 1600.0 samples/sec",
+                          "steps 4.0s, input wait 2.4s (60.0% of the step time), compute 1.6s, validation 0.5s",
+                          "peak RSS 600.0 MB, major page faults 5",
+                          "Input bound epochs (1): 1"])
+
+    def test_summarize_empty(self):
+        self.write_log([])
+        self.assertEqual(summarize(self.log_path), "No epochs logged in " + self.log_path)
+        self.write_log(self.epochs[:1])
+        self.assertEqual(summarize(self.log_path).split("\n")[-1], "No input bound epochs")
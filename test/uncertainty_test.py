@@ -0,0 +1,24 @@
+"""
+Test Class for the Monte Carlo dropout and ensemble uncertainties
+"""
+import unittest
+import numpy as np
+from src.uncertainty import rows_per_call, summarize
+
+class TestUncertainty(unittest.TestCase):
+    def test_rows_per_call(self):
+        self.assertEqual(rows_per_call(8192, 30), 273)
+        self.assertEqual(rows_per_call(10, 30), 1)
+        with self.assertRaises(ValueError) as exception_context:
+            rows_per_call(0, 30)
+        self.assertEqual(str(exception_context.exception), "micro_batch and draws need to be at least 1!")
+
+    def test_summarize(self):
+        draws = np.random.default_rng(0).normal(size = (40, 5, 6))
+        mean, std, bounds = summarize(draws, (0.1, 0.9))
+        np.testing.assert_allclose(mean, draws.mean(axis = 0))
+        np.testing.assert_allclose(std, draws.std(axis = 0, ddof = 1))
+        self.assertEqual(bounds.shape, (2, 5, 6))
+        self.assertTrue(np.all(bounds[0] <= mean) and np.all(mean <= bounds[1]))
+        #A single deterministic draw has no spread
+        self.assertEqual(summarize(draws[:1])[1].max(), 0)
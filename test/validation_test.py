@@ -0,0 +1,65 @@
+"""
+Test Class for the dataset validation
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from src.validation import validate, row_hashes, find_duplicates, is_valid
+from src.spectra_generator import generator, rmf_list, arf_list
+
+class TestValidation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.gen = generator(rmf_list, arf_list)
+        rng = np.random.default_rng(0)
+        self.inputs = rng.random((300, 1993)) + 0.1
+        self.inputs[:, -3] = rng.integers(0, 2, 300)
+        self.inputs[:, -2] = rng.integers(0, 15, 300)
+        self.inputs[:, -1] = self.gen.exposure_feature(rng.integers(2000, 20001, 300))
+        self.labels = rng.random((300, 6))
+        self.input_path = os.path.join(self.directory, "inputs.npy")
+        self.label_path = os.path.join(self.directory, "labels.npy")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save(self):
+        np.save(self.input_path, self.inputs)
+        np.save(self.label_path, self.labels)
+
+    def test_clean_dataset(self):
+        self.save()
+        self.assertTrue(is_valid(validate(self.input_path, self.label_path, self.gen, processes = 1, chunk_rows = 64)))
+
+    def test_offending_rows(self):
+        self.inputs[3, 10] = np.nan
+        self.labels[5, 2] = 1.5
+        self.inputs[7, -3] = 2
+        self.inputs[8, -2] = -1
+        self.inputs[9, 995:1990] = 0
+        self.inputs[250] = self.inputs[20]
+        self.inputs[251] = self.inputs[20]
+        self.save()
+        report = validate(self.input_path, self.label_path, self.gen, processes = 2, chunk_rows = 64)
+        self.assertEqual(report["nonfinite_inputs"]["rows"], [3])
+        self.assertEqual(report["label_range"]["rows"], [5])
+        self.assertEqual(report["rmf_id"]["rows"], [7])
+        self.assertEqual(report["arf_id"]["rows"], [8])
+        self.assertEqual(report["zero_rates"]["rows"], [9])
+        self.assertEqual(report["duplicates"], {"count": 2, "rows": [250, 251]})
+        self.assertEqual(report["exposure"]["count"], 0)
+
+    def test_shape_errors(self):
+        self.labels = self.labels[:, :5]
+        self.save()
+        report = validate(self.input_path, self.label_path, self.gen, processes = 1)
+        self.assertEqual(report["errors"], ["labels have shape (300, 5), expected (N, 6)"])
+
+    def test_hash_collisions_are_confirmed(self):
+        #Rows forced into the same hash bucket are only reported if they are equal
+        hashes = np.zeros((3, 2), dtype = np.uint64)
+        rows = np.array([[1.0, 2.0], [1.0, 3.0], [1.0, 2.0]])
+        np.testing.assert_array_equal(find_duplicates(hashes, rows), [2])
+        self.assertFalse((row_hashes(rows)[0] == row_hashes(rows)[1]).all())